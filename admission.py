@@ -0,0 +1,289 @@
+# coding: utf-8
+"""
+/api/scrape の受け付け制御
+
+ジョブごとに Chromium を起動するため、同時に処理するジョブ数を制限する。
+
+- 同時に処理するジョブは SCRAPE_MAX_CONCURRENT 件まで。空きがなければ待機列で順番を待つ
+- 待機列が SCRAPE_MAX_QUEUE 件で埋まっている場合は、待たせずに 429 を返す
+- 1つのクライアント（接続元IP）が処理中・待機中に持てるURLは合計 SCRAPE_MAX_CLIENT_URLS 件まで
+- 待機列で SCRAPE_QUEUE_TIMEOUT 秒待っても順番が来なければ 429 を返す
+
+429 の Retry-After は、最近のジョブの所要時間と待機列の長さから見積もる。
+
+待機列の順番（スケジューリング）:
+
+- 小さなジョブ（URLが SCRAPE_SMALL_JOB_URLS 件以下）と、画面（index.html）から送られた
+  SCRAPE_INTERACTIVE_MAX_URLS 件以下のジョブは interactive、それ以外は batch とする。
+  画面からのジョブかはサーバー側で判定し（app.py）、小さなジョブより大きいものを interactive にするのは
+  1クライアントにつき同時に1件まで（2件目以降は batch）
+- interactive は batch より先に始める。同時処理数のうち SCRAPE_INTERACTIVE_SLOTS 件は
+  interactive 専用に空けておく（batch が同時処理数を使い切らない）
+- 同じ優先度では、処理済みのURLが少ないクライアントを先にする（クライアントごとの公平な配分）
+- batch のジョブはURLを1件処理するたびに checkpoint() を呼ぶ。interactive のジョブが待っている場合、
+  または SCRAPE_BATCH_QUANTUM 秒以上続けて処理していて、処理済みのURLが少ない別のクライアントが
+  待っている場合は、ブラウザを閉じて枠を譲り、待機列に戻る（残りのURLは順番が来てから続ける）
+"""
+import logging
+import math
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_CONCURRENT = 2
+DEFAULT_MAX_QUEUE = 10
+DEFAULT_MAX_CLIENT_URLS = 100
+DEFAULT_QUEUE_TIMEOUT = 600
+DEFAULT_SMALL_JOB_URLS = 3
+DEFAULT_INTERACTIVE_MAX_URLS = 20
+DEFAULT_INTERACTIVE_SLOTS = 1
+DEFAULT_BATCH_QUANTUM = 120
+
+PRIORITY_INTERACTIVE = "interactive"
+PRIORITY_BATCH = "batch"
+
+# ジョブの所要時間の初期値（実績がないときの Retry-After の見積もり用、秒）
+INITIAL_JOB_SECONDS = 60.0
+# 所要時間の移動平均で直近のジョブに掛ける重み
+JOB_SECONDS_WEIGHT = 0.2
+
+
+def _env_number(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        logger.warning("Ignoring invalid %s=%r", name, os.environ.get(name))
+        return default
+
+
+class AdmissionRejected(Exception):
+    """混雑のためジョブを受け付けない（429 で返す）"""
+
+    def __init__(self, message: str, reason: str, retry_after: int):
+        super().__init__(message)
+        self.reason = reason            # "queue_full" / "client_limit" / "timeout"
+        self.retry_after = retry_after  # 再送までの目安（秒）
+
+
+class Ticket:
+    """受け付けたジョブ1件（待機中・処理中）"""
+
+    def __init__(self, client: str, url_count: int, priority: str):
+        self.client = client
+        self.url_count = url_count      # 残りのURL数（checkpoint() で減る）
+        self.priority = priority
+        self.enqueued_at = time.time()
+        self.started_at: Optional[float] = None  # 最後に処理を始めた（再開した）時刻
+        self.yields = 0
+        self.from_ui = False            # 画面からのジョブとして interactive になった
+
+    @property
+    def interactive(self) -> bool:
+        return self.priority == PRIORITY_INTERACTIVE
+
+
+class AdmissionController:
+    """
+    同時処理数・待機列・クライアントごとのURL数の制限
+
+    acquire() は順番が来るまで呼び出し元のスレッドを待たせ、処理が終わったら release() を呼ぶ。
+    """
+
+    def __init__(self, max_concurrent: Optional[int] = None, max_queue: Optional[int] = None,
+                 max_client_urls: Optional[int] = None, queue_timeout: Optional[float] = None,
+                 small_job_urls: Optional[int] = None, interactive_max_urls: Optional[int] = None,
+                 interactive_slots: Optional[int] = None, batch_quantum: Optional[float] = None):
+        """
+        Args:
+            max_concurrent: 同時に処理するジョブ数（省略時は環境変数 SCRAPE_MAX_CONCURRENT）
+            max_queue: 待機列の長さ（省略時は環境変数 SCRAPE_MAX_QUEUE）
+            max_client_urls: 1クライアントの処理中・待機中のURL数の上限（省略時は環境変数 SCRAPE_MAX_CLIENT_URLS）
+            queue_timeout: 待機列で待つ最長時間（省略時は環境変数 SCRAPE_QUEUE_TIMEOUT）
+            small_job_urls: このURL数以下のジョブは interactive（省略時は環境変数 SCRAPE_SMALL_JOB_URLS）
+            interactive_max_urls: 画面から送られたジョブを interactive とする最大URL数
+                                  （省略時は環境変数 SCRAPE_INTERACTIVE_MAX_URLS）
+            interactive_slots: interactive 専用に空けておく枠（省略時は環境変数 SCRAPE_INTERACTIVE_SLOTS）
+            batch_quantum: batch のジョブが別のクライアントに譲るまで続けて処理する時間
+                           （省略時は環境変数 SCRAPE_BATCH_QUANTUM）
+        """
+        if max_concurrent is None:
+            max_concurrent = int(_env_number("SCRAPE_MAX_CONCURRENT", DEFAULT_MAX_CONCURRENT))
+        if max_queue is None:
+            max_queue = int(_env_number("SCRAPE_MAX_QUEUE", DEFAULT_MAX_QUEUE))
+        if max_client_urls is None:
+            max_client_urls = int(_env_number("SCRAPE_MAX_CLIENT_URLS", DEFAULT_MAX_CLIENT_URLS))
+        if queue_timeout is None:
+            queue_timeout = _env_number("SCRAPE_QUEUE_TIMEOUT", DEFAULT_QUEUE_TIMEOUT)
+        if small_job_urls is None:
+            small_job_urls = int(_env_number("SCRAPE_SMALL_JOB_URLS", DEFAULT_SMALL_JOB_URLS))
+        if interactive_max_urls is None:
+            interactive_max_urls = int(_env_number("SCRAPE_INTERACTIVE_MAX_URLS", DEFAULT_INTERACTIVE_MAX_URLS))
+        if interactive_slots is None:
+            interactive_slots = int(_env_number("SCRAPE_INTERACTIVE_SLOTS", DEFAULT_INTERACTIVE_SLOTS))
+        if batch_quantum is None:
+            batch_quantum = _env_number("SCRAPE_BATCH_QUANTUM", DEFAULT_BATCH_QUANTUM)
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queue = max(0, max_queue)
+        self.max_client_urls = max(1, max_client_urls)
+        self.queue_timeout = queue_timeout
+        self.small_job_urls = small_job_urls
+        self.interactive_max_urls = interactive_max_urls
+        # batch が同時に使える枠（少なくとも1つは使える）
+        self.batch_slots = max(1, self.max_concurrent - max(0, interactive_slots))
+        self.batch_quantum = batch_quantum
+        self._cond = threading.Condition()
+        self._waiting: List[Ticket] = []
+        self._active: List[Ticket] = []
+        self._client_urls: Dict[str, int] = {}
+        # クライアントごとの処理済みURL数（待機中・処理中のジョブがなくなったら消す）
+        self._client_served: Dict[str, int] = {}
+        self._job_seconds = INITIAL_JOB_SECONDS
+
+    def queue_depth(self) -> int:
+        with self._cond:
+            return len(self._waiting)
+
+    def active_count(self) -> int:
+        with self._cond:
+            return len(self._active)
+
+    def retry_after(self) -> int:
+        """今から送り直した場合に待機列が空くまでの目安（秒）"""
+        with self._cond:
+            return self._estimate_wait(len(self._waiting) + 1)
+
+    def _estimate_wait(self, jobs_ahead: int) -> int:
+        seconds = self._job_seconds * jobs_ahead / self.max_concurrent
+        return int(min(3600, max(1, math.ceil(seconds))))
+
+    def classify(self, url_count: int, interactive: bool = False) -> str:
+        """ジョブの優先度（interactive: 画面から送られたジョブ）"""
+        if url_count <= self.small_job_urls or (interactive and url_count <= self.interactive_max_urls):
+            return PRIORITY_INTERACTIVE
+        return PRIORITY_BATCH
+
+    def _has_ui_ticket(self, client: str) -> bool:
+        """client が画面からのジョブとして interactive にしたジョブを処理中・待機中か"""
+        return any(t.from_ui and t.client == client for t in self._active + self._waiting)
+
+    def _rank(self, ticket: Ticket) -> tuple:
+        # interactive が先、同じ優先度では処理済みのURLが少ないクライアントが先、最後に到着順
+        return (0 if ticket.interactive else 1, self._client_served.get(ticket.client, 0), ticket.enqueued_at)
+
+    def _next_ticket(self) -> Optional[Ticket]:
+        """次に処理を始めるジョブ"""
+        return min(self._waiting, key=self._rank) if self._waiting else None
+
+    def _can_start(self, ticket: Ticket) -> bool:
+        if len(self._active) >= self.max_concurrent:
+            return False
+        return ticket.interactive or sum(not t.interactive for t in self._active) < self.batch_slots
+
+    def _wait_for_turn(self, ticket: Ticket, deadline: Optional[float]) -> bool:
+        """ticket の順番が来るまで待つ（deadline を過ぎたら False）"""
+        while self._next_ticket() is not ticket or not self._can_start(ticket):
+            remaining = None if deadline is None else deadline - time.time()
+            if remaining is not None and remaining <= 0:
+                return False
+            self._cond.wait(timeout=remaining)
+        self._waiting.remove(ticket)
+        self._active.append(ticket)
+        ticket.started_at = time.time()
+        # 同時処理数に空きが残っていれば次のジョブも始める
+        self._cond.notify_all()
+        return True
+
+    def acquire(self, client: str, url_count: int, interactive: bool = False) -> Ticket:
+        """
+        ジョブの処理を始められるまで待つ
+
+        Args:
+            client: クライアントの識別子
+            url_count: ジョブのURL数
+            interactive: 画面から送られたジョブか（優先度の判定に使う。同じクライアントの
+                画面からのジョブが処理中・待機中の場合は無視する）
+
+        Raises:
+            AdmissionRejected: 待機列が満杯・クライアントのURL数が上限・待ち時間切れ
+        """
+        with self._cond:
+            if self._client_urls.get(client, 0) + url_count > self.max_client_urls:
+                raise AdmissionRejected(
+                    f"処理中・待機中のURLが多すぎます（1クライアントあたり{self.max_client_urls}件まで）",
+                    "client_limit", self._estimate_wait(len(self._waiting) + 1))
+            if interactive and self._has_ui_ticket(client):
+                interactive = False
+            ticket = Ticket(client, url_count, self.classify(url_count, interactive))
+            ticket.from_ui = ticket.interactive and url_count > self.small_job_urls
+            # checkpoint() で枠を譲ったジョブは待機列の長さに数えない
+            waiting_new = sum(t.yields == 0 for t in self._waiting)
+            if not self._can_start(ticket) and waiting_new >= self.max_queue:
+                raise AdmissionRejected("サーバーが混雑しています", "queue_full",
+                                        self._estimate_wait(len(self._waiting) + 1))
+
+            self._waiting.append(ticket)
+            self._client_urls[client] = self._client_urls.get(client, 0) + url_count
+            if not self._wait_for_turn(ticket, ticket.enqueued_at + self.queue_timeout):
+                self._waiting.remove(ticket)
+                self._forget(ticket)
+                self._cond.notify_all()
+                raise AdmissionRejected("待ち時間が長すぎるため処理を中止しました", "timeout",
+                                        self._estimate_wait(len(self._waiting) + 1))
+        if ticket.started_at - ticket.enqueued_at > 1:
+            logger.info("%s job from %s started after waiting %.1fs",
+                        ticket.priority, client, ticket.started_at - ticket.enqueued_at)
+        return ticket
+
+    def checkpoint(self, ticket: Ticket) -> bool:
+        """
+        URLを1件処理し終えたことを記録し、枠を譲るべきかを返す
+
+        True の場合、呼び出し元はブラウザを閉じてから requeue() を呼ぶ。
+        """
+        with self._cond:
+            ticket.url_count -= 1
+            self._client_urls[ticket.client] -= 1
+            self._client_served[ticket.client] = self._client_served.get(ticket.client, 0) + 1
+            if ticket.interactive or ticket.url_count <= 0:
+                return False
+            waiting = self._next_ticket()
+            if waiting is None or waiting.client == ticket.client:
+                return False
+            if self._can_start(waiting):
+                # 空いている枠で始められる
+                return False
+            if waiting.interactive:
+                return True
+            return (time.time() - ticket.started_at >= self.batch_quantum
+                    and self._rank(waiting) < self._rank(ticket))
+
+    def requeue(self, ticket: Ticket) -> None:
+        """枠を譲って待機列に戻り、順番が来たら戻る（待ち時間の上限はない）"""
+        with self._cond:
+            self._active.remove(ticket)
+            ticket.yields += 1
+            self._waiting.append(ticket)
+            self._cond.notify_all()
+            logger.info("Batch job from %s yielded its slot (%d URL(s) left)", ticket.client, ticket.url_count)
+            self._wait_for_turn(ticket, None)
+
+    def release(self, ticket: Ticket) -> None:
+        """ジョブの処理が終わった（成功・失敗とも）"""
+        with self._cond:
+            self._active.remove(ticket)
+            self._forget(ticket)
+            elapsed = time.time() - (ticket.started_at or ticket.enqueued_at)
+            self._job_seconds += JOB_SECONDS_WEIGHT * (elapsed - self._job_seconds)
+            self._cond.notify_all()
+
+    def _forget(self, ticket: Ticket) -> None:
+        """待機列・処理中から外したジョブの残りのURLを、クライアントの合計から除く"""
+        if any(t.client == ticket.client for t in self._active + self._waiting if t is not ticket):
+            # 同じクライアントのジョブが残っている（処理済みの分は checkpoint() で除いてある）
+            self._client_urls[ticket.client] = max(0, self._client_urls.get(ticket.client, 0) - ticket.url_count)
+        else:
+            self._client_urls.pop(ticket.client, None)
+            self._client_served.pop(ticket.client, None)
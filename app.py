@@ -3,92 +3,205 @@
 画像一括取得システム - Webアプリ版
 Flask APIサーバー
 """
-from flask import Flask, request, send_file, jsonify, send_from_directory
+from flask import Flask, Response, request, send_file, jsonify, send_from_directory
 from flask_cors import CORS
-import tempfile
+import logging
 import zipfile
 import os
-import shutil
 import time
 import threading
+import uuid
 from pathlib import Path
-from playwright.sync_api import sync_playwright
+from urllib.parse import urlparse
 
-# 既存の関数をインポート（同じディレクトリにあることを前提）
-from 画像一括取得 import scrape_single_url_js
+# Playwright と 画像一括取得（BeautifulSoup・requests を含む）は最初のジョブで読み込む。
+# サーバーの起動（ポートの待ち受け開始）を遅らせないため
+from profiling import profile_url
+from scrape_logging import configure_logging, log_context
+from scrape_metrics import UrlMetrics, write_metrics_log
+import prometheus_metrics as prom
+from browser_contexts import HostContextPool
+from job_queue import DEFAULT_DB_PATH, DEFAULT_MAX_ATTEMPTS, JobQueue
+from output_sinks import ZipBundleSink
+from page_parser import auto_parse_workers, set_parse_workers
+from result_store import ResultStore
+from admission import AdmissionController, AdmissionRejected
+from url_canonical import group_unique_urls
+
+configure_logging()
+logger = logging.getLogger("app")
 
 app = Flask(__name__)
 CORS(app, expose_headers=['X-Success-URLs', 'X-Failed-URLs'])
 
-# 一時ファイルのクリーンアップ用
-temp_files_to_cleanup = []
+# ジョブキュー（最初の /api/jobs で開く。パスは環境変数 JOB_QUEUE_DB）
+_job_queue = None
+_job_queue_lock = threading.Lock()
 
-def cleanup_temp_files():
-    """古い一時ファイルを削除（5分経過後）"""
-    while True:
-        time.sleep(60)  # 1分ごとにチェック
-        now = time.time()
-        for temp_dir, created_at in list(temp_files_to_cleanup):
-            if now - created_at > 300:  # 5分経過したら削除
-                try:
-                    if os.path.exists(temp_dir):
-                        shutil.rmtree(temp_dir)
-                    temp_files_to_cleanup.remove((temp_dir, created_at))
-                except:
-                    pass
+def get_job_queue():
+    global _job_queue
+    with _job_queue_lock:
+        if _job_queue is None:
+            _job_queue = JobQueue(os.environ.get('JOB_QUEUE_DB', DEFAULT_DB_PATH))
+        return _job_queue
+
+# 返却するZIPの保管（上限・期限は result_store.py。サーバー起動時に前回の残りを消す）
+_result_store = None
+_result_store_lock = threading.Lock()
+
+def _record_eviction(reason, size):
+    prom.RESULT_STORE_EVICTIONS.inc(reason=reason)
+    prom.RESULT_STORE_EVICTED_BYTES.inc(size, reason=reason)
+
+def get_result_store():
+    global _result_store
+    with _result_store_lock:
+        if _result_store is None:
+            _result_store = ResultStore(on_evict=_record_eviction)
+        return _result_store
 
-# バックグラウンドでクリーンアップスレッドを起動
-cleanup_thread = threading.Thread(target=cleanup_temp_files, daemon=True)
-cleanup_thread.start()
+# 結果のディスク使用量は /metrics 取得時にだけ計算する
+prom.TEMP_DISK_BYTES.set_function(lambda: get_result_store().bytes_held())
+
+# 同時に処理するジョブ数・待機列の制限（上限は admission.py の環境変数）
+admission = AdmissionController()
+prom.QUEUE_DEPTH.set_function(admission.queue_depth)
+
+# 複数のジョブを同時に処理する場合は、解析を別プロセスで行う（PARSE_WORKERS を指定した場合はそれに従う）
+if 'PARSE_WORKERS' not in os.environ and admission.max_concurrent > 1:
+    set_parse_workers(min(admission.max_concurrent, auto_parse_workers()))
+
+def client_key():
+    """クライアントごとの制限に使う識別子（接続元IP）"""
+    return request.remote_addr or 'unknown'
+
+def from_ui():
+    """
+    画面（このサーバーが配信した index.html）から送られたリクエストか
+
+    クライアントが送るオプションでは判定しない。ブラウザが付ける Sec-Fetch-Site（なければ Origin）が
+    このサーバーと同じオリジンの場合のみ True（優先度の上限は admission.py で1クライアント1件に制限する）。
+    """
+    site = request.headers.get('Sec-Fetch-Site')
+    if site is not None:
+        return site == 'same-origin'
+    origin = request.headers.get('Origin')
+    return bool(origin) and urlparse(origin).netloc == request.host
+
+def validate_urls(urls):
+    """
+    URLの検証（空行・コメント行を除き、スキームがなければ https:// を補う。正規化して重複を除く）
+
+    Returns:
+        正規化したURL → そのURLにまとめた入力（送られた文字列のまま）の辞書（入力順）
+    """
+    validated_urls = []
+    for source in urls:
+        url = source.strip()
+        if url and not url.startswith('#'):
+            if url.startswith('http://') or url.startswith('https://'):
+                validated_urls.append((url, source))
+            else:
+                # http://を自動追加（オプション）
+                validated_urls.append(('https://' + url, source))
+    return group_unique_urls(validated_urls)
+
+def input_urls(validated_urls, urls):
+    """正規化したURLのリストを、画面で照合できるよう送られたURLに戻す"""
+    return [source for url in urls for source in validated_urls.get(url, [url])]
 
 @app.route('/api/scrape', methods=['POST'])
 def scrape():
     """
     URLリストを受け取り、画像取得処理を実行してZIPファイルを返す
+
+    同時に処理できるジョブ数を超える場合は待機列で順番を待ち、待機列が満杯なら 429 を返す。
+    小さなジョブ・画面からのジョブ（from_ui()）は大きなジョブより先に処理する（admission.py）。
     """
+    ticket = None
     try:
         data = request.get_json()
         urls = data.get('urls', [])
+        # リクエストごとのオプション（省略時は既定値）
+        options = data.get('options') or {}
+        capture_twitter = bool(options.get('capture_twitter', True))
+        make_thumbnails = bool(options.get('thumbnails', False))
+        convert_webp = bool(options.get('webp', False))
+        profile = bool(options.get('profile', False))
         
         if not urls:
             return jsonify({'error': 'URLが指定されていません'}), 400
         
-        # URLの検証
-        validated_urls = []
-        for url in urls:
-            url = url.strip()
-            if url and not url.startswith('#'):
-                if url.startswith('http://') or url.startswith('https://'):
-                    validated_urls.append(url)
-                else:
-                    # http://を自動追加（オプション）
-                    validated_urls.append('https://' + url)
-        
+        validated_urls = validate_urls(urls)
         if not validated_urls:
             return jsonify({'error': '有効なURLがありません'}), 400
-        
-        # 一時ディレクトリを作成
-        temp_dir = tempfile.mkdtemp()
-        result_root = os.path.join(temp_dir, 'result_js')
-        os.makedirs(result_root, exist_ok=True)
+        if len(validated_urls) > admission.max_client_urls:
+            return jsonify({'error': f'URLが多すぎます（1回あたり{admission.max_client_urls}件まで。'
+                                     f'多い場合は /api/jobs を使ってください）'}), 400
+
+        # 順番が来るまで待つ
+        ticket = admission.acquire(client_key(), len(validated_urls), interactive=from_ui())
+        prom.QUEUE_WAIT_SECONDS.observe(ticket.started_at - ticket.enqueued_at, priority=ticket.priority)
+
+        # ジョブのフォルダを作成（以降で失敗した場合は except でフォルダを削除し、finally でゲージを戻す）
+        store = get_result_store()
+        temp_dir = store.create()
+        job_started_at = time.time()
+        job_id = uuid.uuid4().hex[:8]  # ログをジョブごとに分けるためのID
+        sink = None
         
         # 成功/失敗を記録
         success_urls = []
         failed_urls = []
+        url_metrics = []
 
+        prom.JOBS_IN_PROGRESS.inc()
         try:
-            # Playwrightで画像取得処理を実行
+            result_root = os.path.join(temp_dir, 'result_js')
+            os.makedirs(result_root, exist_ok=True)
+            # 画像・posts.txt は返却用のZIPに直接書き込む（result_root には要約・メトリクスなどだけが残る）
+            zip_path = os.path.join(temp_dir, 'result.zip')
+            sink = ZipBundleSink(zip_path)
+
+            from playwright.sync_api import sync_playwright
+            # 既存の関数をインポート（同じディレクトリにあることを前提）
+            from 画像一括取得 import scrape_single_url_js
+
+            # Playwrightで画像取得処理を実行（同じホストのURLはコンテキストを使い回す）
             with sync_playwright() as p:
-                browser = p.chromium.launch(headless=True)
+                browser = HostContextPool(p.chromium)
+                prom.BROWSERS_ACTIVE.inc()
                 for url in validated_urls:
+                    metrics = UrlMetrics(url)
+                    url_metrics.append(metrics)
                     try:
-                        scrape_single_url_js(url, result_root, browser)
+                        with log_context(url=url, job=job_id), profile_url(profile, metrics, result_root):
+                            scrape_single_url_js(
+                                url, result_root, browser,
+                                capture_twitter=capture_twitter,
+                                make_thumbnails=make_thumbnails,
+                                convert_webp=convert_webp,
+                                metrics=metrics,
+                                sink=sink,
+                            )
                         success_urls.append(url)
                     except Exception as e:
-                        print(f"Error processing {url}: {e}")
+                        with log_context(url=url, job=job_id):
+                            logger.exception("Error processing %s", url)
+                        metrics.finish("error", str(e))
                         failed_urls.append({'url': url, 'error': str(e)})
                         continue
+                    finally:
+                        prom.record_url(metrics)
+                        # 優先するジョブが待っていれば、ブラウザを閉じて枠を譲る（次のURLで起動し直す）
+                        if admission.checkpoint(ticket):
+                            browser.close()
+                            prom.BROWSERS_ACTIVE.dec()
+                            prom.JOB_YIELDS.inc()
+                            admission.requeue(ticket)
+                            prom.BROWSERS_ACTIVE.inc()
                 browser.close()
+                prom.BROWSERS_ACTIVE.dec()
 
             # 結果サマリーファイルを作成
             summary_path = os.path.join(result_root, '_result_summary.txt')
@@ -122,18 +235,16 @@ def scrape():
                     f.write("Claude Codeで '/analyze-failed-url' Skillを使用して\n")
                     f.write("URL構造を分析できます。\n")
 
-            # 結果をZIP化
-            zip_path = os.path.join(temp_dir, 'result.zip')
-            with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                for root, dirs, files in os.walk(result_root):
-                    for file in files:
-                        file_path = os.path.join(root, file)
-                        # 相対パスでZIPに追加
-                        arcname = os.path.relpath(file_path, result_root)
-                        zipf.write(file_path, arcname)
+            # 段階ごとの所要時間などをJSONで記録
+            write_metrics_log(os.path.join(result_root, '_metrics.json'), url_metrics)
+
+            # 要約・メトリクス（とプロファイル）をZIPに追加して閉じる
+            sink.add_tree(result_root)
+            sink.close()
             
-            # クリーンアップリストに追加（5分後に削除）
-            temp_files_to_cleanup.append((temp_dir, time.time()))
+            # 保管に移す（期限切れ・上限超過で消える）
+            store.finish(temp_dir)
+            prom.JOBS_TOTAL.inc(status='ok')
 
             # ZIPファイルを返す（成功/失敗情報をヘッダーに含める）
             import json
@@ -144,21 +255,122 @@ def scrape():
                 download_name='result.zip'
             )
             # 成功したURLリストをヘッダーに追加
-            response.headers['X-Success-URLs'] = json.dumps(success_urls)
+            # （正規化前の、送られたURLのまま。重複としてまとめたURLも含む）
+            response.headers['X-Success-URLs'] = json.dumps(input_urls(validated_urls, success_urls))
             # 失敗したURLリストをヘッダーに追加（URLのみ）
-            response.headers['X-Failed-URLs'] = json.dumps([item['url'] for item in failed_urls])
+            response.headers['X-Failed-URLs'] = json.dumps(
+                input_urls(validated_urls, [item['url'] for item in failed_urls]))
             return response
             
         except Exception as e:
             # エラー時は即座に削除
-            try:
-                shutil.rmtree(temp_dir)
-            except:
-                pass
+            if sink is not None:
+                try:
+                    sink.close()
+                except Exception:
+                    pass
+            store.discard(temp_dir)
+            prom.JOBS_TOTAL.inc(status='error')
             raise
+        finally:
+            prom.JOBS_IN_PROGRESS.dec()
+            prom.JOB_DURATION.observe(time.time() - job_started_at)
             
+    except AdmissionRejected as e:
+        logger.warning("Rejected /api/scrape from %s (%s)", client_key(), e.reason)
+        prom.ADMISSION_REJECTED.inc(reason=e.reason)
+        response = jsonify({'error': f'{e}。{e.retry_after}秒ほど後にもう一度お試しください',
+                            'retry_after': e.retry_after})
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response, 429
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+    finally:
+        if ticket is not None:
+            admission.release(ticket)
+
+@app.route('/api/jobs', methods=['POST'])
+def enqueue_jobs():
+    """
+    URLリストをジョブキューに登録する（処理はワーカー: 画像一括取得.py --worker が行う）
+    """
+    data = request.get_json() or {}
+    urls = data.get('urls', [])
+    if not urls:
+        return jsonify({'error': 'URLが指定されていません'}), 400
+    validated_urls = validate_urls(urls)
+    if not validated_urls:
+        return jsonify({'error': '有効なURLがありません'}), 400
+    options = data.get('options') or {}
+    max_attempts = int(data.get('max_attempts', DEFAULT_MAX_ATTEMPTS))
+    batch = get_job_queue().enqueue(list(validated_urls), options=options, max_attempts=max_attempts)
+    logger.info("Enqueued %d URL(s) as batch %s", len(validated_urls), batch)
+    # 状態・ダウンロードは正規化したURLで返すため、送られたURLとの対応を返す
+    urls_by_input = {source: url for url, sources in validated_urls.items() for source in sources}
+    return jsonify({'batch': batch, 'jobs': len(validated_urls), 'urls': urls_by_input,
+                    'status_url': f'/api/jobs/{batch}'}), 202
+
+@app.route('/api/jobs/<batch>')
+def job_status(batch):
+    """登録したジョブの状態と結果"""
+    queue = get_job_queue()
+    jobs = queue.jobs(batch)
+    if not jobs:
+        return jsonify({'error': 'ジョブが見つかりません'}), 404
+    counts = queue.counts(batch)
+    return jsonify({
+        'batch': batch,
+        'counts': counts,
+        'finished': counts['queued'] == 0 and counts['running'] == 0,
+        'jobs': [job.to_dict() for job in jobs],
+    })
+
+@app.route('/api/jobs/<batch>/download')
+def job_download(batch):
+    """
+    完了したジョブの結果フォルダをZIPで返す
+
+    このサーバーから参照できるフォルダ（同じホスト、または共有ディスク上）だけを含める。
+    """
+    jobs = get_job_queue().jobs(batch)
+    if not jobs:
+        return jsonify({'error': 'ジョブが見つかりません'}), 404
+    folders = [(job.url, (job.result or {}).get('folder')) for job in jobs if job.state == 'done']
+    # フォルダ（--sink dir）とスレッドごとのアーカイブ（--sink zip / tar）を含める
+    folders = [(url, folder) for url, folder in folders if folder and os.path.exists(folder)]
+    if not folders:
+        return jsonify({'error': 'このサーバーから参照できる結果がありません'}), 404
+
+    store = get_result_store()
+    temp_dir = store.create()
+    zip_path = os.path.join(temp_dir, 'result.zip')
+    try:
+        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
+            for _, folder in folders:
+                parent = os.path.dirname(folder)
+                if os.path.isfile(folder):
+                    zipf.write(folder, os.path.basename(folder))
+                    continue
+                for root, dirs, files in os.walk(folder):
+                    for file in files:
+                        file_path = os.path.join(root, file)
+                        zipf.write(file_path, os.path.relpath(file_path, parent))
+    except BaseException:
+        store.discard(temp_dir)
+        raise
+    store.finish(temp_dir)
+
+    import json
+    response = send_file(zip_path, mimetype='application/zip', as_attachment=True,
+                         download_name=f'result_{batch}.zip')
+    response.headers['X-Success-URLs'] = json.dumps([url for url, _ in folders])
+    response.headers['X-Failed-URLs'] = json.dumps([job.url for job in jobs if job.state == 'failed'])
+    return response
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus 形式の運用メトリクス"""
+    return Response(prom.REGISTRY.render(), content_type=prom.CONTENT_TYPE)
 
 @app.route('/')
 def index():
@@ -166,9 +378,11 @@ def index():
     import os
     file_path = os.path.abspath('index.html')
     file_size = os.path.getsize(file_path)
-    print(f"[INFO] Serving index.html from: {file_path}")
-    print(f"[INFO] File size: {file_size} bytes")
+    logger.info("Serving index.html from: %s", file_path)
+    logger.info("File size: %d bytes", file_size)
     return send_from_directory('.', 'index.html')
 
 if __name__ == '__main__':
+    # 前回の起動で残った結果を先に消しておく
+    get_result_store()
     app.run(host='0.0.0.0', port=5000, debug=False)
@@ -0,0 +1,6 @@
+# benchmarks パッケージ
+"""
+性能計測用のスクリプトとフィクスチャ
+
+リポジトリのルートから python -m benchmarks.<モジュール名> で実行する。
+"""
@@ -0,0 +1,182 @@
+# coding: utf-8
+"""
+擬似まとめサイトを相手にしたエンドツーエンドのスループット計測
+
+benchmarks/fake_site.py のサーバーを起動し、実際の Playwright（Chromium）で
+scrape_single_url_js と main() を実行して次の値を出力する。
+
+- URLs/min、images/sec、ダウンロード量（MB/s）
+- Pythonプロセスと（psutil があれば）Chromium を含むプロセスツリーのピークRSS
+
+使い方（リポジトリのルートで実行。playwright install chromium が必要）:
+    python -m benchmarks.bench_e2e
+    python -m benchmarks.bench_e2e --urls 10 --posts 300 --images 2 --mode scrape
+    python -m benchmarks.bench_e2e --json e2e_result.json
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional
+
+from benchmarks.fake_site import THREAD_DEFAULTS, FakeMatomeSite
+from memory_usage import current_rss_bytes
+
+
+class RssSampler:
+    """バックグラウンドで一定間隔ごとにRSSを記録し、ピーク値を保持する"""
+
+    def __init__(self, interval: float = 0.25):
+        self.interval = interval
+        self.peak_self: Optional[int] = None
+        self.peak_tree: Optional[int] = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        try:
+            import psutil
+            self._process = psutil.Process()
+        except ImportError:
+            self._process = None
+
+    def _tree_rss(self) -> Optional[int]:
+        if self._process is None:
+            return None
+        total = 0
+        for proc in [self._process] + self._process.children(recursive=True):
+            try:
+                total += proc.memory_info().rss
+            except Exception:
+                continue
+        return total
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self.sample()
+            self._stop.wait(self.interval)
+
+    def sample(self) -> None:
+        rss = current_rss_bytes()
+        if rss is not None and (self.peak_self is None or rss > self.peak_self):
+            self.peak_self = rss
+        tree = self._tree_rss()
+        if tree is not None and (self.peak_tree is None or tree > self.peak_tree):
+            self.peak_tree = tree
+
+    def __enter__(self) -> "RssSampler":
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.sample()
+
+
+def _report(mode: str, urls: int, seconds: float, records: List[Dict], sampler: RssSampler) -> Dict:
+    images = sum(r.get("images_downloaded", 0) for r in records)
+    nbytes = sum(r.get("bytes_downloaded", 0) for r in records)
+    return {
+        "mode": mode,
+        "urls": urls,
+        "ok": sum(1 for r in records if r.get("status") == "ok"),
+        "seconds": round(seconds, 2),
+        "urls_per_min": round(urls / seconds * 60, 2) if seconds else None,
+        "images": images,
+        "images_per_sec": round(images / seconds, 2) if seconds else None,
+        "mb_per_sec": round(nbytes / 1048576 / seconds, 2) if seconds else None,
+        "images_failed": sum(r.get("images_failed", 0) for r in records),
+        "peak_rss_mb": round(sampler.peak_self / 1048576, 1) if sampler.peak_self else None,
+        "peak_rss_tree_mb": round(sampler.peak_tree / 1048576, 1) if sampler.peak_tree else None,
+    }
+
+
+def bench_scrape(scraper, thread_urls: List[str], result_root: str) -> Dict:
+    """1つのブラウザで scrape_single_url_js を順に呼ぶ"""
+    from playwright.sync_api import sync_playwright
+    from scrape_metrics import UrlMetrics
+
+    records = []
+    with RssSampler() as sampler:
+        start = time.perf_counter()
+        with sync_playwright() as p:
+            browser = p.chromium.launch(headless=True)
+            for url in thread_urls:
+                metrics = UrlMetrics(url)
+                try:
+                    scraper.scrape_single_url_js(url, result_root, browser, metrics=metrics)
+                except Exception as e:
+                    metrics.finish("error", str(e))
+                records.append(metrics.to_dict())
+            browser.close()
+        seconds = time.perf_counter() - start
+    return _report("scrape_single_url_js", len(thread_urls), seconds, records, sampler)
+
+
+def bench_main(scraper, thread_urls: List[str], workdir: str) -> Dict:
+    """urls.txt を置いた作業フォルダで main() を実行"""
+    with open(os.path.join(workdir, "urls.txt"), "w", encoding="utf-8") as f:
+        f.write("\n".join(thread_urls) + "\n")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        with RssSampler() as sampler:
+            start = time.perf_counter()
+            scraper.main([])
+            seconds = time.perf_counter() - start
+    finally:
+        os.chdir(cwd)
+    with open(os.path.join(workdir, "result_js", "metrics_js.json"), "r", encoding="utf-8") as f:
+        records = json.load(f)["urls"]
+    return _report("main", len(thread_urls), seconds, records, sampler)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="擬似まとめサイトに対するエンドツーエンド計測")
+    parser.add_argument("--urls", type=int, default=5, help="スレッド数")
+    parser.add_argument("--mode", choices=("scrape", "main", "both"), default="both")
+    parser.add_argument("--json", help="結果をJSONで保存するパス")
+    for key, default in THREAD_DEFAULTS.items():
+        parser.add_argument(f"--{key.replace('_', '-')}", dest=key, type=type(default), default=default,
+                            help=f"スレッドの {key}（既定: {default}）")
+    args = parser.parse_args(argv)
+
+    work = tempfile.mkdtemp(prefix="bench_e2e_")
+    # ツイートのキャッシュを使い回すと2回目以降の計測が速くなりすぎるため、実行ごとに分ける
+    os.environ["TWITTER_CACHE_DIR"] = os.path.join(work, "twitter_cache")
+    import importlib
+    scraper = importlib.import_module("画像一括取得")
+
+    thread_params = {key: getattr(args, key) for key in THREAD_DEFAULTS}
+    results = []
+    with FakeMatomeSite() as site:
+        if args.mode in ("scrape", "both"):
+            urls = [site.thread_url(i, **thread_params) for i in range(1, args.urls + 1)]
+            results.append(bench_scrape(scraper, urls, os.path.join(work, "scrape")))
+        if args.mode in ("main", "both"):
+            # scrape モードとは別のスレッド番号を使う（ツイートIDが重ならないように）
+            urls = [site.thread_url(i, **thread_params) for i in range(1001, 1001 + args.urls)]
+            main_dir = os.path.join(work, "main")
+            os.makedirs(main_dir, exist_ok=True)
+            results.append(bench_main(scraper, urls, main_dir))
+        requests_served = dict(site.stats)
+
+    print(f"\n=== End-to-end benchmark ({args.urls} URLs, {args.posts} posts x {args.images} images) ===")
+    for result in results:
+        print(f"[{result['mode']}] {result['urls_per_min']} URLs/min, {result['images_per_sec']} images/sec, "
+              f"{result['mb_per_sec']} MB/s, peak RSS {result['peak_rss_mb']}MB"
+              + (f" (with Chromium {result['peak_rss_tree_mb']}MB)" if result["peak_rss_tree_mb"] else ""))
+    print(f"Requests served: {requests_served}")
+    print(f"Output: {work}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"params": vars(args), "results": results, "requests": requests_served},
+                      f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,335 @@
+# coding: utf-8
+"""
+抽出処理のオフラインベンチマーク
+
+benchmarks/fixtures/ の実サイト構造のHTMLと、synthetic.py で生成した
+1000レスのスレッドを使い、次の処理時間を計測する（ネットワーク・ブラウザ不要）。
+
+- パターン判定（detect_extraction_pattern）
+- 各抽出器の extract
+- clean_text_from_images / is_ad_image / 画像IDの正規化
+
+結果は baseline.json と比較し、基準より遅くなったケースや
+抽出件数（投稿数・画像数）が変わったケースがあれば終了コード1で終了する。
+
+使い方（リポジトリのルートで実行）:
+    python -m benchmarks.bench_extractors             # 計測して基準と比較
+    python -m benchmarks.bench_extractors --update    # 基準を更新
+    python -m benchmarks.bench_extractors --only standard --repeat 5
+
+マシンの速さの違いを吸収するため、比較は固定の処理（calibrate）に対する
+比率で行う。基準を更新するのは、意図して処理内容を変えたときだけにする。
+"""
+import argparse
+import gc
+import importlib
+import json
+import os
+import platform
+import re
+import sys
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+import requests
+from bs4 import BeautifulSoup
+
+from benchmarks.synthetic import PATTERNS, generate_thread_html, sample_image_urls
+from extractors.base import BaseExtractor, extract_image_id
+from extractors.pattern_detector import detect_extraction_pattern, get_extractor_class_name
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURE_DIR = os.path.join(BENCH_DIR, "fixtures")
+BASELINE_PATH = os.path.join(BENCH_DIR, "baseline.json")
+BASE_URL = "https://example.com/archives/1.html"
+
+# 記録済みフィクスチャ（ファイル名 → 期待するパターン）
+FIXTURES = {
+    "standard.html": "pattern_standard",
+    "t_b_only.html": "pattern_t_b_only",
+    "generic_2ch.html": "pattern_generic_2ch",
+    "dl_dt_dd.html": "pattern_dl_dt_dd",
+    "fallback.html": "pattern_fallback",
+}
+
+DEFAULT_REPEAT = 5
+DEFAULT_POSTS = 1000
+DEFAULT_TOLERANCE = 0.50
+# 基準より遅かったケースを計測し直す最大回数（最初の計測を含む）
+DEFAULT_ROUNDS = 3
+
+
+def calibrate(repeat: int = 10) -> float:
+    """マシンの速さの目安（文字列処理・正規表現・辞書操作の固定ワークロード）"""
+    pattern = re.compile(r"ID:([A-Za-z0-9]+)")
+    lines = [f"{i}: 名無しさん 25/03/23(日) 08:24:57 ID:ab{i:06d}" for i in range(20000)]
+
+    def workload():
+        counts = {}
+        for line in lines:
+            match = pattern.search(line)
+            key = match.group(1).lower()
+            counts[key] = counts.get(key, 0) + len(line.split())
+        return counts
+
+    return _best_of(workload, repeat)
+
+
+# 1回の計測がこれより短い処理は、まとめて複数回実行して平均する
+MIN_SAMPLE_SECONDS = 0.05
+
+
+def _best_of(func: Callable[[], object], repeat: int, setup: Optional[Callable[[], object]] = None) -> float:
+    """
+    repeat 回計測した最小時間（1回あたり）
+
+    timeit と同様に計測中は GC を止める。setup を指定した場合は、
+    その戻り値を引数に渡して1回ずつ計測する（setup の時間は含めない）。
+    """
+    number = 1
+    if setup is None:
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        if elapsed < MIN_SAMPLE_SECONDS:
+            number = max(1, int(MIN_SAMPLE_SECONDS / max(elapsed, 1e-6)))
+
+    best = float("inf")
+    gc_enabled = gc.isenabled()
+    try:
+        for _ in range(repeat):
+            arg = setup() if setup else None
+            gc.collect()
+            gc.disable()
+            start = time.perf_counter()
+            if setup:
+                func(arg)
+            else:
+                for _ in range(number):
+                    func()
+            elapsed = (time.perf_counter() - start) / number
+            if gc_enabled:
+                gc.enable()
+            best = min(best, elapsed)
+            del arg
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return best
+
+
+def _extractor(pattern: str) -> BaseExtractor:
+    # 本番（pattern_loader.load_extractor）と同じ方法でクラスを選ぶ
+    module = importlib.import_module(f"extractors.{pattern}")
+    return getattr(module, get_extractor_class_name(pattern))(requests.Session(), BASE_URL)
+
+
+def _load_corpus(posts: int) -> Dict[str, Dict]:
+    """ケース名 → {"html", "pattern"}"""
+    corpus = {}
+    for filename, pattern in FIXTURES.items():
+        with open(os.path.join(FIXTURE_DIR, filename), "r", encoding="utf-8") as f:
+            corpus[f"fixture_{filename[:-5]}"] = {"html": f.read(), "pattern": pattern}
+    for pattern in PATTERNS:
+        corpus[f"synthetic{posts}_{pattern[len('pattern_'):]}"] = {
+            "html": generate_thread_html(pattern, posts), "pattern": pattern,
+        }
+    return corpus
+
+
+def run_benchmarks(repeat: int = DEFAULT_REPEAT, posts: int = DEFAULT_POSTS,
+                   only: Optional[str] = None, cases: Optional[List[str]] = None) -> Dict[str, Dict]:
+    """
+    全ケースを計測
+
+    Args:
+        only: ケース名にこの文字列を含むものだけを計測
+        cases: 指定した名前のケースだけを計測
+
+    Returns:
+        ケース名 → {"seconds", "posts"?, "images"?, "pattern"?} の辞書
+    """
+    results: Dict[str, Dict] = {}
+
+    def selected(name: str) -> bool:
+        if cases is not None:
+            return name in cases
+        return not only or only in name
+
+    corpus = _load_corpus(posts)
+    for name, case in corpus.items():
+        html, pattern = case["html"], case["pattern"]
+        extractor = _extractor(pattern)
+
+        if selected(f"parse:{name}"):
+            results[f"parse:{name}"] = {
+                "seconds": _best_of(lambda: BeautifulSoup(html, "html.parser"), repeat),
+            }
+
+        soup = BeautifulSoup(html, "html.parser")
+        if selected(f"detect:{name}"):
+            detected = detect_extraction_pattern(soup)
+            results[f"detect:{name}"] = {
+                "seconds": _best_of(lambda: detect_extraction_pattern(soup), repeat),
+                "pattern": detected,
+            }
+
+        if selected(f"extract:{name}"):
+            # フォールバック抽出器は広告要素を decompose するため、毎回新しい soup を渡す
+            extracted = extractor.extract(BeautifulSoup(html, "html.parser"))
+            results[f"extract:{name}"] = {
+                "seconds": _best_of(extractor.extract, repeat,
+                                    setup=lambda: BeautifulSoup(html, "html.parser")),
+                "posts": len(extracted),
+                "images": sum(len(post["images"]) for post in extracted),
+            }
+
+    # 要素単位の処理は、1000レスの標準パターンから対象要素を集めて計測
+    standard_soup = BeautifulSoup(corpus[f"synthetic{posts}_standard"]["html"], "html.parser")
+    bodies = standard_soup.select(".t_b")
+    images = [(img, img.parent) for body in bodies for img in body.find_all("img")]
+    base = BaseExtractor(requests.Session(), BASE_URL)
+    urls = sample_image_urls(posts)
+
+    if selected("clean_text_from_images"):
+        results["clean_text_from_images"] = {
+            "seconds": _best_of(lambda: [base.clean_text_from_images(body) for body in bodies], repeat),
+            "items": len(bodies),
+        }
+    if selected("is_ad_image"):
+        results["is_ad_image"] = {
+            "seconds": _best_of(lambda: [base.is_ad_image(base.extract_img_src(img), img, parent)
+                                         for img, parent in images], repeat),
+            "items": len(images),
+            "ads": sum(1 for img, parent in images if base.is_ad_image(base.extract_img_src(img), img, parent)),
+        }
+    if selected("image_id:extractors"):
+        results["image_id:extractors"] = {
+            "seconds": _best_of(lambda: [extract_image_id(url) for url in urls], repeat),
+            "items": len(urls),
+            "unique": len({extract_image_id(url) for url in urls}),
+        }
+    if selected("image_id:download"):
+        scraper = importlib.import_module("画像一括取得")
+        results["image_id:download"] = {
+            "seconds": _best_of(lambda: [scraper.get_image_id_from_url(url) for url in urls], repeat),
+            "items": len(urls),
+            "unique": len({scraper.get_image_id_from_url(url) for url in urls}),
+        }
+    return results
+
+
+# 速度以外で基準と一致すべき項目（抽出結果が変わったことを検出する）
+CHECKED_FIELDS = ("pattern", "posts", "images", "items", "ads", "unique")
+
+
+def compare(results: Dict[str, Dict], calibration: float, baseline: Dict,
+            tolerance: float) -> List[str]:
+    """基準との比較。問題のあったケースの説明のリストを返す"""
+    failures = []
+    base_cases = baseline.get("cases", {})
+    base_calibration = baseline.get("calibration_seconds")
+    for name, result in results.items():
+        expected = base_cases.get(name)
+        if expected is None:
+            continue
+        for field in CHECKED_FIELDS:
+            if field in expected and expected[field] != result.get(field):
+                failures.append(f"{name}: {field} changed {expected[field]!r} -> {result.get(field)!r}")
+        if base_calibration:
+            ratio = (result["seconds"] / calibration) / (expected["seconds"] / base_calibration)
+            result["ratio"] = ratio
+            if ratio > 1 + tolerance:
+                failures.append(f"{name}: {ratio:.2f}x slower than baseline "
+                                f"({expected['seconds'] * 1000:.2f}ms -> {result['seconds'] * 1000:.2f}ms)")
+    return failures
+
+
+def write_baseline(path: str, results: Dict[str, Dict], calibration: float, posts: int) -> None:
+    payload = {
+        "generated_at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "posts": posts,
+        "calibration_seconds": calibration,
+        "cases": {name: {k: v for k, v in result.items() if k != "ratio"}
+                  for name, result in sorted(results.items())},
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False, indent=2)
+        f.write("\n")
+
+
+def print_table(results: Dict[str, Dict]) -> None:
+    width = max(len(name) for name in results) if results else 10
+    print(f"{'case':<{width}}  {'ms':>10}  {'vs base':>8}  detail")
+    for name, result in results.items():
+        ratio = f"{result['ratio']:.2f}x" if "ratio" in result else "-"
+        detail = ", ".join(f"{k}={result[k]}" for k in CHECKED_FIELDS if k in result)
+        print(f"{name:<{width}}  {result['seconds'] * 1000:>10.2f}  {ratio:>8}  {detail}")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="抽出処理のオフラインベンチマーク")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="基準ファイル（既定: benchmarks/baseline.json）")
+    parser.add_argument("--update", action="store_true", help="計測結果で基準を上書きする")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="各ケースの試行回数（最小値を採用）")
+    parser.add_argument("--posts", type=int, default=DEFAULT_POSTS, help="合成スレッドのレス数")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="許容する遅延の割合（既定: 0.50 = 50%%）")
+    parser.add_argument("--rounds", type=int, default=DEFAULT_ROUNDS,
+                        help="基準より遅かったケースを計測し直す最大回数（最初の計測を含む、最小値を採用）")
+    parser.add_argument("--only", help="ケース名にこの文字列を含むものだけを計測")
+    args = parser.parse_args(argv)
+
+    # 計測の前後で校正し、速い方を採用（実行中の負荷の揺らぎを減らす）
+    calibration = calibrate()
+    results = run_benchmarks(repeat=args.repeat, posts=args.posts, only=args.only)
+    calibration = min(calibration, calibrate())
+
+    if args.update:
+        if args.only:
+            print("[ERROR] --update cannot be combined with --only", file=sys.stderr)
+            return 2
+        write_baseline(args.baseline, results, calibration, args.posts)
+        print_table(results)
+        print(f"\nBaseline written: {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print_table(results)
+        print(f"\n[WARN] Baseline not found: {args.baseline} (run with --update to create it)")
+        return 0
+
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline.get("posts") != args.posts:
+        print(f"[WARN] Baseline was recorded with --posts {baseline.get('posts')}; synthetic cases are not comparable")
+    failures = compare(results, calibration, baseline, args.tolerance)
+    # 基準より遅かったケースだけを計測し直し、各回の最小時間で判定する
+    # （計測中の一時的な負荷で、変更のないコードを回帰と判定しないため）。
+    # 計測し直した時間は、その回の校正値で最初の校正値に合わせてから比べる
+    for _ in range(args.rounds - 1):
+        slow = [name for name, result in results.items() if result.get("ratio", 0) > 1 + args.tolerance]
+        if not slow:
+            break
+        round_calibration = calibrate()
+        retried = run_benchmarks(repeat=args.repeat, posts=args.posts, cases=slow)
+        round_calibration = min(round_calibration, calibrate())
+        for name, result in retried.items():
+            seconds = result["seconds"] * calibration / round_calibration
+            results[name]["seconds"] = min(results[name]["seconds"], seconds)
+        failures = compare(results, calibration, baseline, args.tolerance)
+    print_table(results)
+    if failures:
+        print(f"\n=== {len(failures)} regression(s) against {args.baseline} ===")
+        for failure in failures:
+            print(f"  - {failure}")
+        return 1
+    print("\nNo regressions.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
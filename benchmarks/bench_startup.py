@@ -0,0 +1,199 @@
+# coding: utf-8
+"""
+起動時間の計測（インポート時間と、最初のURLの処理開始までの時間）
+
+新しいプロセスで次の値を計測し、予算（BUDGETS）を超えたら終了コード1で終了する。
+
+- import 時間: `python -X importtime -c "import <module>"` の累積時間
+  （画像一括取得 と app。試行を繰り返して最小値を採用）
+- 重い依存の遅延読み込み: import 直後に Playwright・BeautifulSoup・requests が
+  読み込まれていないこと
+- 最初のURLまでの時間: 擬似まとめサイトの URL を1件書いた urls.txt で CLI を起動し、
+  最初のブラウザコンテキストができた「Browser started」のログが出るまでの時間
+  （Chromium は最初のページを開くときに起動するので、その時間を含む。
+  playwright install chromium が必要で、起動できない環境では省略し、そう表示する）
+
+使い方（リポジトリのルートで実行）:
+    python -m benchmarks.bench_startup
+    python -m benchmarks.bench_startup --repeat 10 --skip-first-url
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 最初のURLの計測で待つログ（browser_contexts.HostContextPool が Chromium を起動した後に出す）
+FIRST_URL_MARKER = "Browser started in "
+
+# 予算（ミリ秒）。CIなど遅いマシンでも誤検知しない程度に余裕を持たせている
+BUDGETS = {
+    "import 画像一括取得": 250,
+    "import app": 600,
+    "first URL": 8000,
+}
+
+# import 直後には読み込まれていてはいけないモジュール
+LAZY_MODULES = ("playwright", "bs4", "requests")
+
+DEFAULT_REPEAT = 5
+DEFAULT_TOP = 10
+
+_IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( *)(\S+)$")
+
+
+def _run_python(code: str, *flags: str) -> subprocess.CompletedProcess:
+    return subprocess.run([sys.executable, *flags, "-c", code], cwd=REPO_ROOT,
+                          capture_output=True, text=True, encoding="utf-8")
+
+
+def measure_import(module: str) -> Tuple[float, List[Tuple[str, float]]]:
+    """
+    新しいプロセスで module を import し、(累積ミリ秒, 直下の依存ごとの累積ミリ秒) を返す
+    """
+    result = _run_python(f"import {module}", "-X", "importtime")
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr}")
+    total = None
+    children = []
+    for line in result.stderr.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        cumulative_ms = int(match.group(2)) / 1000
+        depth = len(match.group(3)) // 2
+        name = match.group(4)
+        if depth == 0:
+            if name == module:
+                total = cumulative_ms
+                break
+            # -X importtime は子→親の順に出力するため、直前の depth 0 以降が module の依存になる
+            children = []
+        elif depth == 1:
+            children.append((name, cumulative_ms))
+    if total is None:
+        raise RuntimeError(f"No importtime entry for {module}")
+    return total, sorted(children, key=lambda item: item[1], reverse=True)
+
+
+def loaded_lazy_modules(module: str) -> List[str]:
+    """module を import した直後に読み込まれている LAZY_MODULES を返す"""
+    code = (f"import sys, json, {module}\n"
+            f"print(json.dumps([m for m in {LAZY_MODULES!r} if m in sys.modules]))")
+    result = _run_python(code)
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def measure_first_url(timeout: float = 120) -> Optional[float]:
+    """
+    CLI を起動してから、最初のURLのために Chromium を起動してコンテキストを作るまでのミリ秒
+
+    Chromium を起動できない場合（ログが出ないままプロセスが終了した場合）は None を返す。
+    """
+    from benchmarks.fake_site import FakeMatomeSite
+
+    script = os.path.join(REPO_ROOT, "画像一括取得.py")
+    with FakeMatomeSite() as site, tempfile.TemporaryDirectory(prefix="bench_startup_") as work:
+        with open(os.path.join(work, "urls.txt"), "w", encoding="utf-8") as f:
+            f.write(site.thread_url(1, posts=10) + "\n")
+        env = dict(os.environ, LOG_LEVEL="INFO", LOG_FORMAT="text",
+                   TWITTER_CACHE_DIR=os.path.join(work, "twitter_cache"))
+        started = time.perf_counter()
+        process = subprocess.Popen([sys.executable, script], cwd=work, env=env,
+                                   stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                                   stderr=subprocess.PIPE, text=True, encoding="utf-8")
+        elapsed = None
+        try:
+            # 終了時の「Enterキーを押して終了」に備えて改行を渡しておく
+            process.stdin.write("\n")
+            process.stdin.close()
+            deadline = started + timeout
+            for line in process.stderr:
+                if FIRST_URL_MARKER in line:
+                    elapsed = (time.perf_counter() - started) * 1000
+                    break
+                if time.perf_counter() > deadline:
+                    break
+        finally:
+            process.kill()
+            process.wait()
+    return elapsed
+
+
+def run(repeat: int, skip_first_url: bool) -> Dict:
+    results: Dict = {"imports": {}, "lazy_violations": {}}
+    for module in ("画像一括取得", "app"):
+        samples = [measure_import(module) for _ in range(repeat)]
+        best_total, best_children = min(samples, key=lambda sample: sample[0])
+        results["imports"][module] = {"ms": round(best_total, 1),
+                                      "top": [(name, round(ms, 1)) for name, ms in best_children]}
+        results["lazy_violations"][module] = loaded_lazy_modules(module)
+    if not skip_first_url:
+        first_url = measure_first_url()
+        results["first_url_ms"] = round(first_url, 1) if first_url is not None else None
+    return results
+
+
+def check_budgets(results: Dict, budgets: Dict[str, float]) -> List[str]:
+    failures = []
+    for module, entry in results["imports"].items():
+        budget = budgets[f"import {module}"]
+        if entry["ms"] > budget:
+            failures.append(f"import {module}: {entry['ms']}ms > budget {budget}ms")
+    for module, loaded in results["lazy_violations"].items():
+        if loaded:
+            failures.append(f"import {module} loads {', '.join(loaded)} eagerly")
+    first_url = results.get("first_url_ms")
+    if first_url is not None and first_url > budgets["first URL"]:
+        failures.append(f"first URL: {first_url}ms > budget {budgets['first URL']}ms")
+    return failures
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="起動時間（import と最初のURLまで）の計測")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="import の試行回数（最小値を採用）")
+    parser.add_argument("--top", type=int, default=DEFAULT_TOP, help="表示する依存モジュールの件数")
+    parser.add_argument("--skip-first-url", action="store_true", help="最初のURLまでの計測を省略する")
+    parser.add_argument("--first-url-budget", type=float, default=BUDGETS["first URL"],
+                        help=f"最初のURLまでの予算（ミリ秒、既定: {BUDGETS['first URL']}）")
+    parser.add_argument("--json", help="結果をJSONで保存するパス")
+    args = parser.parse_args(argv)
+
+    budgets = dict(BUDGETS, **{"first URL": args.first_url_budget})
+    results = run(args.repeat, args.skip_first_url)
+
+    print("\n=== Startup time ===")
+    for module, entry in results["imports"].items():
+        print(f"import {module}: {entry['ms']}ms (budget {budgets[f'import {module}']}ms)")
+        for name, ms in entry["top"][:args.top]:
+            print(f"    {ms:8.1f}ms  {name}")
+    if "first_url_ms" in results:
+        if results["first_url_ms"] is None:
+            print("First URL: skipped (Chromium could not be launched)")
+        else:
+            print(f"First URL: {results['first_url_ms']}ms (budget {budgets['first URL']}ms)")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"budgets": budgets, "results": results}, f, ensure_ascii=False, indent=2)
+
+    failures = check_budgets(results, budgets)
+    if failures:
+        print(f"\n=== {len(failures)} startup budget violation(s) ===")
+        for failure in failures:
+            print(f"  - {failure}")
+        return 1
+    print("\nWithin budget.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,145 @@
+# coding: utf-8
+"""
+ブラウザ内での切り出し（dom_extract.py）と従来の処理の一致確認
+
+各ページを Chromium で表示し、次の2つの結果（タイトル・投稿・画像・スレ主ID・パターン）を比べる。
+
+- 従来: page.content() のページ全体を parse_page で解析
+- 切り出し: extract_thread_html のHTMLを parse_page で解析
+
+切り出しの結果を実際に使う（dom_extract.matches_full_page が真）のに従来と
+一致しないページがあれば終了コード1で終了する。HTMLのサイズと解析時間も表示する。
+
+対象は benchmarks/fixtures/ の実サイト構造のHTML、synthetic.py の合成スレッド、
+--url で指定したページ。playwright install chromium が必要。
+
+使い方（リポジトリのルートで実行）:
+    python -m benchmarks.dom_extract_parity
+    python -m benchmarks.dom_extract_parity --posts 1000 --url https://example.com/archives/1.html
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+from benchmarks.bench_extractors import BASE_URL, FIXTURE_DIR, FIXTURES
+from benchmarks.synthetic import PATTERNS, generate_thread_html
+from dom_extract import extract_thread_html, matches_full_page
+from page_parser import ParsedPage, parse_page
+
+DEFAULT_POSTS = 300
+
+
+def _load_cases(posts: int, urls: List[str]) -> List[Tuple[str, Optional[str], str]]:
+    """(ケース名, HTML（URLを開く場合は None）, URL)"""
+    cases = []
+    for filename in FIXTURES:
+        with open(os.path.join(FIXTURE_DIR, filename), "r", encoding="utf-8") as f:
+            cases.append((f"fixture:{filename}", f.read(), BASE_URL))
+    for pattern in PATTERNS:
+        cases.append((f"synthetic:{pattern}", generate_thread_html(pattern, posts), BASE_URL))
+    for url in urls:
+        cases.append((url, None, url))
+    return cases
+
+
+def _differences(full: ParsedPage, thread: ParsedPage) -> List[str]:
+    diffs = []
+    if full.title != thread.title:
+        diffs.append(f"title {full.title!r} != {thread.title!r}")
+    if full.pattern != thread.pattern:
+        diffs.append(f"pattern {full.pattern} != {thread.pattern}")
+    if full.op_ids != thread.op_ids:
+        diffs.append(f"op_ids {list(full.op_ids)} != {list(thread.op_ids)}")
+    if len(full.posts) != len(thread.posts):
+        diffs.append(f"posts {len(full.posts)} != {len(thread.posts)}")
+    for index, (a, b) in enumerate(zip(full.posts, thread.posts), 1):
+        if a != b:
+            fields = [name for name in a._fields if getattr(a, name) != getattr(b, name)]
+            diffs.append(f"post {index}: {', '.join(fields)} differ")
+            break
+    return diffs
+
+
+def check_page(page, url: str) -> Dict:
+    """表示中のページで従来の処理と切り出しを比べる"""
+    start = time.perf_counter()
+    html = page.content()
+    full = parse_page(html, url)
+    full_seconds = time.perf_counter() - start
+    record = {"pattern": full.pattern, "posts": len(full.posts), "page_bytes": len(html),
+              "page_seconds": round(full_seconds, 3)}
+
+    start = time.perf_counter()
+    thread_html = extract_thread_html(page)
+    if thread_html is None:
+        record["result"] = "unsupported"
+        return record
+    thread = parse_page(thread_html.html, url)
+    record.update(thread_bytes=len(thread_html.html), thread_seconds=round(time.perf_counter() - start, 3))
+    record["differences"] = _differences(full, thread)
+    if not matches_full_page(thread, thread_html):
+        record["result"] = "not used"
+    else:
+        record["result"] = "differs" if record["differences"] else "same"
+    return record
+
+
+def run(posts: int, urls: List[str]) -> Dict[str, Dict]:
+    from playwright.sync_api import sync_playwright
+
+    results = {}
+    with sync_playwright() as p:
+        browser = p.chromium.launch(headless=True)
+        try:
+            for name, html, url in _load_cases(posts, urls):
+                page = browser.new_page()
+                try:
+                    if html is None:
+                        page.goto(url, wait_until="domcontentloaded", timeout=60000)
+                    else:
+                        page.set_content(html, wait_until="domcontentloaded")
+                    results[name] = check_page(page, url)
+                except Exception as e:
+                    results[name] = {"result": "error", "error": str(e)}
+                finally:
+                    page.close()
+        finally:
+            browser.close()
+    return results
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="ブラウザ内での切り出しと従来の処理の一致確認")
+    parser.add_argument("--posts", type=int, default=DEFAULT_POSTS, help="合成スレッドのレス数")
+    parser.add_argument("--url", action="append", default=[], help="確認するページ（複数指定可）")
+    parser.add_argument("--json", help="結果をJSONで保存するパス")
+    args = parser.parse_args(argv)
+
+    results = run(args.posts, args.url)
+
+    print(f"\n{'case':<36} {'result':<12} {'pattern':<20} {'posts':>6} {'page KB':>9} {'thread KB':>10}")
+    for name, record in results.items():
+        thread_kb = f"{record['thread_bytes'] / 1024:.1f}" if "thread_bytes" in record else "-"
+        page_kb = f"{record['page_bytes'] / 1024:.1f}" if "page_bytes" in record else "-"
+        print(f"{name:<36} {record['result']:<12} {record.get('pattern') or '-':<20} "
+              f"{record.get('posts', '-'):>6} {page_kb:>9} {thread_kb:>10}")
+        for line in record.get("differences", []) or ([record["error"]] if "error" in record else []):
+            print(f"    {line}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+    failures = [name for name, record in results.items() if record["result"] in ("differs", "error")]
+    if failures:
+        print(f"\n=== {len(failures)} case(s) failed: {', '.join(failures)} ===")
+        return 1
+    print("\nAll pages that use in-browser extraction match the full-page result.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
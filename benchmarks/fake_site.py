@@ -0,0 +1,282 @@
+# coding: utf-8
+"""
+ローカルで動く擬似まとめサイト
+
+実在のブログにアクセスせずに Playwright を含む処理全体を計測するための
+HTTPサーバー。標準パターン（.t_h / .t_b）のスレッドをその場で生成する。
+
+スレッドURLのクエリで内容を指定できる:
+    posts      レス数（既定: 100）
+    images     1レスあたりの画像数（既定: 1）
+    lazy       data-src で遅延読み込みにする画像の割合（既定: 0.3）
+    imgur      imgur形式のミラーリンクを付ける画像の割合（既定: 0.2）
+    missing    404 になる画像の割合（既定: 0.05。ミラーがあればそちらで取得される）
+    slow       遅いホスト（localhost 側）から配信する画像の割合（既定: 0.1）
+    delay_ms   遅いホストの応答遅延（既定: 500）
+    tweets     ツイート埋め込み iframe の数（既定: 2）
+    image_kb   画像1枚のサイズ（既定: 50）
+    seed       乱数シード（既定: スレッド番号）
+
+ページは 127.0.0.1、遅いホストの画像は localhost で配信するため、
+ホスト別のメトリクスも区別できる。
+
+単体でも起動できる:
+    python -m benchmarks.fake_site --port 8765
+"""
+import argparse
+import base64
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlencode, urlparse
+
+# 8x8 の JPEG（画像サイズはコメントセグメントで水増しする）
+_BASE_JPEG = base64.b64decode(
+    "/9j/4AAQSkZJRgABAQAAAQABAAD/2wBDABALDA4MChAODQ4SERATGCgaGBYWGDEjJR0oOjM9PDkzODdASFxOQERXRTc4UG1RV19i"
+    "Z2hnPk1xeXBkeFxlZ2P/2wBDARESEhgVGC8aGi9jQjhCY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2Nj"
+    "Y2NjY2NjY2P/wAARCAAIAAgDASIAAhEBAxEB/8QAHwAAAQUBAQEBAQEAAAAAAAAAAAECAwQFBgcICQoL/8QAtRAAAgEDAwIEAwUF"
+    "BAQAAAF9AQIDAAQRBRIhMUEGE1FhByJxFDKBkaEII0KxwRVS0fAkM2JyggkKFhcYGRolJicoKSo0NTY3ODk6Q0RFRkdISUpTVFVW"
+    "V1hZWmNkZWZnaGlqc3R1dnd4eXqDhIWGh4iJipKTlJWWl5iZmqKjpKWmp6ipqrKztLW2t7i5usLDxMXGx8jJytLT1NXW19jZ2uHi"
+    "4+Tl5ufo6erx8vP09fb3+Pn6/8QAHwEAAwEBAQEBAQEBAQAAAAAAAAECAwQFBgcICQoL/8QAtREAAgECBAQDBAcFBAQAAQJ3AAEC"
+    "AxEEBSExBhJBUQdhcRMiMoEIFEKRobHBCSMzUvAVYnLRChYkNOEl8RcYGRomJygpKjU2Nzg5OkNERUZHSElKU1RVVldYWVpjZGVm"
+    "Z2hpanN0dXZ3eHl6goOEhYaHiImKkpOUlZaXmJmaoqOkpaanqKmqsrO0tba3uLm6wsPExcbHyMnK0tPU1dbX2Nna4uPk5ebn6Onq"
+    "8vP09fb3+Pn6/9oADAMBAAIRAxEAPwC7RRRXach//9k="
+)
+
+THREAD_DEFAULTS = {
+    "posts": 100,
+    "images": 1,
+    "lazy": 0.3,
+    "imgur": 0.2,
+    "missing": 0.05,
+    "slow": 0.1,
+    "delay_ms": 500,
+    "tweets": 2,
+    "image_kb": 50,
+}
+
+# スクロールで表示された画像だけ data-src を src に移す（一般的な遅延読み込みの実装）
+_LAZY_LOAD_JS = """
+document.addEventListener("DOMContentLoaded", () => {
+  const io = new IntersectionObserver(entries => entries.forEach(entry => {
+    if (entry.isIntersecting) {
+      const img = entry.target;
+      img.src = img.dataset.src;
+      io.unobserve(img);
+    }
+  }));
+  document.querySelectorAll("img[data-src]").forEach(img => io.observe(img));
+});
+"""
+
+_BODY_LINES = ["それな", "画像貼るで", "ほんまか？", "草", "ソースは？", "これはええな", "うらやましい"]
+
+_image_cache: Dict[int, bytes] = {}
+_image_cache_lock = threading.Lock()
+
+
+def make_jpeg(size_kb: int) -> bytes:
+    """指定サイズ（KB）前後の有効な JPEG を作る（SOI直後にコメントセグメントを挿入）"""
+    with _image_cache_lock:
+        cached = _image_cache.get(size_kb)
+    if cached is not None:
+        return cached
+    padding = max(0, size_kb * 1024 - len(_BASE_JPEG))
+    segments = []
+    while padding > 0:
+        chunk = min(padding, 65533)
+        segments.append(b"\xff\xfe" + (chunk + 2).to_bytes(2, "big") + b"\x00" * chunk)
+        padding -= chunk + 4
+    data = _BASE_JPEG[:2] + b"".join(segments) + _BASE_JPEG[2:]
+    with _image_cache_lock:
+        _image_cache[size_kb] = data
+    return data
+
+
+def _params(query: str, thread_id: int) -> Dict:
+    values = parse_qs(query)
+    params = {}
+    for key, default in THREAD_DEFAULTS.items():
+        raw = values.get(key, [None])[0]
+        params[key] = type(default)(raw) if raw is not None else default
+    params["seed"] = int(values.get("seed", [thread_id])[0])
+    return params
+
+
+def render_thread(thread_id: int, params: Dict, page_origin: str, slow_origin: str) -> str:
+    """スレッドHTMLを生成（同じ引数なら同じHTML）"""
+    rnd = random.Random(params["seed"])
+    kb = params["image_kb"]
+    op_id = "".join(rnd.choice("abcdefghjkmnpqrstuvwxyz0123456789") for _ in range(6))
+    rows: List[str] = []
+    tweet_slots = set(rnd.sample(range(1, params["posts"] + 1), min(params["tweets"], params["posts"])))
+
+    for n in range(1, params["posts"] + 1):
+        post_id = op_id if n == 1 or rnd.random() < 0.15 else "".join(
+            rnd.choice("abcdefghjkmnpqrstuvwxyz0123456789") for _ in range(6))
+        rows.append(f'<div class="t_h">{n}: 名無しさん＠おーぷん 25/03/23(日) 08:{n // 60 % 60:02d}:{n % 60:02d} ID:{post_id}</div>')
+
+        parts = [rnd.choice(_BODY_LINES)]
+        for _ in range(params["images"]):
+            name = "%08x" % rnd.getrandbits(32)
+            origin = slow_origin + f"/slow/{params['delay_ms']}" if rnd.random() < params["slow"] else page_origin
+            folder = "missing" if rnd.random() < params["missing"] else f"img/{kb}"
+            full = f"{origin}/{folder}/{name}.jpg"
+            thumb = f"{origin}/{folder}/{name}-s.jpg"
+            if rnd.random() < params["lazy"]:
+                img = f'<img data-src="{thumb}" width="400" height="300" class="lazy">'
+            else:
+                img = f'<img src="{thumb}" width="400" height="300">'
+            parts.append(f'<a href="{full}" target="_blank">{img}</a>')
+            if rnd.random() < params["imgur"]:
+                mirror = f"{page_origin}/imgur/{kb}/" + "".join(
+                    rnd.choice("abcdefghijkmnopqrstuvwxyzABCDEFGHJKLMNPQRSTUVWXYZ0123456789") for _ in range(7)) + ".jpg"
+                parts.append(f'<a href="{mirror}" target="_blank">{mirror}</a>')
+        if n in tweet_slots:
+            tweet_id = 1700000000000000000 + params["seed"] * 100000 + n
+            parts.append(f'<iframe src="{page_origin}/platform.twitter.com/embed/Tweet.html?id={tweet_id}"'
+                         ' width="550" height="300" frameborder="0"></iframe>')
+        rows.append(f'<div class="t_b">{"<br>".join(parts)}</div>')
+
+        if n % 50 == 0:
+            rows.append('<div class="t_b"><div class="rss-block">記事の途中ですが、おすすめ記事です'
+                        '<img src="/ads/banner.gif" width="300" height="250"></div></div>')
+
+    return ('<!DOCTYPE html>\n<html lang="ja">\n<head><meta charset="utf-8">'
+            f"<title>擬似スレッド{thread_id} : ローカルまとめ</title>"
+            f"<script>{_LAZY_LOAD_JS}</script></head>\n<body>\n"
+            '<main id="main" class="main"><article class="post"><div class="entry-content">\n'
+            + "\n".join(rows)
+            + "\n</div></article></main>\n</body>\n</html>\n")
+
+
+def _tweet_html(tweet_id: str) -> str:
+    return ('<!DOCTYPE html><html><head><meta charset="utf-8"></head>'
+            '<body style="margin:0;font-family:sans-serif">'
+            '<div style="border:1px solid #cfd9de;border-radius:12px;padding:12px;width:520px">'
+            f"<b>擬似ユーザー</b> @fake_user<p>擬似ツイート {tweet_id}</p></div></body></html>")
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "FakeMatome/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: bytes, content_type: str) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        site: "FakeMatomeSite" = self.server.site
+        parsed = urlparse(self.path)
+        path = parsed.path
+
+        if path.startswith("/slow/"):
+            _, _, delay, rest = path.split("/", 3)
+            time.sleep(int(delay) / 1000)
+            path = "/" + rest
+
+        if path.startswith("/thread/"):
+            site.count("thread")
+            thread_id = int(path.split("/")[2] or 0)
+            html = render_thread(thread_id, _params(parsed.query, thread_id), site.base_url, site.slow_base_url)
+            self._send(200, html.encode("utf-8"), "text/html; charset=utf-8")
+        elif path.startswith("/img/") or path.startswith("/imgur/"):
+            site.count("image")
+            kb = int(path.split("/")[2])
+            self._send(200, make_jpeg(kb), "image/jpeg")
+        elif path.startswith("/platform.twitter.com/embed/"):
+            site.count("tweet")
+            tweet_id = parse_qs(parsed.query).get("id", [""])[0]
+            self._send(200, _tweet_html(tweet_id).encode("utf-8"), "text/html; charset=utf-8")
+        elif path == "/urls.txt":
+            # main() 用のURLリスト（count 件、その他のクエリは各スレッドURLに引き継ぐ）
+            query = parse_qs(parsed.query)
+            count = int(query.pop("count", ["10"])[0])
+            params = {key: values[0] for key, values in query.items()}
+            body = "\n".join(site.thread_url(i, **params) for i in range(1, count + 1)) + "\n"
+            self._send(200, body.encode("utf-8"), "text/plain; charset=utf-8")
+        else:
+            site.count("not_found")
+            self._send(404, b"<html><body>404 Not Found</body></html>", "text/html; charset=utf-8")
+
+
+class FakeMatomeSite:
+    """
+    擬似まとめサイトのサーバー
+
+    with FakeMatomeSite() as site:
+        url = site.thread_url(1, posts=500, images=2)
+    """
+
+    def __init__(self, port: int = 0, host: str = "127.0.0.1"):
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.site = self
+        self._thread: Optional[threading.Thread] = None
+        self._stats_lock = threading.Lock()
+        self.stats: Dict[str, int] = {}
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    @property
+    def slow_base_url(self) -> str:
+        """遅いホスト（同じサーバーを別のホスト名で参照）"""
+        return f"http://localhost:{self.port}"
+
+    def thread_url(self, thread_id: int, **params) -> str:
+        query = urlencode(params)
+        return f"{self.base_url}/thread/{thread_id}" + (f"?{query}" if query else "")
+
+    def count(self, kind: str) -> None:
+        with self._stats_lock:
+            self.stats[kind] = self.stats.get(kind, 0) + 1
+
+    def start(self) -> "FakeMatomeSite":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "FakeMatomeSite":
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.stop()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="ローカルの擬似まとめサイトを起動")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--host", default="127.0.0.1")
+    args = parser.parse_args(argv)
+
+    site = FakeMatomeSite(args.port, args.host)
+    print(f"Serving fake matome site on {site.base_url}")
+    print(f"  thread : {site.thread_url(1, posts=200, images=2)}")
+    print(f"  urls   : {site.base_url}/urls.txt?count=10&posts=200")
+    try:
+        site._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        site._server.server_close()
+
+
+if __name__ == "__main__":
+    main()
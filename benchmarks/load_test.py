@@ -0,0 +1,286 @@
+# coding: utf-8
+"""
+/api/scrape サーバーの負荷試験
+
+ローカルの擬似まとめサイト（fake_site.py）を起動し、app.py のサーバーに
+同時に複数の /api/scrape リクエストを送る。
+
+- 1リクエストあたりのURL数（バッチサイズ）の混合比と、同時ユーザー数、
+  ユーザーごとの送信間隔を指定できる
+- レイテンシのパーセンタイル、スループット、エラー率を集計する
+- 実行中は /metrics を一定間隔で取得し、一時ディスク使用量・RSS・
+  実行中ジョブ数の推移を記録する
+
+使い方（リポジトリのルートで実行）:
+    # app.py を別ポートで起動して試験（終了時に停止）
+    python -m benchmarks.load_test --spawn --users 4 --requests 20 --mix 1:6,3:3,10:1
+
+    # 起動済みのサーバーに対して試験
+    python -m benchmarks.load_test --server http://localhost:5000 --users 2 --duration 120
+"""
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import requests
+
+from benchmarks.fake_site import FakeMatomeSite
+from scrape_metrics import percentile
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# /metrics から推移を記録する値
+WATCHED_METRICS = (
+    "scrape_temp_disk_bytes",
+    "process_resident_memory_bytes",
+    "scrape_jobs_in_progress",
+    "scrape_browsers_active",
+)
+
+
+def parse_mix(text: str) -> List[Tuple[int, float]]:
+    """"1:6,3:3,10:1" → [(バッチサイズ, 重み), ...]"""
+    mix = []
+    for part in text.split(","):
+        size, _, weight = part.partition(":")
+        mix.append((int(size), float(weight or 1)))
+    return mix
+
+
+def parse_prometheus(text: str) -> Dict[str, float]:
+    """Prometheus テキスト形式から、ラベルなしのサンプル値を取り出す"""
+    values = {}
+    for line in text.splitlines():
+        if not line or line.startswith("#") or "{" in line:
+            continue
+        name, _, value = line.partition(" ")
+        try:
+            values[name] = float(value)
+        except ValueError:
+            continue
+    return values
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def spawn_server(port: int) -> subprocess.Popen:
+    """app.py のサーバーを別プロセスで起動し、応答するまで待つ"""
+    code = f"import app; app.app.run(host='127.0.0.1', port={port}, threaded=True)"
+    process = subprocess.Popen([sys.executable, "-c", code], cwd=REPO_ROOT,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"app.py exited with code {process.returncode}")
+        try:
+            requests.get(f"http://127.0.0.1:{port}/metrics", timeout=1)
+            return process
+        except requests.exceptions.RequestException:
+            time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError("app.py did not start within 60 seconds")
+
+
+class MetricsPoller:
+    """/metrics を一定間隔で取得し、WATCHED_METRICS の推移を記録する"""
+
+    def __init__(self, server: str, interval: float):
+        self.url = server.rstrip("/") + "/metrics"
+        self.interval = interval
+        self.samples: List[Dict] = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._started = 0.0
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                values = parse_prometheus(requests.get(self.url, timeout=5).text)
+                sample = {"t": round(time.perf_counter() - self._started, 2)}
+                sample.update({name: values.get(name) for name in WATCHED_METRICS})
+                self.samples.append(sample)
+            except requests.exceptions.RequestException:
+                pass
+            self._stop.wait(self.interval)
+
+    def __enter__(self) -> "MetricsPoller":
+        self._started = time.perf_counter()
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def peak(self, name: str) -> Optional[float]:
+        values = [s[name] for s in self.samples if s.get(name) is not None]
+        return max(values) if values else None
+
+
+class LoadGenerator:
+    """同時ユーザーごとにリクエストを送り、結果を記録する"""
+
+    def __init__(self, server: str, site: FakeMatomeSite, mix: List[Tuple[int, float]],
+                 thread_params: Dict, timeout: float, think: float, seed: int):
+        self.endpoint = server.rstrip("/") + "/api/scrape"
+        self.site = site
+        self.mix = mix
+        self.thread_params = thread_params
+        self.timeout = timeout
+        self.think = think
+        self.random = random.Random(seed)
+        self.results: List[Dict] = []
+        self._lock = threading.Lock()
+        self._next_thread_id = 0
+        self._remaining: Optional[int] = None
+        self._deadline: Optional[float] = None
+
+    def _take(self) -> bool:
+        """次のリクエストを送ってよいか（総数または時間で打ち切り）"""
+        with self._lock:
+            if self._deadline is not None and time.perf_counter() >= self._deadline:
+                return False
+            if self._remaining is not None:
+                if self._remaining <= 0:
+                    return False
+                self._remaining -= 1
+            return True
+
+    def _batch(self) -> List[str]:
+        with self._lock:
+            sizes, weights = zip(*self.mix)
+            size = self.random.choices(sizes, weights)[0]
+            ids = range(self._next_thread_id + 1, self._next_thread_id + size + 1)
+            self._next_thread_id += size
+        return [self.site.thread_url(i, **self.thread_params) for i in ids]
+
+    def _user(self, started: float) -> None:
+        session = requests.Session()
+        while self._take():
+            urls = self._batch()
+            sent = time.perf_counter()
+            record = {"sent": round(sent - started, 3), "urls": len(urls)}
+            try:
+                response = session.post(self.endpoint, json={"urls": urls}, timeout=self.timeout)
+                record["status"] = response.status_code
+                record["bytes"] = len(response.content)
+                if response.status_code == 200:
+                    record["failed_urls"] = len(json.loads(response.headers.get("X-Failed-URLs", "[]")))
+            except requests.exceptions.RequestException as e:
+                record["status"] = type(e).__name__
+            record["latency"] = round(time.perf_counter() - sent, 3)
+            with self._lock:
+                self.results.append(record)
+            if self.think:
+                time.sleep(self.think)
+
+    def run(self, users: int, total_requests: Optional[int], duration: Optional[float]) -> float:
+        self._remaining = total_requests
+        started = time.perf_counter()
+        self._deadline = started + duration if duration else None
+        with ThreadPoolExecutor(max_workers=users) as pool:
+            for _ in range(users):
+                pool.submit(self._user, started)
+        return time.perf_counter() - started
+
+
+def summarize(results: List[Dict], seconds: float, poller: MetricsPoller) -> Dict:
+    ok = [r for r in results if r.get("status") == 200]
+    latencies = [r["latency"] for r in ok]
+    status_counts: Dict[str, int] = {}
+    for r in results:
+        status_counts[str(r.get("status"))] = status_counts.get(str(r.get("status")), 0) + 1
+    urls_done = sum(r["urls"] - r.get("failed_urls", 0) for r in ok)
+    return {
+        "requests": len(results),
+        "seconds": round(seconds, 2),
+        "status": status_counts,
+        "error_rate": round(1 - len(ok) / len(results), 4) if results else None,
+        "latency_seconds": {
+            **{f"p{p}": round(percentile(latencies, p), 3) if latencies else None for p in (50, 90, 95, 99)},
+            "max": max(latencies) if latencies else None,
+        },
+        "throughput": {
+            "requests_per_min": round(len(ok) / seconds * 60, 2) if seconds else None,
+            "urls_per_min": round(urls_done / seconds * 60, 2) if seconds else None,
+        },
+        "peak_temp_disk_mb": _mb(poller.peak("scrape_temp_disk_bytes")),
+        "peak_rss_mb": _mb(poller.peak("process_resident_memory_bytes")),
+        "peak_jobs_in_progress": poller.peak("scrape_jobs_in_progress"),
+    }
+
+
+def _mb(value: Optional[float]) -> Optional[float]:
+    return round(value / 1048576, 1) if value is not None else None
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="/api/scrape サーバーの負荷試験")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--server", default="http://127.0.0.1:5000", help="試験対象のサーバー")
+    target.add_argument("--spawn", action="store_true", help="app.py を空いているポートで起動して試験する")
+    parser.add_argument("--users", type=int, default=2, help="同時ユーザー数")
+    parser.add_argument("--requests", type=int, help="送信するリクエストの総数")
+    parser.add_argument("--duration", type=float, help="試験時間（秒）。--requests と併用時は先に達した方で終了")
+    parser.add_argument("--mix", default="1:6,3:3,10:1", help="バッチサイズ:重み のカンマ区切り")
+    parser.add_argument("--think", type=float, default=0.0, help="ユーザーごとのリクエスト間隔（秒）")
+    parser.add_argument("--timeout", type=float, default=1800, help="1リクエストのタイムアウト（秒）")
+    parser.add_argument("--posts", type=int, default=100, help="擬似スレッドのレス数")
+    parser.add_argument("--images", type=int, default=1, help="擬似スレッドの1レスあたりの画像数")
+    parser.add_argument("--poll", type=float, default=1.0, help="/metrics の取得間隔（秒）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="結果（集計・リクエストごと・/metrics の推移）を保存するパス")
+    args = parser.parse_args(argv)
+    if args.requests is None and args.duration is None:
+        args.requests = args.users * 5
+
+    process = None
+    server = args.server
+    if args.spawn:
+        port = _free_port()
+        process = spawn_server(port)
+        server = f"http://127.0.0.1:{port}"
+
+    try:
+        with FakeMatomeSite() as site:
+            generator = LoadGenerator(server, site, parse_mix(args.mix),
+                                      {"posts": args.posts, "images": args.images},
+                                      args.timeout, args.think, args.seed)
+            with MetricsPoller(server, args.poll) as poller:
+                seconds = generator.run(args.users, args.requests, args.duration)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+
+    summary = summarize(generator.results, seconds, poller)
+    print(f"\n=== Load test: {args.users} users, mix {args.mix} -> {server} ===")
+    print(f"Requests: {summary['requests']} in {summary['seconds']}s, status {summary['status']}, "
+          f"error rate {summary['error_rate']}")
+    print("Latency (s): " + ", ".join(f"{k}={v}" for k, v in summary["latency_seconds"].items()))
+    print(f"Throughput: {summary['throughput']['requests_per_min']} req/min, "
+          f"{summary['throughput']['urls_per_min']} URLs/min")
+    print(f"Peak temp disk {summary['peak_temp_disk_mb']}MB, peak RSS {summary['peak_rss_mb']}MB, "
+          f"peak jobs in progress {summary['peak_jobs_in_progress']}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"params": vars(args), "summary": summary, "requests": generator.results,
+                       "metrics": poller.samples}, f, ensure_ascii=False, indent=2)
+    return 0 if summary["error_rate"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,182 @@
+# coding: utf-8
+"""
+合成スレッドHTMLの生成
+
+各抽出パターンのページ構造を模した、任意のレス数のHTMLを作る。
+画像（livedoor形式・サムネイル付きリンク・imgurリンク・imgur埋め込み）、
+広告ブロック、絵文字などの小さな画像を一定間隔で混ぜ、
+実ページに近い負荷で抽出処理を計測できるようにする。
+"""
+import random
+from typing import Callable, Dict, List
+
+PATTERNS = (
+    "pattern_standard",
+    "pattern_t_b_only",
+    "pattern_generic_2ch",
+    "pattern_dl_dt_dd",
+    "pattern_fallback",
+)
+
+_BODY_LINES = [
+    "それな", "ワイもそう思う", "画像貼るで", "ほんまか？", "草",
+    "ソースは？", "昔よく行ったわ", "これはええな", "どこで買えるんや", "うらやましい",
+]
+
+
+class _Thread:
+    """レスごとの見出し・本文・画像HTMLを決定的に生成する"""
+
+    def __init__(self, posts: int, seed: int):
+        self.posts = posts
+        self.random = random.Random(seed)
+        self.op_id = self._id()
+
+    def _id(self) -> str:
+        return "".join(self.random.choice("abcdefghijkmnpqrstuvwxyzABCDEFGHJKLMNPQRSTUVWXYZ0123456789")
+                       for _ in range(8))
+
+    def _hex(self) -> str:
+        return "%08x" % self.random.getrandbits(32)
+
+    def header(self, number: int) -> str:
+        post_id = self.op_id if number == 1 or self.random.random() < 0.15 else self._id()
+        second = number % 60
+        return f"{number}: 名無しさん＠おーぷん 25/03/23(日) 08:{(number // 60) % 60:02d}:{second:02d} ID:{post_id}"
+
+    def body_text(self) -> str:
+        return "<br>".join(self.random.choice(_BODY_LINES) for _ in range(self.random.randint(1, 3)))
+
+    def images(self, number: int) -> str:
+        """レス番号に応じて0〜2枚の画像HTMLを返す"""
+        parts = []
+        if number % 3 == 0:
+            h = self._hex()
+            parts.append(
+                f'<a href="https://livedoor.blogimg.jp/bench/imgs/{h[0]}/{h[1]}/{h}.jpg" target="_blank">'
+                f'<img src="https://livedoor.blogimg.jp/bench/imgs/{h[0]}/{h[1]}/{h}-s.jpg" width="400" height="300"></a>'
+            )
+        if number % 5 == 0:
+            h = self._hex()
+            parts.append(f'<img src="https://livedoor.blogimg.jp/bench/imgs/{h[0]}/{h[1]}/{h}.png" width="640" height="480">')
+        if number % 7 == 0:
+            imgur_id = self._id()[:7]
+            parts.append(f'<a href="https://i.imgur.com/{imgur_id}.jpg" target="_blank">https://i.imgur.com/{imgur_id}.jpg</a>')
+        if number % 11 == 0:
+            parts.append(f'<iframe class="imgur-embed-iframe-pub" src="https://imgur.com/{self._id()[:7]}/embed?context=false"'
+                         ' width="540" height="500"></iframe>')
+        if number % 13 == 0:
+            parts.append('<img src="https://parts.blog.livedoor.jp/img/emoji/2/1f605.gif" width="16" height="16">')
+        return "<br>".join(parts)
+
+    def ad_block(self) -> str:
+        return ('<div class="rss-block">記事の途中ですが、おすすめ記事です<ul>'
+                '<li><a href="https://example.net/archives/1.html">'
+                '<img src="https://example.net/thumb/rss1.jpg" width="80" height="80">グルメRSS</a></li>'
+                '</ul></div>')
+
+
+def _page(title: str, content: str) -> str:
+    return ('<!DOCTYPE html>\n<html lang="ja">\n<head><meta charset="utf-8">'
+            f"<title>{title}</title></head>\n<body>\n{content}\n"
+            '<aside class="sidebar"><div class="widget">'
+            '<img src="https://ad.example.com/banner/300x250.jpg" width="300" height="250"></div></aside>\n'
+            "</body>\n</html>\n")
+
+
+def _standard(thread: _Thread) -> str:
+    rows = []
+    for n in range(1, thread.posts + 1):
+        rows.append(f'<div class="t_h">{thread.header(n)}</div>')
+        rows.append(f'<div class="t_b">{thread.body_text()}<br>{thread.images(n)}</div>')
+        if n % 50 == 0:
+            rows.append(f'<div class="t_b">{thread.ad_block()}</div>')
+    return _page("【合成】標準パターン", '<main id="main" class="main"><article class="post"><div class="entry-content">\n'
+                 + "\n".join(rows) + "\n</div></article></main>")
+
+
+def _t_b_only(thread: _Thread) -> str:
+    rows = []
+    for n in range(1, thread.posts + 1):
+        rows.append(f'<div class="t_b">{thread.header(n)}<br>{thread.body_text()}<br>{thread.images(n)}</div>')
+        if n % 50 == 0:
+            rows.append('<div class="t_b">記事の途中ですが、スポンサーリンク</div>')
+    return _page("【合成】t_bのみ", '<article class="article"><div class="article-body">\n'
+                 + "\n".join(rows) + "\n</div></article>")
+
+
+def _generic_2ch(thread: _Thread) -> str:
+    rows = []
+    for n in range(1, thread.posts + 1):
+        rows.append(f"<div>{thread.header(n)}</div>")
+        rows.append(f"<div>{thread.body_text()}<br>{thread.images(n)}</div>")
+        if n % 50 == 0:
+            rows.append(f'<div class="ad-area">{thread.ad_block()}</div>')
+    return _page("【合成】汎用2ch", '<div id="container"><div class="article-body">\n'
+                 + "\n".join(rows) + "\n</div></div>")
+
+
+def _dl_dt_dd(thread: _Thread) -> str:
+    rows = []
+    for n in range(1, thread.posts + 1):
+        rows.append(f"<dt>{thread.header(n)}</dt>")
+        rows.append(f"<dd>{thread.body_text()}<br>{thread.images(n)}</dd>")
+    return _page("【合成】dl/dt/dd", '<div id="main"><div class="main-text"><dl>\n'
+                 + "\n".join(rows) + "\n</dl></div></div>")
+
+
+def _fallback(thread: _Thread) -> str:
+    rows = []
+    for n in range(1, thread.posts + 1):
+        rows.append(f"<p>{thread.body_text()}</p>")
+        images = thread.images(n)
+        if images:
+            rows.append(f"<p>{images}</p>")
+        if n % 50 == 0:
+            rows.append('<div class="sponsor-box"><img src="https://ads.example.com/banners/728x90.png"'
+                        ' width="728" height="90"></div>')
+    return _page("【合成】フォールバック", '<article class="post"><div class="entry-content">\n'
+                 + "\n".join(rows) + "\n</div></article>")
+
+
+_GENERATORS: Dict[str, Callable[[_Thread], str]] = {
+    "pattern_standard": _standard,
+    "pattern_t_b_only": _t_b_only,
+    "pattern_generic_2ch": _generic_2ch,
+    "pattern_dl_dt_dd": _dl_dt_dd,
+    "pattern_fallback": _fallback,
+}
+
+
+def generate_thread_html(pattern: str, posts: int = 1000, seed: int = 0) -> str:
+    """
+    指定パターンの合成スレッドHTMLを生成（同じ引数なら同じHTML）
+
+    Args:
+        pattern: パターン名（PATTERNS のいずれか）
+        posts: レス数（フォールバックでは段落数）
+        seed: 乱数シード
+    """
+    if pattern not in _GENERATORS:
+        raise ValueError(f"Unknown pattern: {pattern}")
+    return _GENERATORS[pattern](_Thread(posts, seed))
+
+
+def sample_image_urls(count: int = 1000, seed: int = 0) -> List[str]:
+    """画像ID正規化の計測用に、実際に出現する形式の画像URLを生成"""
+    thread = _Thread(count, seed)
+    urls = []
+    for i in range(count):
+        h = thread._hex()
+        kind = i % 5
+        if kind == 0:
+            urls.append(f"https://livedoor.blogimg.jp/bench/imgs/{h[0]}/{h[1]}/{h}-s.jpg")
+        elif kind == 1:
+            urls.append(f"https://livedoor.blogimg.jp/bench/imgs/{h[0]}/{h[1]}/{h}.jpg")
+        elif kind == 2:
+            urls.append(f"https://i.imgur.com/{thread._id()[:7]}.png")
+        elif kind == 3:
+            urls.append(f"https://tabinolog.com/wp-content/uploads/2025/02/photo{i}-640x480.jpg")
+        else:
+            urls.append(f"https://cdn.example.jp/photos/{i}.webp?w=800")
+    return urls
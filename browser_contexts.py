@@ -0,0 +1,243 @@
+# coding: utf-8
+"""
+ホストごとのブラウザコンテキスト
+
+同じまとめブログのスレッドを続けて処理するとき、CSS・JS・フォント・ヘッダー画像を
+毎回ダウンロードし直さないよう、ホストごとに BrowserContext を使い回す。
+Cookie（同意バナー・年齢確認など）もコンテキストに残るので、2件目以降のページは
+同意画面を経ずに表示される。
+
+- 既定: 1つの Chromium の中にホストごとのコンテキストを作る（キャッシュはメモリ上、
+  バッチの実行中だけ有効）
+- プロファイルフォルダ指定時（--browser-profile-dir / BROWSER_PROFILE_DIR）:
+  すべてのホストで1つの永続コンテキスト（launch_persistent_context）を共有し、ディスクキャッシュと
+  Cookie を次回の実行にも引き継ぐ。永続コンテキストは Chromium を1つずつ起動するため、ホストごとに
+  作るとホスト数だけ Chromium が起動してメモリが増える（キャッシュ・Cookie はもともとサイトごとに
+  分かれているので、共有しても混ざらない）。使用期間とページ数の上限で入れ替えるのは既定と同じ
+
+同時に開くコンテキスト数は LRU で、1つのコンテキストの使用期間とページ数は上限で
+制限する（長時間のバッチでメモリが増え続けないように）。プロファイルフォルダは
+起動時に、最終使用から一定日数が経ったものと、合計サイズの上限を超えた古いものを削除する。
+"""
+import logging
+import os
+import shutil
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+
+from prometheus_metrics import directory_size_bytes
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_CONTEXTS = 4          # 同時に開いておくホスト数
+DEFAULT_CONTEXT_MAX_AGE = 600     # 1つのコンテキストを使い続ける最長時間（秒）
+DEFAULT_CONTEXT_MAX_PAGES = 50    # 1つのコンテキストで開く最大ページ数
+DEFAULT_DISK_CACHE_MB = 64        # 永続コンテキストごとのディスクキャッシュ上限
+DEFAULT_PROFILE_MAX_MB = 1024     # プロファイルフォルダ全体の上限
+DEFAULT_PROFILE_MAX_DAYS = 7      # 最終使用からこの日数が経ったプロファイルは削除
+
+# プロファイルの最終使用時刻を記録するファイル（Chromium が書き換えるファイルの mtime は当てにならない）
+LAST_USED_FILE = ".last_used"
+# Chromium が使用中のプロファイルに作るロックファイル（Linux/macOS と Windows）
+PROFILE_LOCK_FILES = ("SingletonLock", "lockfile")
+# 全ホストで共有する永続コンテキストのプロファイル名（プロファイルフォルダの下のフォルダ）
+SHARED_PROFILE = "shared"
+
+
+def host_key(url: str) -> str:
+    """コンテキストを共有する単位（ホスト名。www. は区別しない）"""
+    host = (urlsplit(url).hostname or "").lower()
+    if host.startswith("www."):
+        host = host[4:]
+    return host or "_"
+
+
+def default_profile_dir() -> Optional[str]:
+    return os.environ.get("BROWSER_PROFILE_DIR") or None
+
+
+def prune_profiles(profile_dir: str, max_bytes: int, max_age_seconds: float) -> List[str]:
+    """
+    古いプロファイルを削除し、削除したフォルダ名を返す（以前のバージョンが作ったホストごとのフォルダも対象）
+
+    最終使用から max_age_seconds が経ったものを削除したあと、合計サイズが max_bytes を
+    超えていれば最終使用が古い順に削除する。別のプロセスが使用中のプロファイルは削除しない。
+    """
+    if not os.path.isdir(profile_dir):
+        return []
+    entries = []
+    for name in os.listdir(profile_dir):
+        path = os.path.join(profile_dir, name)
+        if not os.path.isdir(path):
+            continue
+        if any(os.path.lexists(os.path.join(path, lock)) for lock in PROFILE_LOCK_FILES):
+            continue
+        marker = os.path.join(path, LAST_USED_FILE)
+        last_used = os.path.getmtime(marker if os.path.exists(marker) else path)
+        entries.append((last_used, name, path, directory_size_bytes([path])))
+
+    now = time.time()
+    total = sum(size for *_, size in entries)
+    removed = []
+    for last_used, name, path, size in sorted(entries):
+        if now - last_used <= max_age_seconds and total <= max_bytes:
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+        removed.append(name)
+    if removed:
+        logger.info("Removed %d browser profile(s) from %s: %s", len(removed), profile_dir, ", ".join(removed))
+    return removed
+
+
+class _HostContext:
+    def __init__(self, host: str, context):
+        self.host = host
+        self.context = context
+        self.created_at = time.monotonic()
+        self.pages = 0
+        self.open_pages = []
+
+    def has_open_pages(self) -> bool:
+        self.open_pages = [page for page in self.open_pages if not page.is_closed()]
+        return bool(self.open_pages)
+
+
+class HostContextPool:
+    """
+    ホストごとの BrowserContext を使い回して new_page する
+
+    Playwright の同期APIはスレッドをまたいで使えないため、1つのスレッドから使う。
+    close() で開いているコンテキストとブラウザをすべて閉じる。
+
+    上限（ページ数・使用期間・ホスト数）で入れ替えるコンテキストにまだ開いているページがある場合
+    （複数ページのスレッドを同時に読み込んでいる途中など）は、そのページがすべて閉じられてから閉じる。
+    """
+
+    def __init__(self, browser_type, profile_dir: Optional[str] = None,
+                 max_contexts: int = DEFAULT_MAX_CONTEXTS,
+                 max_age: float = DEFAULT_CONTEXT_MAX_AGE,
+                 max_pages: int = DEFAULT_CONTEXT_MAX_PAGES,
+                 disk_cache_mb: int = DEFAULT_DISK_CACHE_MB,
+                 profile_max_mb: Optional[int] = None, profile_max_days: Optional[float] = None):
+        self.browser_type = browser_type
+        self.profile_dir = os.path.abspath(profile_dir) if profile_dir else None
+        self.max_contexts = max(1, max_contexts)
+        self.max_age = max_age
+        self.max_pages = max(1, max_pages)
+        self.disk_cache_mb = disk_cache_mb
+        self._browser = None
+        self._contexts: "OrderedDict[str, _HostContext]" = OrderedDict()
+        # 入れ替え済みで、開いているページが閉じられるのを待っているコンテキスト
+        self._retired: List[_HostContext] = []
+        self.stats: Dict[str, int] = {"contexts": 0, "reused_pages": 0}
+
+        if self.profile_dir:
+            if profile_max_mb is None:
+                profile_max_mb = int(os.environ.get("BROWSER_PROFILE_MAX_MB", DEFAULT_PROFILE_MAX_MB))
+            if profile_max_days is None:
+                profile_max_days = float(os.environ.get("BROWSER_PROFILE_MAX_DAYS", DEFAULT_PROFILE_MAX_DAYS))
+            os.makedirs(self.profile_dir, exist_ok=True)
+            prune_profiles(self.profile_dir, profile_max_mb * 1048576, profile_max_days * 86400)
+
+    @property
+    def browser(self):
+        """コンテキストを作る共有の Chromium（最初に必要になったときに起動）"""
+        if self._browser is None:
+            self._browser = self.browser_type.launch(headless=True)
+        return self._browser
+
+    def _context_key(self, url: str) -> str:
+        # プロファイルフォルダ指定時は全ホストで1つの永続コンテキストを使う
+        return SHARED_PROFILE if self.profile_dir else host_key(url)
+
+    def new_page(self, url: str):
+        """url のホスト用のコンテキストで新しいページを開く"""
+        host = self._context_key(url)
+        self._close_retired()
+        entry = self._contexts.get(host)
+        if entry is not None and (entry.pages >= self.max_pages
+                                  or time.monotonic() - entry.created_at > self.max_age):
+            logger.debug("Recycling browser context for %s after %d page(s)", host, entry.pages)
+            self._retire_context(host)
+            entry = None
+
+        if entry is None:
+            while len(self._contexts) >= self.max_contexts:
+                self._retire_context(next(iter(self._contexts)))
+            started = time.perf_counter()
+            entry = self._contexts[host] = self._open_context(host)
+            if not self.stats["contexts"]:
+                # 最初のコンテキスト（Chromium の起動を含む）。benchmarks/bench_startup.py がこの行を待つ
+                logger.info("Browser started in %.0fms", (time.perf_counter() - started) * 1000)
+            self.stats["contexts"] += 1
+        else:
+            self._contexts.move_to_end(host)
+            self.stats["reused_pages"] += 1
+
+        entry.pages += 1
+        page = entry.context.new_page()
+        entry.open_pages.append(page)
+        return page
+
+    def _open_context(self, host: str) -> _HostContext:
+        if self.profile_dir:
+            user_data_dir = os.path.join(self.profile_dir, host)
+            try:
+                context = self.browser_type.launch_persistent_context(
+                    user_data_dir, headless=True,
+                    args=[f"--disk-cache-size={self.disk_cache_mb * 1048576}"],
+                )
+                with open(os.path.join(user_data_dir, LAST_USED_FILE), "w", encoding="utf-8") as f:
+                    f.write(time.strftime("%Y-%m-%dT%H:%M:%S"))
+                logger.debug("Opened persistent browser context: %s", user_data_dir)
+                return _HostContext(host, context)
+            except Exception as e:
+                # 別のワーカーが同じプロファイルを使用中（Chromium のロック）など。
+                # 一時的なコンテキストは共有の Chromium に作るので、起動する Chromium は増えない
+                logger.warning("Could not open browser profile %s (%s); using a temporary context",
+                               user_data_dir, e)
+        logger.debug("Opened browser context for %s", host)
+        return _HostContext(host, self.browser.new_context())
+
+    def _retire_context(self, host: str) -> None:
+        """コンテキストを使わなくする（開いているページがあれば、閉じられてから閉じる）"""
+        entry = self._contexts.pop(host)
+        if entry.has_open_pages():
+            self._retired.append(entry)
+        else:
+            self._close_entry(entry)
+
+    def _close_retired(self) -> None:
+        for entry in list(self._retired):
+            if not entry.has_open_pages():
+                self._retired.remove(entry)
+                self._close_entry(entry)
+
+    @staticmethod
+    def _close_entry(entry: _HostContext) -> None:
+        try:
+            entry.context.close()
+        except Exception as e:
+            logger.debug("Failed to close browser context for %s: %s", entry.host, e)
+
+    def close(self) -> None:
+        for entry in self._retired + list(self._contexts.values()):
+            self._close_entry(entry)
+        self._retired = []
+        self._contexts.clear()
+        if self._browser is not None:
+            self._browser.close()
+            self._browser = None
+        if self.stats["contexts"]:
+            logger.info("Browser contexts: %d opened, %d page(s) reused a context",
+                        self.stats["contexts"], self.stats["reused_pages"])
+
+
+def open_page(browser, url: str):
+    """HostContextPool ならホストごとのコンテキストで、Browser ならそのまま新しいページを開く"""
+    if isinstance(browser, HostContextPool):
+        return browser.new_page(url)
+    return browser.new_page()
@@ -0,0 +1,199 @@
+# coding: utf-8
+"""
+ブラウザ内でのスレッド部分の切り出し（--dom-extract / DOM_EXTRACT）
+
+page.content() は広告・サイドバー・インラインスクリプトを含むDOM全体をシリアライズし、
+Python側でそれをすべて解析し直す。対応パターン（.t_h/.t_b、.t_b のみ、dl/dt/dd）では、
+ページ内のスクリプトでパターン判定と抽出対象の要素の選択を行い、
+タイトル・投稿の要素・スレ主ID（と複数ページのスレッドの他のページへのリンク）だけからなる
+小さなHTMLを返す。
+
+投稿・画像の抽出そのものは従来の抽出器（extractors/）が行うため、抽出結果は
+ページ全体を解析した場合と同じになる（benchmarks/dom_extract_parity.py で確認）。
+次の場合は呼び出し元で page.content() による従来の処理に戻す。
+
+- 対応していないパターン（generic_2ch・fallback）や、投稿の要素が入れ子になっている場合
+- 切り出したHTMLでの判定パターンがブラウザ内の判定と一致しない場合
+- 投稿がない・画像が1枚もない・抽出パターンのフォールバックが起きた場合
+  （フォールバックの抽出器はページ全体を見るため）
+"""
+import logging
+import os
+from typing import TYPE_CHECKING, NamedTuple, Optional
+
+if TYPE_CHECKING:
+    from page_parser import ParsedPage
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_PATTERNS = ("pattern_standard", "pattern_t_b_only", "pattern_dl_dt_dd")
+
+# extractors/pattern_detector.py・各抽出器と同じ順でセレクターを試す
+_EXTRACT_JS = r"""
+() => {
+    const all = (root, selector) => Array.from(root.querySelectorAll(selector));
+    const hasClass = (el, name) => el.classList.contains(name);
+    // BeautifulSoup の get_text() 相当（script / style / template の中身とコメントは含めない）
+    const textOf = (el, strip) => {
+        const parts = [];
+        const walker = document.createTreeWalker(el, NodeFilter.SHOW_TEXT);
+        for (let node = walker.nextNode(); node; node = walker.nextNode()) {
+            const parent = node.parentElement ? node.parentElement.localName : "";
+            if (parent === "script" || parent === "style" || parent === "template") {
+                continue;
+            }
+            const text = strip ? node.data.trim() : node.data;
+            if (text) {
+                parts.push(text);
+            }
+        }
+        return parts.join("");
+    };
+    const header = /^\d+:/;
+    const classify = (targets) => {
+        const th = targets.filter(t => hasClass(t, "t_h")).length;
+        const tb = targets.filter(t => hasClass(t, "t_b")).length;
+        if (th > 0 && tb > 0) {
+            return "pattern_standard";
+        }
+        return tb > 0 ? "pattern_t_b_only" : null;
+    };
+
+    // パターン判定（detect_extraction_pattern）
+    let pattern = null;
+    const detectMain = document.querySelector("article.post, article.article, main#main.main article");
+    if (detectMain) {
+        pattern = classify(all(detectMain,
+            ".entry-content .t_h, .entry-content .t_b, .article-body .t_h, .article-body .t_b, .t_h, .t_b"));
+    }
+    if (!pattern) {
+        pattern = classify(all(document,
+            ".article-body .t_h, .article-body .t_b, .entry-content .t_h, .entry-content .t_b, .t_h, .t_b"));
+    }
+    if (!pattern) {
+        const article = document.querySelector("article, .article-body, .entry-content, #article-body");
+        if (article && Array.from(article.children).some(el =>
+                ["div", "p", "blockquote"].includes(el.localName) && header.test(textOf(el, true)))) {
+            return null;  // pattern_generic_2ch
+        }
+    }
+
+    // 抽出器が使う要素
+    let fragments = [];
+    let wrap = true;
+    if (pattern === "pattern_standard") {
+        let main = null;
+        for (const selector of ["article.post", "article.article", "main#main.main article", "article",
+                                ".entry-content", ".article-body", "#main article"]) {
+            main = document.querySelector(selector);
+            if (main) {
+                break;
+            }
+        }
+        const selectors = main
+            ? [".entry-content .t_h, .entry-content .t_b", ".article-body .t_h, .article-body .t_b",
+               ".t_h, .t_b", "div.t_h, div.t_b"]
+            : [".article-body .t_h, .article-body .t_b", ".entry-content .t_h, .entry-content .t_b",
+               ".t_h, .t_b", "div.t_h, div.t_b", "article .t_h, article .t_b", "main .t_h, main .t_b"];
+        for (const selector of selectors) {
+            fragments = all(main || document, selector);
+            if (fragments.length) {
+                break;
+            }
+        }
+    } else if (pattern === "pattern_t_b_only") {
+        const main = document.querySelector("article.post, article.article, main#main.main article, .entry-content");
+        fragments = all(main || document, ".t_b");
+    } else {
+        const matching = all(document, "dl").filter(dl => Array.from(dl.children).some(el =>
+            el.localName === "dt" && header.test(textOf(el, true))));
+        if (!matching.length) {
+            return null;  // pattern_fallback
+        }
+        pattern = "pattern_dl_dt_dd";
+        fragments = matching.filter(dl => !matching.some(other => other !== dl && other.contains(dl)));
+        wrap = false;
+    }
+    // 切り出した要素だけで同じパターンと判定されない・要素が入れ子の場合は対象外
+    if (wrap && (classify(fragments) !== pattern || fragments.some(el => el.querySelector(".t_h, .t_b")))) {
+        return null;
+    }
+
+    // スレ主ID（detect_thread_creator_ids と同じクラス名の要素から）
+    const opClass = /(op|thread-creator|author|postauthor)/i;
+    const opIds = new Set();
+    all(document, "[class]").forEach(el => {
+        if (opClass.test(el.getAttribute("class")) || Array.from(el.classList).some(c => opClass.test(c))) {
+            const match = /ID:([A-Za-z0-9]+)/.exec(textOf(el, false));
+            if (match) {
+                opIds.add(match[1]);
+            }
+        }
+    });
+
+    // 同じスレッドの他のページへのリンク（extractors/pagination.py が判定する）
+    const pageLink = /[?&](p|page|pg|paged)=\d+|\/(page\/)?\d+\/?(#.*)?$/;
+    const escape = value => value.replace(/&/g, "&amp;").replace(/"/g, "&quot;").replace(/</g, "&lt;");
+    // rel="next" / "prev" か、ページ送りの要素の中のリンクだけ（pagination.is_pager_link と同じ条件）
+    const pagerName = /paginat|pagenat|pager|paging|pagenavi|page-?nav|nav-links|page-?links|page-numbers|thread-pages/i;
+    const isPagerLink = el => {
+        if (/(^|\s)(next|prev|previous)(\s|$)/i.test(el.getAttribute("rel") || "")) {
+            return true;
+        }
+        let node = el;
+        for (let depth = 0; depth <= 5 && node && node !== document.body; depth++, node = node.parentElement) {
+            if (pagerName.test((node.getAttribute("class") || "") + " " + (node.id || ""))) {
+                return true;
+            }
+        }
+        return false;
+    };
+    const pageUrls = new Set(all(document, "a[href], link[href]").filter(isPagerLink).map(el => el.href)
+        .filter(href => typeof href === "string" && pageLink.test(href)));
+
+    const title = document.querySelector("title");
+    const body = fragments.map(el => el.outerHTML).join("");
+    const html = "<html><head>" + (title ? title.outerHTML : "") + "</head><body>"
+        + (wrap ? '<article class="post"><div class="entry-content">' + body + "</div></article>" : body)
+        + Array.from(opIds).map(id => '<div class="op">ID:' + id + "</div>").join("")
+        + '<div class="thread-pages">'
+        + Array.from(pageUrls).map(href => '<a href="' + escape(href) + '"></a>').join("") + "</div>"
+        + "</body></html>";
+    return {pattern: pattern, html: html, fragments: fragments.length};
+}
+"""
+
+
+class ThreadHtml(NamedTuple):
+    """ブラウザ内で切り出したスレッド部分"""
+    pattern: str       # ブラウザ内で判定したパターン
+    html: str          # タイトル・投稿の要素・スレ主IDだけのHTML
+    fragments: int     # 切り出した要素の数
+
+
+def default_dom_extract() -> bool:
+    return os.environ.get("DOM_EXTRACT", "").strip().lower() in ("1", "true", "yes", "on")
+
+
+def extract_thread_html(page) -> Optional[ThreadHtml]:
+    """対応パターンならスレッド部分だけのHTMLを返す（対象外・失敗時は None）"""
+    try:
+        result = page.evaluate(_EXTRACT_JS)
+    except Exception as e:
+        logger.debug("In-browser extraction failed: %s", e)
+        return None
+    if not result or result.get("pattern") not in SUPPORTED_PATTERNS:
+        return None
+    return ThreadHtml(result["pattern"], result["html"], int(result["fragments"]))
+
+
+def matches_full_page(parsed: "ParsedPage", thread: ThreadHtml) -> bool:
+    """
+    切り出したHTMLの抽出結果を、ページ全体を解析した場合と同じとみなせるか
+
+    フォールバックの抽出器はページ全体を対象にするため、フォールバックが起きた場合や
+    その条件（投稿がない・画像がない）に当たる場合は使わない。
+    """
+    return (parsed.pattern == thread.pattern
+            and parsed.pattern_fallbacks == 0
+            and any(post.images for post in parsed.posts))
@@ -10,6 +10,20 @@ import requests
 from urllib.parse import urljoin
 
 
+def extract_image_id(url: str) -> str:
+    """画像IDを抽出（重複チェック用）"""
+    patterns = [
+        r'/([a-zA-Z0-9]{7,})(?:-[a-z0-9]+)?\.(?:jpg|jpeg|png|gif|webp)',
+        r'/([a-zA-Z0-9]{7,})\.(?:jpg|jpeg|png|gif|webp)',
+        r'([a-zA-Z0-9]{7,})(?:-[a-z0-9]+)?\.(?:jpg|jpeg|png|gif|webp)',
+    ]
+    for pattern in patterns:
+        match = re.search(pattern, url, re.IGNORECASE)
+        if match:
+            return match.group(1).lower()
+    return url.split('?')[0].lower()
+
+
 class BaseExtractor:
     """抽出パターンの基底クラス"""
     
@@ -128,19 +142,6 @@ class BaseExtractor:
         image_urls = []
         seen_ids = set()
         
-        def extract_image_id(url: str) -> str:
-            """画像IDを抽出（重複チェック用）"""
-            patterns = [
-                r'/([a-zA-Z0-9]{7,})(?:-[a-z0-9]+)?\.(?:jpg|jpeg|png|gif|webp)',
-                r'/([a-zA-Z0-9]{7,})\.(?:jpg|jpeg|png|gif|webp)',
-                r'([a-zA-Z0-9]{7,})(?:-[a-z0-9]+)?\.(?:jpg|jpeg|png|gif|webp)',
-            ]
-            for pattern in patterns:
-                match = re.search(pattern, url, re.IGNORECASE)
-                if match:
-                    return match.group(1).lower()
-            return url.split('?')[0].lower()
-        
         # STEP 1: <img>タグから抽出
         local_images = []
         imgur_urls_in_post = []
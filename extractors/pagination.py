@@ -0,0 +1,141 @@
+# coding: utf-8
+"""
+複数ページに分かれたスレッドの検出と結合
+
+まとめ記事の中には、1つのスレッドを複数のページ（?p=2、/2/、「次のページ」リンク）に
+分けて掲載するものがある。ページ内のリンクから同じ記事の2ページ目以降のURLを探し、
+取得した各ページの投稿を1つのスレッドとして結合する。
+
+同じ記事のページとみなすのは、次のいずれかの形のURLだけ（別の記事へのリンクは対象外）:
+
+- 同じパスで、クエリの p / page / pg / paged だけが異なる   例: /archives/123.html?p=2
+- パスの末尾に /N または /page/N を付けたもの             例: /archives/123.html/2/
+
+ただし、トップページ（パスが /）はパスで記事を表していないので、/N は別のページ（記事一覧など）、
+?p=N は WordPress の記事IDとみなす。記事のURL自体が ?p=123 の場合、p はページ番号ではない。
+さらに、rel="next" / "prev" のリンクか、ページ送りの要素（class・id が pagination など）の中の
+リンクだけを使う（本文・サイドバーの関連記事へのリンクを取り違えない）。
+"""
+
+import re
+from typing import TYPE_CHECKING, Iterable, List, Optional, Tuple
+from urllib.parse import parse_qsl, urljoin, urlsplit
+
+from post_record import Post
+
+if TYPE_CHECKING:
+    from bs4 import BeautifulSoup
+
+# ページ番号を表すクエリのキー
+PAGE_QUERY_KEYS = ("p", "page", "pg", "paged")
+
+# 1スレッドとして取得する最大ページ数（1ページ目を含む）
+DEFAULT_MAX_PAGES = 10
+
+# これより大きい番号はページ番号とみなさない（記事IDなどとの取り違えを防ぐ）
+MAX_PAGE_NUMBER = 999
+
+_PATH_PAGE = re.compile(r"^(?:/page)?/(\d+)/?$")
+
+# ページ送りの要素の class・id（dom_extract.py の thread-pages を含む）
+_PAGER = re.compile(r"paginat|pagenat|pager|paging|pagenavi|page-?nav|nav-links|page-?links|page-numbers|"
+                    r"thread-pages", re.IGNORECASE)
+
+# ページ送りの要素を探す祖先の段数
+PAGER_MAX_DEPTH = 5
+
+
+def page_number(link: str, url: str) -> Optional[int]:
+    """link が url の記事の何ページ目か（同じ記事のページでなければ None）"""
+    base = urlsplit(url)
+    target = urlsplit(link)
+    if target.scheme not in ("http", "https") or (target.hostname or "") != (base.hostname or ""):
+        return None
+
+    base_params = parse_qsl(base.query)
+    # 記事のURL自体が ?p=123（WordPress の記事ID）なら、p はページ番号ではない
+    page_keys = [key for key in PAGE_QUERY_KEYS if not (key == "p" and key in dict(base_params))]
+    base_query = [(k, v) for k, v in base_params if k not in page_keys]
+    at_root = base.path in ("", "/")
+
+    number = None
+    if target.path == base.path:
+        if at_root and not base_query:
+            # トップページの ?p=N / ?page=N は別の記事・記事一覧
+            return None
+        target_query = []
+        for key, value in parse_qsl(target.query):
+            if key in page_keys and value.isdigit():
+                number = int(value)
+            else:
+                target_query.append((key, value))
+        if sorted(base_query) != sorted(target_query):
+            return None
+    elif not at_root and target.path.startswith(base.path.rstrip("/") + "/"):
+        match = _PATH_PAGE.match(target.path[len(base.path.rstrip("/")):])
+        if match:
+            number = int(match.group(1))
+
+    if number is None or not 1 <= number <= MAX_PAGE_NUMBER:
+        return None
+    return number
+
+
+def is_pager_link(link) -> bool:
+    """rel="next" / "prev" のリンク、またはページ送りの要素の中のリンクか"""
+    rel = link.get("rel") or []
+    if isinstance(rel, str):
+        rel = rel.split()
+    if any(value.lower() in ("next", "prev", "previous") for value in rel):
+        return True
+    element = link
+    for _ in range(PAGER_MAX_DEPTH + 1):
+        if element is None or element.name in (None, "body", "html", "[document]"):
+            return False
+        names = list(element.get("class") or []) + [element.get("id") or ""]
+        if any(_PAGER.search(name) for name in names if name):
+            return True
+        element = element.parent
+    return False
+
+
+def find_page_urls(soup: "BeautifulSoup", url: str) -> List[str]:
+    """
+    ページ内のリンクから同じ記事の2ページ目以降のURLを探し、ページ番号順に返す
+
+    ページ送り（1 2 3 …）の要素の中のリンクと rel="next" の両方を見る。
+    「次のページ」しかないサイトでは、取得したページでさらに探す（呼び出し元で繰り返す）。
+    """
+    pages = {}
+    for link in soup.find_all(["a", "link"], href=True):
+        if not is_pager_link(link):
+            continue
+        href = urljoin(url, link["href"]).split("#", 1)[0]
+        number = page_number(href, url)
+        if number is not None and number >= 2 and number not in pages:
+            pages[number] = href
+    return [pages[number] for number in sorted(pages)]
+
+
+def merge_pages(pages: Iterable[Tuple[str, Iterable[Post]]]) -> List[Post]:
+    """
+    各ページの投稿を1つのスレッドに結合する
+
+    画像URLは各ページのURLで絶対URLにする。ページをまたいで同じレス番号の投稿
+    （各ページの先頭に再掲される >>1 など）は最初のものだけを残す。
+
+    Args:
+        pages: (ページURL, そのページの投稿) をページ順に
+    """
+    merged = []
+    seen_numbers = set()
+    for page_url, posts in pages:
+        for post in posts:
+            match = re.match(r"^(\d+):", post.header.strip())
+            if match:
+                if match.group(1) in seen_numbers:
+                    continue
+                seen_numbers.add(match.group(1))
+            images = tuple(image._replace(url=urljoin(page_url, image.url)) for image in post.images)
+            merged.append(post._replace(images=images))
+    return merged
@@ -76,6 +76,12 @@ def get_extractor_module_name(pattern: str) -> str:
     return f"extractors.{pattern}"
 
 
+# 命名規則（pattern_standard -> StandardExtractor）に従わないクラス名
+EXTRACTOR_CLASS_NAMES = {
+    "pattern_t_b_only": "T_B_OnlyExtractor",
+}
+
+
 def get_extractor_class_name(pattern: str) -> str:
     """
     パターン名からクラス名を取得
@@ -86,6 +92,8 @@ def get_extractor_class_name(pattern: str) -> str:
     Returns:
         クラス名（例: "StandardExtractor"）
     """
+    if pattern in EXTRACTOR_CLASS_NAMES:
+        return EXTRACTOR_CLASS_NAMES[pattern]
     # pattern_standard -> StandardExtractor
     parts = pattern.split("_")
     class_name = "".join(word.capitalize() for word in parts[1:]) + "Extractor"
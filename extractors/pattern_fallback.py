@@ -4,6 +4,7 @@
 どのパターンにも該当しない場合、ページ全体から画像を抽出
 """
 
+import logging
 import re
 from typing import List, Dict
 from bs4 import BeautifulSoup
@@ -11,6 +12,8 @@ from urllib.parse import urljoin
 
 from extractors.base import BaseExtractor
 
+logger = logging.getLogger(__name__)
+
 
 class FallbackExtractor(BaseExtractor):
     """パターン5: フォールバック"""
@@ -19,7 +22,7 @@ class FallbackExtractor(BaseExtractor):
         """パターン5で投稿を抽出"""
         posts = []
         
-        print("[INFO] .t_h/.t_b要素が見つかりません。ページ全体から画像を抽出します。")
+        logger.info(".t_h/.t_b要素が見つかりません。ページ全体から画像を抽出します。")
         
         # メイン記事エリアを特定
         main_article = soup.select_one("article.post, article.article, main#main.main article, .entry-content")
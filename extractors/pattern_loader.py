@@ -5,6 +5,7 @@
 """
 
 import importlib
+import logging
 from typing import Optional, Type
 from bs4 import BeautifulSoup
 import requests
@@ -15,6 +16,9 @@ from extractors.pattern_detector import (
     get_extractor_module_name,
     get_extractor_class_name
 )
+from scrape_logging import log_stage
+
+logger = logging.getLogger(__name__)
 
 
 def load_extractor(pattern: str, session: requests.Session, base_url: str) -> Optional[BaseExtractor]:
@@ -47,11 +51,11 @@ def load_extractor(pattern: str, session: requests.Session, base_url: str) -> Op
         
         return extractor
     except Exception as e:
-        print(f"[ERROR] Failed to load extractor for pattern {pattern}: {e}")
+        logger.error("Failed to load extractor for pattern %s: %s", pattern, e)
         return None
 
 
-def extract_posts_from_page(soup: BeautifulSoup, session: requests.Session, base_url: str) -> list:
+def extract_posts_from_page(soup: BeautifulSoup, session: requests.Session, base_url: str, metrics=None) -> list:
     """
     ページから投稿を抽出（パターン自動選択）
     
@@ -59,20 +63,34 @@ def extract_posts_from_page(soup: BeautifulSoup, session: requests.Session, base
         soup: BeautifulSoupオブジェクト
         session: HTTPセッション
         base_url: ベースURL
+        metrics: UrlMetrics（指定時は判定・抽出の所要時間とパターンを記録）
     
     Returns:
         投稿のリスト
     """
+    if metrics is None:
+        metrics = _NullMetrics()
+    
     # パターンを判定
-    pattern = detect_extraction_pattern(soup)
-    print(f"[INFO] Detected extraction pattern: {pattern}")
+    with metrics.stage("detect"):
+        pattern = detect_extraction_pattern(soup)
+    metrics.pattern = pattern
+    logger.info("Detected extraction pattern: %s", pattern)
     
+    with metrics.stage("extract"):
+        return _extract_with_fallback(pattern, soup, session, base_url, metrics)
+
+
+def _extract_with_fallback(pattern: str, soup: BeautifulSoup, session: requests.Session,
+                           base_url: str, metrics) -> list:
+    """判定したパターンで抽出し、失敗時はフォールバックパターンを試行"""
     # 抽出器を読み込む
     extractor = load_extractor(pattern, session, base_url)
     
     if not extractor:
-        print(f"[ERROR] Failed to load extractor, trying fallback pattern")
+        logger.error("Failed to load extractor, trying fallback pattern")
         # フォールバックパターンを試行
+        metrics.pattern_fallbacks += 1
         extractor = load_extractor("pattern_fallback", session, base_url)
         if not extractor:
             return []
@@ -81,10 +99,11 @@ def extract_posts_from_page(soup: BeautifulSoup, session: requests.Session, base
     try:
         posts = extractor.extract(soup)
     except Exception as e:
-        print(f"[ERROR] Extraction failed for pattern {pattern}: {e}")
+        logger.error("Extraction failed for pattern %s: %s", pattern, e)
         # エラーが発生した場合、フォールバックパターンを試行
         if pattern != "pattern_fallback":
-            print(f"[INFO] Trying fallback pattern")
+            logger.info("Trying fallback pattern")
+            metrics.pattern_fallbacks += 1
             fallback_extractor = load_extractor("pattern_fallback", session, base_url)
             if fallback_extractor:
                 posts = fallback_extractor.extract(soup)
@@ -96,12 +115,23 @@ def extract_posts_from_page(soup: BeautifulSoup, session: requests.Session, base
     # 画像が取得できなかった場合、フォールバックパターンを試行
     if posts and all(len(post.get("images", [])) == 0 for post in posts):
         if pattern != "pattern_fallback":
-            print(f"[WARN] Pattern {pattern} extracted posts but no images found, trying fallback pattern")
+            logger.warning("Pattern %s extracted posts but no images found, trying fallback pattern", pattern)
+            metrics.pattern_fallbacks += 1
             fallback_extractor = load_extractor("pattern_fallback", session, base_url)
             if fallback_extractor:
                 fallback_posts = fallback_extractor.extract(soup)
                 if fallback_posts and any(len(post.get("images", [])) > 0 for post in fallback_posts):
-                    print(f"[INFO] Fallback pattern found images, using fallback results")
+                    logger.info("Fallback pattern found images, using fallback results")
+                    metrics.pattern = "pattern_fallback"
                     return fallback_posts
     
     return posts
+
+
+class _NullMetrics:
+    """metrics 未指定時に使う何もしない記録先（ログの stage だけ付与する）"""
+    pattern = None
+    pattern_fallbacks = 0
+
+    def stage(self, name: str):
+        return log_stage(name)
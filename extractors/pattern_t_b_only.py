@@ -4,6 +4,7 @@
 tabinolog.comなど、.t_b要素のみが存在するサイト用
 """
 
+import logging
 import re
 from typing import List, Dict
 from bs4 import BeautifulSoup
@@ -11,6 +12,8 @@ from urllib.parse import urljoin
 
 from extractors.base import BaseExtractor
 
+logger = logging.getLogger(__name__)
+
 
 class T_B_OnlyExtractor(BaseExtractor):
     """パターン2: .t_b のみ"""
@@ -30,7 +33,7 @@ class T_B_OnlyExtractor(BaseExtractor):
         if not t_b_elements:
             return posts
         
-        print("[INFO] .t_h要素が見つかりません。.t_b要素から直接抽出を試みます。")
+        logger.info(".t_h要素が見つかりません。.t_b要素から直接抽出を試みます。")
         
         # .t_b要素ごとに投稿を作成
         for t_b in t_b_elements:
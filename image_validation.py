@@ -0,0 +1,325 @@
+# coding: utf-8
+"""
+ダウンロード画像の検証と後処理
+
+- マジックバイトから実際の形式を判定し、拡張子を決める
+- HTMLのエラーページや途中で切れたファイルを画像として保存しない
+  （判定できない形式は検証せずに保存し、拡張子はURLから決める）
+- サムネイル生成・WebP変換（任意、Pillowが必要）はプロセスプールで実行し、
+  ダウンロード処理を止めない
+"""
+import io
+import logging
+import os
+import re
+import threading
+from typing import TYPE_CHECKING, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from concurrent.futures import ProcessPoolExecutor
+    from output_sinks import ThreadOutput
+
+logger = logging.getLogger(__name__)
+
+# 判定できる形式と拡張子
+# (マジックバイト, オフセット, 拡張子)
+_MAGIC_SIGNATURES = [
+    (b"\xff\xd8\xff", 0, ".jpg"),
+    (b"\x89PNG\r\n\x1a\n", 0, ".png"),
+    (b"GIF87a", 0, ".gif"),
+    (b"GIF89a", 0, ".gif"),
+    (b"BM", 0, ".bmp"),
+    (b"\x00\x00\x01\x00", 0, ".ico"),
+]
+
+# ISO BMFF（ftyp ボックス）のブランドと拡張子
+_FTYP_BRANDS = {
+    b"avif": ".avif",
+    b"avis": ".avif",
+}
+
+# 形式を判定できないときに、URLの拡張子をそのまま使う画像形式
+_URL_IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".gif", ".webp", ".bmp", ".avif", ".svg", ".ico",
+                   ".heic", ".heif", ".jxl", ".tif", ".tiff")
+
+# 形式もURLの拡張子も分からないときの拡張子（以前の保存と同じ）
+DEFAULT_IMAGE_EXT = ".jpg"
+
+# サムネイル・WebP版を作る形式（Pillow で読めるもの）
+DERIVABLE_EXTS = (".jpg", ".png", ".gif", ".bmp", ".webp")
+
+_SVG_HEAD = re.compile(rb"^(?:\xef\xbb\xbf)?\s*(?:<\?xml[^>]*>\s*)?(?:<!--.*?-->\s*)*(?:<!DOCTYPE svg[^>]*>\s*)?<svg[\s>]",
+                       re.IGNORECASE | re.DOTALL)
+
+# サムネイルの最大サイズ（幅, 高さ）
+THUMBNAIL_SIZE = (320, 320)
+
+# WebP変換時の品質
+WEBP_QUALITY = 80
+
+# 後処理用プロセスプールの最大ワーカー数
+MAX_POSTPROCESS_WORKERS = max(1, min(4, (os.cpu_count() or 2) - 1))
+
+
+class InvalidImageError(ValueError):
+    """ダウンロードした内容が画像として不正な場合の例外"""
+
+
+def sniff_image_ext(data: bytes) -> Optional[str]:
+    """
+    マジックバイトから画像形式を判定
+
+    Returns:
+        拡張子（例: ".jpg"）、画像でない場合は None
+    """
+    for magic, offset, ext in _MAGIC_SIGNATURES:
+        if data[offset:offset + len(magic)] == magic:
+            return ext
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return ".webp"
+    if data[4:8] == b"ftyp" and data[8:12] in _FTYP_BRANDS:
+        return _FTYP_BRANDS[data[8:12]]
+    if _SVG_HEAD.match(data[:1024]):
+        return ".svg"
+    return None
+
+
+def _jpeg_complete(data: bytes) -> bool:
+    """
+    マーカーのセグメントをたどり、画像本体の EOI まであるか
+
+    EXIF のサムネイル（APP1 の中）の EOI は読み飛ばし、EOI より後ろのデータは無視する。
+    """
+    pos, size = 2, len(data)
+    while pos + 2 <= size:
+        if data[pos] != 0xFF:
+            # セグメントの構造が崩れている: 最後のスキャン開始（SOS）より後ろの EOI を探す
+            return data.find(b"\xff\xd9", max(2, data.rfind(b"\xff\xda"))) != -1
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            pos += 1
+            continue
+        if marker == 0xD9:
+            return True
+        if 0xD0 <= marker <= 0xD7 or marker == 0x01:
+            pos += 2
+            continue
+        if pos + 4 > size:
+            return False
+        pos += 2 + int.from_bytes(data[pos + 2:pos + 4], "big")
+        if marker == 0xDA:
+            # 圧縮データ: 0xFF00（バイトの詰め物）・RST 以外のマーカーまで進める
+            while True:
+                pos = data.find(b"\xff", pos)
+                if pos == -1 or pos + 1 >= size:
+                    return False
+                following = data[pos + 1]
+                if following == 0xFF:
+                    pos += 1
+                elif following == 0x00 or 0xD0 <= following <= 0xD7:
+                    pos += 2
+                else:
+                    break
+    return False
+
+
+def _png_complete(data: bytes) -> bool:
+    """チャンクをたどり、IEND まであるか（IEND より後ろのデータは無視する）"""
+    pos, size = 8, len(data)
+    while pos + 8 <= size:
+        length = int.from_bytes(data[pos:pos + 4], "big")
+        if data[pos + 4:pos + 8] == b"IEND":
+            return True
+        pos += 12 + length
+    return False
+
+
+def _gif_complete(data: bytes) -> bool:
+    """ブロックをたどり、トレーラー（;）まであるか（トレーラーより後ろのデータは無視する）"""
+    size = len(data)
+    if size < 13:
+        return False
+    pos = 13
+    if data[10] & 0x80:
+        pos += 3 << ((data[10] & 0x07) + 1)
+
+    def skip_sub_blocks(pos: int) -> int:
+        while pos < size and data[pos]:
+            pos += data[pos] + 1
+        return pos + 1
+
+    while pos < size:
+        block = data[pos]
+        if block == 0x3B:
+            return True
+        if block == 0x21:
+            pos = skip_sub_blocks(pos + 2)
+        elif block == 0x2C:
+            if pos + 10 > size:
+                return False
+            flags = data[pos + 9]
+            pos += 10
+            if flags & 0x80:
+                pos += 3 << ((flags & 0x07) + 1)
+            pos = skip_sub_blocks(pos + 1)
+        else:
+            return False
+    return False
+
+
+def is_truncated(data: bytes, ext: str) -> bool:
+    """
+    形式ごとの構造をたどって終端まであるかを確認し、途中で切れたファイルかどうかを判定
+
+    終端より後ろに余分なデータが付いたファイル（スマホで撮った写真など）は切れていないとみなす。
+    終端を確認できない形式（AVIF・SVG・ICO など）は常に False。
+    """
+    if ext == ".jpg":
+        return not _jpeg_complete(data)
+    if ext == ".png":
+        return not _png_complete(data)
+    if ext == ".gif":
+        return not _gif_complete(data)
+    if ext == ".webp":
+        riff_size = int.from_bytes(data[4:8], "little")
+        return len(data) < riff_size + 8
+    if ext == ".bmp":
+        file_size = int.from_bytes(data[2:6], "little")
+        return len(data) < file_size
+    return False
+
+
+def _ext_from_url(url: Optional[str]) -> str:
+    ext = os.path.splitext((url or "").split("?", 1)[0].split("#", 1)[0])[1].lower()
+    return ext if ext in _URL_IMAGE_EXTS else DEFAULT_IMAGE_EXT
+
+
+def validate_image(data: bytes, url: Optional[str] = None) -> str:
+    """
+    ダウンロード内容を検証して拡張子を返す
+
+    判定できない形式は検証せずに通し、拡張子は url から決める（分からなければ .jpg）。
+
+    Raises:
+        InvalidImageError: 画像でない（HTMLのエラーページなど）、または途中で切れている場合
+    """
+    if not data:
+        raise InvalidImageError("empty response")
+    ext = sniff_image_ext(data)
+    if ext is None:
+        head = data[:64].lstrip().lower()
+        if head.startswith(b"<"):
+            raise InvalidImageError("HTML response instead of image")
+        ext = _ext_from_url(url)
+        logger.debug("Unknown image format, saving as %s: %s", ext, url)
+        return ext
+    if is_truncated(data, ext):
+        raise InvalidImageError(f"truncated {ext[1:]} file")
+    return ext
+
+
+def render_derivatives(name: str, data: bytes, make_thumbnail: bool, convert_webp: bool,
+                       thumbnail_size: Tuple[int, int] = THUMBNAIL_SIZE,
+                       webp_quality: int = WEBP_QUALITY) -> List[Tuple[str, bytes]]:
+    """
+    画像1枚からサムネイル・WebP版を生成（プロセスプールのワーカーで実行）
+
+    Args:
+        name: 元ファイル名（例: "画像1.jpg"）
+        data: 元画像のバイト列
+
+    Returns:
+        [(相対パス, バイト列), ...] のリスト（例: ("thumbs/画像1.jpg", ...)）
+    """
+    from PIL import Image
+
+    stem = os.path.splitext(name)[0]
+    results = []
+    with Image.open(io.BytesIO(data)) as img:
+        img.load()
+        if convert_webp:
+            buf = io.BytesIO()
+            # アニメーションGIFはアニメーションのまま変換
+            img.save(buf, "WEBP", quality=webp_quality, save_all=getattr(img, "is_animated", False))
+            results.append((f"webp/{stem}.webp", buf.getvalue()))
+        if make_thumbnail:
+            thumb = img.convert("RGB")
+            thumb.thumbnail(thumbnail_size)
+            buf = io.BytesIO()
+            thumb.save(buf, "JPEG", quality=85)
+            results.append((f"thumbs/{stem}.jpg", buf.getvalue()))
+    return results
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_postprocess_pool() -> "ProcessPoolExecutor":
+    """後処理用のプロセスプールを取得（初回呼び出し時に作成し、以降は共有）"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # multiprocessing の読み込みは重いので、後処理を使うときだけ
+            from concurrent.futures import ProcessPoolExecutor
+            _pool = ProcessPoolExecutor(max_workers=MAX_POSTPROCESS_WORKERS)
+        return _pool
+
+
+def pillow_available() -> bool:
+    try:
+        import PIL  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class ImagePostprocessor:
+    """
+    保存済み画像の後処理（サムネイル生成・WebP変換）をプロセスプールに投入し、
+    スレッドの処理終了時にまとめて結果を書き出す
+    """
+
+    def __init__(self, output: "ThreadOutput", make_thumbnails: bool = False, convert_webp: bool = False):
+        """
+        Args:
+            output: 派生ファイルの出力先（output_sinks.ThreadOutput。thumbs/, webp/ に書き込む）
+            make_thumbnails: サムネイルを生成するか
+            convert_webp: WebP版を生成するか
+        """
+        self.output = output
+        self.make_thumbnails = make_thumbnails
+        self.convert_webp = convert_webp
+        self.enabled = (make_thumbnails or convert_webp) and pillow_available()
+        if (make_thumbnails or convert_webp) and not self.enabled:
+            logger.warning("Pillow is not installed; thumbnails/WebP conversion skipped (pip install pillow)")
+        self._futures = []
+
+    def submit(self, name: str, data: bytes) -> None:
+        """画像1枚の後処理を投入（すぐに戻る）"""
+        if not self.enabled or os.path.splitext(name)[1].lower() not in DERIVABLE_EXTS:
+            return
+        future = get_postprocess_pool().submit(
+            render_derivatives, name, data, self.make_thumbnails, self.convert_webp
+        )
+        self._futures.append((name, future))
+
+    def finish(self) -> int:
+        """
+        投入済みの後処理の完了を待ち、派生ファイルを書き出す
+
+        Returns:
+            書き出した派生ファイル数
+        """
+        written = 0
+        for name, future in self._futures:
+            try:
+                derivatives = future.result()
+            except Exception as e:
+                logger.warning("Post-processing failed for %s: %s: %s", name, type(e).__name__, e)
+                continue
+            for rel_path, payload in derivatives:
+                self.output.write_bytes(rel_path, payload)
+                written += 1
+        self._futures = []
+        return written
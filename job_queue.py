@@ -0,0 +1,337 @@
+# coding: utf-8
+"""
+SQLite を使った永続ジョブキュー
+
+URL 1件を1ジョブとして登録し、複数のワーカープロセス（別ホストでも可）が
+取り出して処理する。外部サービスは不要。
+
+- 取り出し（claim）: ジョブにリース期限を付けて running にする
+- ハートビート: 処理中はリースを延長する。ワーカーが落ちてリースが切れた
+  ジョブは、他のワーカーが取り直す
+- 失敗: max_attempts 回までは待ち時間を置いて queued に戻し、超えたら failed
+- 登録単位（batch）ごとに状態と結果（UrlMetrics.to_dict()）を取得できる
+
+複数ホストで共有する場合は、DB をネットワーク共有上に置き、WAL を無効にする
+（環境変数 JOB_QUEUE_WAL=0。WAL は同一ホスト内の共有メモリを前提とするため）。
+"""
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DB_PATH = "jobs.sqlite3"
+DEFAULT_LEASE_SECONDS = 300
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_RETRY_DELAY = 30  # 再試行までの待ち時間（秒）× 試行回数
+
+STATES = ("queued", "running", "done", "failed")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id            INTEGER PRIMARY KEY AUTOINCREMENT,
+    batch         TEXT    NOT NULL,
+    url           TEXT    NOT NULL,
+    options       TEXT    NOT NULL DEFAULT '{}',
+    state         TEXT    NOT NULL DEFAULT 'queued',
+    attempts      INTEGER NOT NULL DEFAULT 0,
+    max_attempts  INTEGER NOT NULL,
+    available_at  REAL    NOT NULL,
+    worker        TEXT,
+    lease_until   REAL,
+    heartbeat_at  REAL,
+    enqueued_at   REAL    NOT NULL,
+    started_at    REAL,
+    finished_at   REAL,
+    result        TEXT,
+    error         TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (state, available_at, id);
+CREATE INDEX IF NOT EXISTS jobs_batch ON jobs (batch);
+"""
+
+
+class Job(NamedTuple):
+    """キュー上のジョブ1件"""
+    id: int
+    batch: str
+    url: str
+    options: Dict
+    state: str
+    attempts: int
+    max_attempts: int
+    worker: Optional[str]
+    lease_until: Optional[float]
+    enqueued_at: float
+    started_at: Optional[float]
+    finished_at: Optional[float]
+    result: Optional[Dict]
+    error: Optional[str]
+
+    @classmethod
+    def from_row(cls, row: sqlite3.Row) -> "Job":
+        return cls(
+            id=row["id"],
+            batch=row["batch"],
+            url=row["url"],
+            options=json.loads(row["options"] or "{}"),
+            state=row["state"],
+            attempts=row["attempts"],
+            max_attempts=row["max_attempts"],
+            worker=row["worker"],
+            lease_until=row["lease_until"],
+            enqueued_at=row["enqueued_at"],
+            started_at=row["started_at"],
+            finished_at=row["finished_at"],
+            result=json.loads(row["result"]) if row["result"] else None,
+            error=row["error"],
+        )
+
+    def to_dict(self) -> Dict:
+        return {
+            "id": self.id,
+            "url": self.url,
+            "state": self.state,
+            "attempts": self.attempts,
+            "max_attempts": self.max_attempts,
+            "worker": self.worker,
+            "error": self.error,
+            "result": self.result,
+        }
+
+
+def default_worker_id() -> str:
+    """ホスト名とプロセスIDからワーカーIDを作る"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class JobQueue:
+    """
+    SQLite のジョブキュー
+
+    操作ごとに接続を開くので、1つのインスタンスを複数スレッドから使ってよい。
+    """
+
+    def __init__(self, path: str = DEFAULT_DB_PATH, wal: Optional[bool] = None):
+        """
+        Args:
+            path: DBファイルのパス（なければ作成）
+            wal: WAL モードを使うか（省略時は環境変数 JOB_QUEUE_WAL、既定は有効）
+        """
+        self.path = path
+        if wal is None:
+            wal = os.environ.get("JOB_QUEUE_WAL", "1") != "0"
+        with self._connect() as conn:
+            if wal:
+                conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    @contextmanager
+    def _transaction(self):
+        """書き込みロックを先に取るトランザクション（claim の競合を防ぐ）"""
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def enqueue(self, urls: Iterable[str], options: Optional[Dict] = None,
+                max_attempts: int = DEFAULT_MAX_ATTEMPTS, batch: Optional[str] = None) -> str:
+        """
+        URLをジョブとして登録し、batch ID を返す
+
+        Args:
+            urls: 対象URL
+            options: scrape_single_url_js に渡すオプション（capture_twitter など）
+            max_attempts: 最大試行回数
+            batch: 既存の batch に追加する場合に指定
+        """
+        batch = batch or uuid.uuid4().hex[:12]
+        now = time.time()
+        options_json = json.dumps(options or {}, ensure_ascii=False)
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT INTO jobs (batch, url, options, max_attempts, available_at, enqueued_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                [(batch, url, options_json, max_attempts, now, now) for url in urls],
+            )
+        return batch
+
+    def claim(self, worker: str, lease_seconds: float = DEFAULT_LEASE_SECONDS) -> Optional[Job]:
+        """
+        処理待ちのジョブを1件取り出す（なければ None）
+
+        リースが切れた running のジョブも対象にする（ワーカーが落ちた場合の回収）。
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            self._expire_leases(conn, now)
+            row = conn.execute(
+                "SELECT id FROM jobs WHERE state = 'queued' AND available_at <= ?"
+                " ORDER BY id LIMIT 1", (now,)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE jobs SET state = 'running', worker = ?, attempts = attempts + 1,"
+                " lease_until = ?, heartbeat_at = ?, started_at = ? WHERE id = ?",
+                (worker, now + lease_seconds, now, now, row["id"]),
+            )
+            return Job.from_row(conn.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone())
+
+    def _expire_leases(self, conn: sqlite3.Connection, now: float) -> None:
+        """リースが切れた running のジョブを queued（試行回数を使い切っていれば failed）に戻す"""
+        expired = conn.execute(
+            "SELECT id, url, worker, attempts, max_attempts FROM jobs"
+            " WHERE state = 'running' AND lease_until < ?", (now,)
+        ).fetchall()
+        for row in expired:
+            logger.warning("Lease expired for job %d (%s) held by %s", row["id"], row["url"], row["worker"])
+            if row["attempts"] >= row["max_attempts"]:
+                conn.execute(
+                    "UPDATE jobs SET state = 'failed', error = ?, finished_at = ?, lease_until = NULL"
+                    " WHERE id = ?", ("lease expired", now, row["id"]))
+            else:
+                conn.execute(
+                    "UPDATE jobs SET state = 'queued', available_at = ?, lease_until = NULL WHERE id = ?",
+                    (now, row["id"]))
+
+    def heartbeat(self, job_id: int, worker: str, lease_seconds: float = DEFAULT_LEASE_SECONDS) -> bool:
+        """リースを延長する。ジョブが既に他のワーカーに渡っていれば False"""
+        now = time.time()
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET lease_until = ?, heartbeat_at = ?"
+                " WHERE id = ? AND worker = ? AND state = 'running'",
+                (now + lease_seconds, now, job_id, worker),
+            )
+            return cursor.rowcount == 1
+
+    def complete(self, job_id: int, worker: str, result: Optional[Dict] = None) -> bool:
+        """ジョブを完了にする。リースを失っていた場合は何もせず False"""
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET state = 'done', result = ?, error = NULL, finished_at = ?,"
+                " lease_until = NULL WHERE id = ? AND worker = ? AND state = 'running'",
+                (json.dumps(result, ensure_ascii=False) if result is not None else None,
+                 time.time(), job_id, worker),
+            )
+            return cursor.rowcount == 1
+
+    def fail(self, job_id: int, worker: str, error: str, result: Optional[Dict] = None,
+             retry_delay: float = DEFAULT_RETRY_DELAY) -> Optional[str]:
+        """
+        ジョブの失敗を記録する
+
+        試行回数が残っていれば retry_delay × 試行回数 だけ待ってから再び queued にする。
+
+        Returns:
+            新しい状態（"queued" / "failed"）。リースを失っていた場合は None
+        """
+        now = time.time()
+        result_json = json.dumps(result, ensure_ascii=False) if result is not None else None
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT attempts, max_attempts FROM jobs WHERE id = ? AND worker = ? AND state = 'running'",
+                (job_id, worker),
+            ).fetchone()
+            if row is None:
+                return None
+            if row["attempts"] < row["max_attempts"]:
+                conn.execute(
+                    "UPDATE jobs SET state = 'queued', error = ?, result = ?, available_at = ?,"
+                    " lease_until = NULL WHERE id = ?",
+                    (error, result_json, now + retry_delay * row["attempts"], job_id))
+                return "queued"
+            conn.execute(
+                "UPDATE jobs SET state = 'failed', error = ?, result = ?, finished_at = ?,"
+                " lease_until = NULL WHERE id = ?",
+                (error, result_json, now, job_id))
+            return "failed"
+
+    def release(self, job_id: int, worker: str) -> bool:
+        """
+        処理を中断したジョブを試行回数を数えずに queued に戻す（ワーカーの停止時など）
+        """
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET state = 'queued', attempts = attempts - 1, available_at = ?,"
+                " lease_until = NULL WHERE id = ? AND worker = ? AND state = 'running'",
+                (time.time(), job_id, worker),
+            )
+            return cursor.rowcount == 1
+
+    def jobs(self, batch: str) -> List[Job]:
+        """batch のジョブを登録順に返す"""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT * FROM jobs WHERE batch = ? ORDER BY id", (batch,)).fetchall()
+        return [Job.from_row(row) for row in rows]
+
+    def counts(self, batch: Optional[str] = None) -> Dict[str, int]:
+        """状態ごとの件数（batch 省略時はキュー全体）"""
+        with self._connect() as conn:
+            if batch is None:
+                rows = conn.execute("SELECT state, COUNT(*) AS n FROM jobs GROUP BY state").fetchall()
+            else:
+                rows = conn.execute("SELECT state, COUNT(*) AS n FROM jobs WHERE batch = ? GROUP BY state",
+                                    (batch,)).fetchall()
+        counts = {state: 0 for state in STATES}
+        counts.update({row["state"]: row["n"] for row in rows})
+        return counts
+
+
+class Heartbeat:
+    """
+    処理中のジョブのリースを一定間隔で延長するバックグラウンドスレッド
+
+    with Heartbeat(queue, job, worker): の中で処理する。
+    リースを失った場合（他のワーカーに渡った場合）は lost が True になる。
+    """
+
+    def __init__(self, queue: JobQueue, job: Job, worker: str,
+                 lease_seconds: float = DEFAULT_LEASE_SECONDS):
+        self.queue = queue
+        self.job = job
+        self.worker = worker
+        self.lease_seconds = lease_seconds
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.lease_seconds / 3):
+            try:
+                if not self.queue.heartbeat(self.job.id, self.worker, self.lease_seconds):
+                    self.lost = True
+                    logger.warning("Lost lease on job %d (%s)", self.job.id, self.job.url)
+                    return
+            except sqlite3.Error as e:
+                # 一時的なロック競合などは次の周期で再試行
+                logger.warning("Heartbeat failed for job %d: %s", self.job.id, e)
+
+    def __enter__(self) -> "Heartbeat":
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self._stop.set()
+        self._thread.join()
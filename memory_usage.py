@@ -0,0 +1,87 @@
+# coding: utf-8
+"""
+プロセスのメモリ使用量（RSS）の計測
+
+psutil があれば使い、なければ OS ごとの標準的な方法で取得する。
+"""
+import os
+import sys
+from typing import Dict, Optional
+
+
+def current_rss_bytes() -> Optional[int]:
+    """現在の RSS（バイト）。取得できない場合は None"""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    except Exception:
+        return None
+
+    if sys.platform.startswith("linux"):
+        try:
+            with open("/proc/self/statm", "r") as f:
+                resident_pages = int(f.read().split()[1])
+            return resident_pages * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError, IndexError):
+            return None
+
+    if sys.platform == "win32":
+        try:
+            import ctypes
+            from ctypes import wintypes
+
+            class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+                _fields_ = [
+                    ("cb", wintypes.DWORD),
+                    ("PageFaultCount", wintypes.DWORD),
+                    ("PeakWorkingSetSize", ctypes.c_size_t),
+                    ("WorkingSetSize", ctypes.c_size_t),
+                    ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+                    ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                    ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                    ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                    ("PagefileUsage", ctypes.c_size_t),
+                    ("PeakPagefileUsage", ctypes.c_size_t),
+                ]
+
+            counters = PROCESS_MEMORY_COUNTERS()
+            counters.cb = ctypes.sizeof(counters)
+            handle = ctypes.windll.kernel32.GetCurrentProcess()
+            if ctypes.windll.psapi.GetProcessMemoryInfo(handle, ctypes.byref(counters), counters.cb):
+                return counters.WorkingSetSize
+        except Exception:
+            pass
+        return None
+
+    # macOS など: ピーク値しか取れないため ru_maxrss で代用（macOS はバイト単位）
+    try:
+        import resource
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if sys.platform == "darwin" else maxrss * 1024
+    except Exception:
+        return None
+
+
+class RssTracker:
+    """処理の区切りごとに RSS を記録し、ピーク値を保持する"""
+
+    def __init__(self):
+        self.samples: Dict[str, int] = {}
+        self.peak: Optional[int] = None
+
+    def sample(self, label: str) -> Optional[int]:
+        rss = current_rss_bytes()
+        if rss is not None:
+            self.samples[label] = rss
+            if self.peak is None or rss > self.peak:
+                self.peak = rss
+        return rss
+
+    def summary(self) -> str:
+        """ログ出力用の要約（例: "peak 120.5MB (parse 118.0MB, release 64.2MB)"）"""
+        if self.peak is None:
+            return "n/a"
+        details = ", ".join(f"{label} {rss / 1048576:.1f}MB" for label, rss in self.samples.items())
+        return f"peak {self.peak / 1048576:.1f}MB ({details})"
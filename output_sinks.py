@@ -0,0 +1,383 @@
+# coding: utf-8
+"""
+出力先（--sink / OUTPUT_SINK）
+
+scrape_single_url_js はスレッドごとに OutputSink.open_thread() で ThreadOutput を受け取り、
+画像・posts.txt などを相対パス（images/画像1.jpg など）で書き込む。
+
+- dir: result_js/[タイトル]_[URLハッシュ]/ にファイルとして保存（従来どおり）
+- zip / tar: スレッドごとに1つのアーカイブ（result_js/[タイトル]_[URLハッシュ].zip）に順に書き込む。
+  小さなファイルを大量に作らないため、Windows の共有フォルダや NFS で速い。
+  中身のパスはフォルダに保存した場合と同じ（[タイトル]_[URLハッシュ]/images/画像1.jpg）
+- sqlite: 1つのDB（result_js/results.sqlite3）にスレッドとファイル（画像・posts.txt 等）を BLOB で保存
+
+APIサーバー（app.py）は ZipBundleSink で全スレッドを返却用のZIPに直接書き込み、
+ファイルを読み直してZIPを作る処理を省く。
+"""
+import io
+import logging
+import os
+import shutil
+import socket
+import sqlite3
+import tarfile
+import tempfile
+import time
+import zipfile
+from contextlib import contextmanager
+from typing import IO, ContextManager, Iterator, Optional
+
+from output_writer import (
+    LOCK_STALE_SECONDS, PARTIAL_SUFFIX, PartialTextFile, atomic_write, claim_lock, claim_output_folder,
+)
+
+logger = logging.getLogger(__name__)
+
+SINK_TYPES = ("dir", "zip", "tar", "sqlite")
+
+DEFAULT_SQLITE_NAME = "results.sqlite3"
+
+# 圧縮して保存するファイル（画像は圧縮済みなので無圧縮で格納する）
+COMPRESSED_SUFFIXES = (".txt", ".jsonl", ".json", ".prof")
+
+# 一時ファイルからアーカイブ・DBへ写すときの単位（バイト）
+COPY_CHUNK_SIZE = 1024 * 1024
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS threads (
+    id           INTEGER PRIMARY KEY AUTOINCREMENT,
+    key          TEXT    NOT NULL,
+    url          TEXT    NOT NULL,
+    title        TEXT,
+    state        TEXT    NOT NULL DEFAULT 'writing',
+    worker       TEXT,
+    created_at   REAL    NOT NULL,
+    finished_at  REAL
+);
+CREATE INDEX IF NOT EXISTS threads_key ON threads (key, state);
+CREATE TABLE IF NOT EXISTS files (
+    thread_id  INTEGER NOT NULL,
+    path       TEXT    NOT NULL,
+    size       INTEGER NOT NULL,
+    data       BLOB    NOT NULL,
+    PRIMARY KEY (thread_id, path)
+);
+"""
+
+
+class ThreadOutput:
+    """1スレッド分の出力先"""
+
+    location = ""  # 結果に記録する保存先（フォルダ・アーカイブのパスなど）
+
+    def write_bytes(self, rel_path: str, data: bytes) -> None:
+        """ファイル1つを書き込む（rel_path は / 区切りの相対パス）"""
+        raise NotImplementedError
+
+    def write_stream(self, rel_path: str, stream: IO[bytes], size: int) -> None:
+        """ファイル1つを stream（size バイト）から書き込む（既定では読み込んで write_bytes に渡す）"""
+        self.write_bytes(rel_path, stream.read())
+
+    def open_text(self, rel_path: str) -> IO[str]:
+        """逐次書き込むテキストファイルを開く（close() で確定する）"""
+        return _SpooledText(self, rel_path)
+
+
+class _SpooledText:
+    """
+    一時ファイルに逐次書き、close() でまとめて書き込むテキスト
+
+    アーカイブ・DBは1ファイルずつ順に書くため、posts.txt などは最後に追加する。
+    内容はメモリに溜めない（長いスレッドでもメモリ使用量が増えない）。
+    """
+
+    def __init__(self, output: ThreadOutput, rel_path: str):
+        self._output = output
+        self._rel_path = rel_path
+        self._file = tempfile.TemporaryFile()
+        self._text = io.TextIOWrapper(self._file, encoding="utf-8", newline="\n")
+
+    @property
+    def closed(self) -> bool:
+        return self._text.closed
+
+    def write(self, text: str) -> int:
+        return self._text.write(text)
+
+    def flush(self) -> None:
+        self._text.flush()
+
+    def close(self) -> None:
+        if self._text.closed:
+            return
+        try:
+            self._text.flush()
+            size = self._file.tell()
+            self._file.seek(0)
+            self._output.write_stream(self._rel_path, self._file, size)
+        finally:
+            # 一時ファイルは閉じると消える
+            self._text.close()
+
+
+class OutputSink:
+    """スレッドごとの出力先を作る"""
+
+    def open_thread(self, key: str, url: str, title: str) -> ContextManager[ThreadOutput]:
+        """
+        スレッド1件分の出力先を確保する（with を抜けたら確定し、例外なら破棄する）
+
+        Args:
+            key: フォルダ名（タイトル_URLのハッシュ）
+            url: スレッドURL
+            title: ページタイトル
+        """
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class _DirectoryOutput(ThreadOutput):
+    def __init__(self, folder: str):
+        self.location = folder
+
+    def _path(self, rel_path: str) -> str:
+        path = os.path.join(self.location, *rel_path.split("/"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def write_bytes(self, rel_path: str, data: bytes) -> None:
+        atomic_write(self._path(rel_path), data)
+
+    def open_text(self, rel_path: str) -> IO[str]:
+        return PartialTextFile(self._path(rel_path))
+
+
+class DirectorySink(OutputSink):
+    """result_root/[key]/ にファイルとして保存する"""
+
+    def __init__(self, result_root: str):
+        self.result_root = result_root
+
+    @contextmanager
+    def open_thread(self, key: str, url: str, title: str) -> Iterator[ThreadOutput]:
+        with claim_output_folder(os.path.join(self.result_root, key)) as folder:
+            yield _DirectoryOutput(folder)
+
+
+class _Archive:
+    """ZIP / TAR への順次書き込み"""
+
+    def __init__(self, path: str, fmt: str):
+        self.fmt = fmt
+        if fmt == "zip":
+            self._zip = zipfile.ZipFile(path, "w")
+        else:
+            self._tar = tarfile.open(path, "w")
+
+    @staticmethod
+    def _zip_info(name: str) -> zipfile.ZipInfo:
+        info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+        info.compress_type = (zipfile.ZIP_DEFLATED if name.endswith(COMPRESSED_SUFFIXES)
+                              else zipfile.ZIP_STORED)
+        return info
+
+    @staticmethod
+    def _tar_info(name: str, size: int) -> tarfile.TarInfo:
+        info = tarfile.TarInfo(name)
+        info.size = size
+        info.mtime = int(time.time())
+        return info
+
+    def add(self, name: str, data: bytes) -> None:
+        if self.fmt == "zip":
+            self._zip.writestr(self._zip_info(name), data)
+        else:
+            self._tar.addfile(self._tar_info(name, len(data)), io.BytesIO(data))
+
+    def add_stream(self, name: str, stream: IO[bytes], size: int) -> None:
+        """stream の内容（size バイト）を少しずつ写す"""
+        if self.fmt == "zip":
+            with self._zip.open(self._zip_info(name), "w", force_zip64=size >= zipfile.ZIP64_LIMIT) as dest:
+                shutil.copyfileobj(stream, dest, COPY_CHUNK_SIZE)
+        else:
+            self._tar.addfile(self._tar_info(name, size), stream)
+
+    def close(self) -> None:
+        if self.fmt == "zip":
+            self._zip.close()
+        else:
+            self._tar.close()
+
+
+class _ArchiveOutput(ThreadOutput):
+    def __init__(self, archive: _Archive, prefix: str, location: str):
+        self._archive = archive
+        self._prefix = prefix
+        self.location = location
+
+    def write_bytes(self, rel_path: str, data: bytes) -> None:
+        self._archive.add(self._prefix + rel_path, data)
+
+    def write_stream(self, rel_path: str, stream: IO[bytes], size: int) -> None:
+        self._archive.add_stream(self._prefix + rel_path, stream, size)
+
+
+class ArchiveSink(OutputSink):
+    """スレッドごとに result_root/[key].zip（または .tar）に保存する"""
+
+    def __init__(self, result_root: str, fmt: str = "zip"):
+        if fmt not in ("zip", "tar"):
+            raise ValueError(f"Unsupported archive format: {fmt}")
+        self.result_root = result_root
+        self.fmt = fmt
+
+    @contextmanager
+    def open_thread(self, key: str, url: str, title: str) -> Iterator[ThreadOutput]:
+        path = os.path.join(self.result_root, f"{key}.{self.fmt}")
+        with claim_lock(path + ".lock", path):
+            # 書き込み中は .part に書き、書き終わったら置き換える
+            part_path = path + PARTIAL_SUFFIX
+            archive = _Archive(part_path, self.fmt)
+            try:
+                yield _ArchiveOutput(archive, key + "/", path)
+            except BaseException:
+                archive.close()
+                os.remove(part_path)
+                raise
+            archive.close()
+            os.replace(part_path, path)
+
+
+class ZipBundleSink(OutputSink):
+    """
+    すべてのスレッドを1つのZIP（APIの返却用）に書き込む
+
+    途中で失敗したスレッドも、書き込み済みのファイルは残る（フォルダに保存した場合と同じ）。
+    """
+
+    def __init__(self, zip_path: str):
+        self.zip_path = zip_path
+        self._archive = _Archive(zip_path, "zip")
+
+    @contextmanager
+    def open_thread(self, key: str, url: str, title: str) -> Iterator[ThreadOutput]:
+        yield _ArchiveOutput(self._archive, key + "/", f"{self.zip_path}:{key}/")
+
+    def add_file(self, arcname: str, path: str) -> None:
+        """要約・メトリクス・プロファイルなど、フォルダに書いたファイルを追加する"""
+        with open(path, "rb") as f:
+            self._archive.add_stream(arcname, f, os.fstat(f.fileno()).st_size)
+
+    def add_tree(self, root: str) -> None:
+        for folder, _dirs, files in os.walk(root):
+            for name in files:
+                path = os.path.join(folder, name)
+                self.add_file(os.path.relpath(path, root).replace(os.sep, "/"), path)
+
+    def close(self) -> None:
+        self._archive.close()
+
+
+class _SqliteOutput(ThreadOutput):
+    def __init__(self, conn: sqlite3.Connection, thread_id: int, location: str):
+        self._conn = conn
+        self.thread_id = thread_id
+        self.location = location
+
+    def write_bytes(self, rel_path: str, data: bytes) -> None:
+        self._conn.execute("INSERT OR REPLACE INTO files (thread_id, path, size, data) VALUES (?, ?, ?, ?)",
+                           (self.thread_id, rel_path, len(data), sqlite3.Binary(data)))
+
+    def write_stream(self, rel_path: str, stream: IO[bytes], size: int) -> None:
+        if not hasattr(self._conn, "blobopen"):
+            # Python 3.10 以前は BLOB を少しずつ書けない
+            return super().write_stream(rel_path, stream, size)
+        rowid = self._conn.execute(
+            "INSERT OR REPLACE INTO files (thread_id, path, size, data) VALUES (?, ?, ?, zeroblob(?))",
+            (self.thread_id, rel_path, size, size)).lastrowid
+        with self._conn.blobopen("files", "data", rowid) as blob:
+            while True:
+                chunk = stream.read(COPY_CHUNK_SIZE)
+                if not chunk:
+                    break
+                blob.write(chunk)
+
+
+class SqliteSink(OutputSink):
+    """
+    1つの SQLite DB にスレッドとファイルを保存する
+
+    書き込み中のスレッドは state='writing' で、確定時に同じ key の前回の結果と置き換える
+    （別のワーカーが書き込み中の行は消さない）。落ちたワーカーが残した writing の行は、
+    LOCK_STALE_SECONDS が経ってから次に開いたときに消す。
+    """
+
+    def __init__(self, path: str, wal: Optional[bool] = None):
+        """
+        Args:
+            path: DBファイルのパス（なければ作成）
+            wal: WAL モードを使うか（省略時は環境変数 OUTPUT_SQLITE_WAL、既定は有効。
+                 ネットワーク共有上に置く場合は無効にする）
+        """
+        self.path = path
+        if wal is None:
+            wal = os.environ.get("OUTPUT_SQLITE_WAL", "1") != "0"
+        with self._connect() as conn:
+            if wal:
+                conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            self._delete_threads(conn, "state = 'writing' AND created_at < ?",
+                                 (time.time() - LOCK_STALE_SECONDS,))
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _delete_threads(conn: sqlite3.Connection, where: str, params: tuple) -> None:
+        conn.execute(f"DELETE FROM files WHERE thread_id IN (SELECT id FROM threads WHERE {where})", params)
+        conn.execute(f"DELETE FROM threads WHERE {where}", params)
+
+    @contextmanager
+    def open_thread(self, key: str, url: str, title: str) -> Iterator[ThreadOutput]:
+        with self._connect() as conn:
+            thread_id = conn.execute(
+                "INSERT INTO threads (key, url, title, worker, created_at) VALUES (?, ?, ?, ?, ?)",
+                (key, url, title, f"{socket.gethostname()}:{os.getpid()}", time.time()),
+            ).lastrowid
+            try:
+                yield _SqliteOutput(conn, thread_id, f"{self.path}#{key}")
+            except BaseException:
+                self._delete_threads(conn, "id = ?", (thread_id,))
+                raise
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._delete_threads(conn, "key = ? AND state = 'done'", (key,))
+                conn.execute("UPDATE threads SET state = 'done', finished_at = ? WHERE id = ?",
+                             (time.time(), thread_id))
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+
+def default_sink_type() -> str:
+    sink_type = os.environ.get("OUTPUT_SINK", "dir").strip().lower()
+    return sink_type if sink_type in SINK_TYPES else "dir"
+
+
+def create_sink(sink_type: str, result_root: str) -> OutputSink:
+    """--sink の種類から出力先を作る（sqlite は result_root/results.sqlite3）"""
+    if sink_type == "dir":
+        return DirectorySink(result_root)
+    if sink_type in ("zip", "tar"):
+        return ArchiveSink(result_root, sink_type)
+    if sink_type == "sqlite":
+        return SqliteSink(os.path.join(result_root, DEFAULT_SQLITE_NAME))
+    raise ValueError(f"Unknown output sink: {sink_type}")
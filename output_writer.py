@@ -0,0 +1,301 @@
+# coding: utf-8
+"""
+投稿の書き出し
+
+posts.txt（人が読む形式）と posts.jsonl（機械処理用、1行1レコード）を
+投稿が確定するたびに追記する。スレッド全体をメモリに溜めず、
+フォルダに保存する場合は、処理中でも posts.txt.part / posts.jsonl.part から読み始められる
+（書き終わったら posts.txt / posts.jsonl に置き換える）。出力先は output_sinks.py を参照。
+
+出力フォルダは「タイトル_URLのハッシュ8桁」とし、処理中は .lock で確保する。
+同じタイトルの別スレッドや、同じURLを処理中の別ワーカーのフォルダを上書きしない。
+
+posts.jsonl のレコード:
+    1行目: {"type": "thread", "url", "title", "op_ids", "twitter_images"}
+    以降:  {"type": "post", "index", "number", "name", "id", "is_op", "header",
+            "body", "images": [{"file", "url"}, ...]}
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import socket
+import sys
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Dict, Iterator, List, Optional
+
+if TYPE_CHECKING:
+    from output_sinks import ThreadOutput
+
+logger = logging.getLogger(__name__)
+
+# 出力フォルダを処理中のワーカーが作るロックファイル
+LOCK_FILE = ".lock"
+
+# この時間より古いロックは、作ったプロセスを確認できなくても放棄されたものとみなす（秒）
+LOCK_STALE_SECONDS = 6 * 3600
+
+# 書き込み中のファイルの接尾辞（書き終わったら外す）
+PARTIAL_SUFFIX = ".part"
+
+
+class OutputFolderBusy(Exception):
+    """出力フォルダを別のワーカーが処理中"""
+
+
+def url_hash(url: str) -> str:
+    """フォルダ名に付けるURLの短いハッシュ（8桁）"""
+    return hashlib.sha1(url.encode("utf-8")).hexdigest()[:8]
+
+
+def atomic_write(path: str, data: bytes) -> None:
+    """一時ファイルに書いてから置き換える（途中で止まっても書きかけのファイルを残さない）"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def pid_alive(pid: int) -> bool:
+    """
+    プロセスが動いているか（確認できない場合は動いているとみなす）
+
+    Windows の os.kill はシグナルの値にかかわらずプロセスを終了させるため、
+    OpenProcess / GetExitCodeProcess で確認する。
+    """
+    if pid <= 0:
+        return False
+    if sys.platform == "win32":
+        return _win32_pid_alive(pid)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        pass
+    return True
+
+
+def _win32_pid_alive(pid: int) -> bool:
+    import ctypes
+    from ctypes import wintypes
+
+    PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+    ERROR_ACCESS_DENIED = 5
+    STILL_ACTIVE = 259
+
+    kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+    kernel32.OpenProcess.restype = wintypes.HANDLE
+    kernel32.OpenProcess.argtypes = (wintypes.DWORD, wintypes.BOOL, wintypes.DWORD)
+    kernel32.GetExitCodeProcess.argtypes = (wintypes.HANDLE, ctypes.POINTER(wintypes.DWORD))
+    kernel32.CloseHandle.argtypes = (wintypes.HANDLE,)
+
+    handle = kernel32.OpenProcess(PROCESS_QUERY_LIMITED_INFORMATION, False, pid)
+    if not handle:
+        # 権限がなく開けないプロセスは存在している
+        return ctypes.get_last_error() == ERROR_ACCESS_DENIED
+    try:
+        exit_code = wintypes.DWORD()
+        if not kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code)):
+            return True
+        return exit_code.value == STILL_ACTIVE
+    finally:
+        kernel32.CloseHandle(handle)
+
+
+def _lock_is_stale(lock_path: str) -> bool:
+    try:
+        with open(lock_path, "r", encoding="utf-8") as f:
+            owner = json.load(f)
+        age = time.time() - os.path.getmtime(lock_path)
+    except FileNotFoundError:
+        return True
+    except (OSError, ValueError):
+        # 書きかけのロック（作成直後）は作ったワーカーのものとみなす
+        return False
+    if age > LOCK_STALE_SECONDS:
+        return True
+    return owner.get("host") == socket.gethostname() and not pid_alive(int(owner.get("pid", 0)))
+
+
+def _clear_folder(folder: str) -> None:
+    """前回の出力を消す（ロックを確保したフォルダだけに使う）"""
+    for name in os.listdir(folder):
+        if name == LOCK_FILE:
+            continue
+        path = os.path.join(folder, name)
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+
+
+@contextmanager
+def claim_lock(lock_path: str, target: str) -> Iterator[None]:
+    """
+    出力先 target をロックファイルで確保する（終了時に外す）
+
+    作ったプロセスが終了しているロックや LOCK_STALE_SECONDS より古いロックは取り直す。
+
+    Raises:
+        OutputFolderBusy: 別のワーカーが同じ出力先を処理中
+    """
+    owner = json.dumps({"pid": os.getpid(), "host": socket.gethostname(), "created_at": time.time()})
+    for attempt in range(2):
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            if attempt == 0 and _lock_is_stale(lock_path):
+                logger.warning("Removing stale lock: %s", lock_path)
+                try:
+                    os.remove(lock_path)
+                except FileNotFoundError:
+                    pass
+                continue
+            raise OutputFolderBusy(f"Output is being written by another worker: {target}")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(owner)
+        break
+
+    try:
+        yield
+    finally:
+        try:
+            os.remove(lock_path)
+        except FileNotFoundError:
+            pass
+
+
+@contextmanager
+def claim_output_folder(folder: str) -> Iterator[str]:
+    """
+    出力フォルダを .lock で確保し、前回の出力を消してから使う（終了時にロックを外す）
+
+    Raises:
+        OutputFolderBusy: 別のワーカーが同じフォルダを処理中
+    """
+    os.makedirs(folder, exist_ok=True)
+    with claim_lock(os.path.join(folder, LOCK_FILE), folder):
+        _clear_folder(folder)
+        yield folder
+
+
+class PartialTextFile:
+    """path.part に逐次書き、close() で path に置き換えるテキストファイル"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path + PARTIAL_SUFFIX, "w", encoding="utf-8")
+
+    @property
+    def closed(self) -> bool:
+        return self._file.closed
+
+    def write(self, text: str) -> int:
+        return self._file.write(text)
+
+    def flush(self) -> None:
+        self._file.flush()
+
+    def close(self) -> None:
+        if self._file.closed:
+            return
+        self._file.close()
+        os.replace(self.path + PARTIAL_SUFFIX, self.path)
+
+
+class PostsWriter:
+    """posts.txt と posts.jsonl を逐次書き出す"""
+
+    def __init__(self, output: "ThreadOutput", url: str, title: str, op_ids: List[str],
+                 twitter_image_files: Optional[List[str]] = None):
+        """
+        Args:
+            output: 出力先（output_sinks.ThreadOutput）
+            url: スレッドURL
+            title: ページタイトル
+            op_ids: スレ主ID
+            twitter_image_files: Twitter/X 埋め込みのキャプチャファイル名
+        """
+        self.op_ids = set(op_ids)
+        self.post_count = 0
+        self._text_started = False
+        self._text = output.open_text("posts.txt")
+        self._jsonl = output.open_text("posts.jsonl")
+
+        lines = [title]
+        for op_id in op_ids:
+            lines.append(f"ID:{op_id}")
+        lines.append("")
+        if twitter_image_files:
+            lines.append("=== X（Twitter）投稿 ===")
+            lines.extend(twitter_image_files)
+            lines.append("")
+        self._write_text_lines(lines)
+        self._write_record({
+            "type": "thread",
+            "url": url,
+            "title": title,
+            "op_ids": list(op_ids),
+            "twitter_images": list(twitter_image_files or []),
+        })
+
+    def _write_text_lines(self, lines: List[str]) -> None:
+        # 旧実装（"\n".join）と同じく、最後の行の後ろには改行を付けない
+        prefix = "\n" if self._text_started else ""
+        self._text.write(prefix + "\n".join(lines))
+        self._text_started = True
+        self._text.flush()
+
+    def _write_record(self, record: Dict) -> None:
+        self._jsonl.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._jsonl.flush()
+
+    def write_post(self, header: Dict[str, str], header_text: str, body: str,
+                   images: List[Dict[str, str]], post_id: Optional[str]) -> None:
+        """
+        確定した投稿を1件書き出す
+
+        Args:
+            header: parse_response_header() の結果
+            header_text: レスヘッダー全文
+            body: 本文
+            images: [{"file": "画像1.jpg", "url": "https://..."}, ...]
+            post_id: レスID
+        """
+        self.post_count += 1
+        lines = [header_text]
+        lines.extend(image["file"] for image in images)
+        if body:
+            lines.append(body)
+        lines.append("")
+        self._write_text_lines(lines)
+        self._write_record({
+            "type": "post",
+            "index": self.post_count,
+            "number": header.get("number") or None,
+            "name": header.get("name") or None,
+            "id": post_id,
+            "is_op": bool(post_id) and post_id in self.op_ids,
+            "header": header_text,
+            "body": body,
+            "images": images,
+        })
+
+    def close(self) -> None:
+        """posts.txt / posts.jsonl を確定する"""
+        self._text.close()
+        self._jsonl.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
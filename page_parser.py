@@ -0,0 +1,333 @@
+# coding: utf-8
+"""
+ページの解析と投稿抽出
+
+page.content() で取得したHTMLを BeautifulSoup で解析し、パターン判定・抽出を行って、
+Tag への参照を持たない投稿レコード（post_record.Post）を返す。
+
+解析と抽出はCPUを使い続けGILを握るため、複数のページを並行して処理する場合は
+プロセスプールで実行する（PARSE_WORKERS）。子プロセスにはHTML文字列だけを渡し、
+pickle 可能な ParsedPage だけを受け取るので、ブラウザ操作や画像ダウンロードの
+スレッドが解析を待たされない。
+"""
+import atexit
+import logging
+import os
+import re
+import threading
+from typing import TYPE_CHECKING, Dict, List, NamedTuple, Optional, Tuple
+
+from extractors.pagination import find_page_urls
+from post_record import Post, compact_posts
+from scrape_logging import configure_logging, log_context
+from scrape_metrics import UrlMetrics
+
+if TYPE_CHECKING:
+    from concurrent.futures import ProcessPoolExecutor
+    from bs4 import BeautifulSoup, Tag
+
+logger = logging.getLogger(__name__)
+
+# デバッグ用に記録するページ内のクラス名の最大数（投稿を抽出できなかった場合）
+MAX_PAGE_CLASSES = 50
+
+
+class ParsedPage(NamedTuple):
+    """parse_page の結果（プロセス間で受け渡す）"""
+    title: str                      # <title> のテキスト（なければ "post"）
+    posts: Tuple[Post, ...]
+    op_ids: Tuple[str, ...]         # スレ主ID
+    pattern: Optional[str]          # 使用した抽出パターン
+    pattern_fallbacks: int
+    stage_seconds: Dict[str, float]  # parse / detect / extract の所要時間
+    page_classes: Tuple[str, ...]   # 投稿を抽出できなかった場合のみ、ページ内のクラス名
+    page_urls: Tuple[str, ...] = ()  # 同じスレッドの2ページ目以降（extractors.pagination）
+
+
+def parse_page(html: str, url: str, metrics: Optional[UrlMetrics] = None,
+               thread_url: Optional[str] = None) -> ParsedPage:
+    """
+    HTMLを解析して投稿を抽出する（プロセスプールからも呼ばれる）
+
+    Args:
+        html: ページのHTML
+        url: ページのURL（相対URLの解決に使用）
+        metrics: 同じプロセスで実行する場合の記録先（省略時は内部で作成し、
+                 所要時間を ParsedPage.stage_seconds で返す）
+        thread_url: 複数ページのスレッドの2ページ目以降を解析する場合の1ページ目のURL
+                    （同じスレッドの他のページを探す基準）
+    """
+    from bs4 import BeautifulSoup
+
+    if metrics is None:
+        metrics = UrlMetrics(url)
+    fallbacks_before = metrics.pattern_fallbacks
+
+    with metrics.stage("parse"):
+        soup = BeautifulSoup(html, "html.parser")
+    metrics.rss.sample("parse")
+
+    title_tag = soup.title.get_text(strip=True) if soup.title else "post"
+
+    # パターン選択ロジックを使用して投稿を抽出
+    try:
+        from extractors.pattern_loader import extract_posts_from_page
+        # 抽出器は session を保持するだけで通信しないため、子プロセスには渡さない
+        posts = extract_posts_from_page(soup, None, url, metrics=metrics)
+    except ImportError as e:
+        logger.error("Failed to import extractors.pattern_loader: %s", e)
+        logger.error("Please ensure extractors/ folder exists with all required modules.")
+        posts = []
+        article = soup.select_one("article, .article-body, .entry-content, #article-body")
+        
+        if article:
+            elements = article.find_all(['div', 'p', 'blockquote'], recursive=False)
+            
+            current_header = ""
+            current_body_parts = []
+            current_imgs = []
+            current_id = None
+            
+            for elem in elements:
+                elem_text = elem.get_text(strip=True)
+                
+                # Check if this is a response header (starts with number:)
+                if elem_text and re.match(r'^\d+:', elem_text):
+                    # Save previous post
+                    if current_header:
+                        posts.append({
+                            "header": current_header,
+                            "body": "\n".join([p for p in current_body_parts if p]),
+                            "images": list(current_imgs),
+                            "id": current_id
+                        })
+                    
+                    # New response header
+                    current_header = elem_text
+                    parsed = parse_response_header(elem_text)
+                    current_id = parsed["id"]
+                    current_body_parts = []
+                    current_imgs = []
+                    continue
+                
+                # If we have a current header, collect body and images
+                if current_header:
+                    # Collect images
+                    for img in elem.find_all("img"):
+                        current_imgs.append(img)
+                    
+                    # Collect text (excluding image URLs)
+                    body_text = clean_text_from_images(elem)
+                    if body_text and body_text != current_header:
+                        current_body_parts.append(body_text)
+            
+            # Save last post
+            if current_header:
+                posts.append({
+                    "header": current_header,
+                    "body": "\n".join([p for p in current_body_parts if p]),
+                    "images": list(current_imgs),
+                    "id": current_id
+                })
+
+    # Tag への参照を持たないコンパクトなレコードに変換（以降 soup は不要）
+    posts = compact_posts(posts)
+    metrics.rss.sample("extract")
+
+    page_classes = []
+    if not posts:
+        for elem in soup.find_all(class_=True):
+            for cls in elem.get('class', []):
+                if cls not in page_classes:
+                    page_classes.append(cls)
+
+    first_post_id = posts[0].id if posts else None
+    op_ids = detect_thread_creator_ids(soup, first_post_id)
+
+    page_urls = []
+    if posts:
+        page_urls = find_page_urls(soup, thread_url or url)
+
+    # 呼び出し元に解析済みの木を残さないよう、ここで解放する
+    soup.decompose()
+    del soup
+
+    return ParsedPage(
+        title=title_tag,
+        posts=tuple(posts),
+        op_ids=tuple(op_ids),
+        pattern=metrics.pattern,
+        pattern_fallbacks=metrics.pattern_fallbacks - fallbacks_before,
+        stage_seconds=dict(metrics.stage_seconds),
+        page_classes=tuple(page_classes[:MAX_PAGE_CLASSES]),
+        page_urls=tuple(page_urls),
+    )
+
+
+def _parse_page_in_worker(html: str, url: str, thread_url: Optional[str]) -> ParsedPage:
+    """プロセスプールの子プロセスで実行（ログに URL を付ける）"""
+    with log_context(url=url):
+        return parse_page(html, url, thread_url=thread_url)
+
+
+def auto_parse_workers() -> int:
+    """CPU数に合わせたワーカー数（1CPUのマシンでは別プロセスにしても速くならないので 0）"""
+    return max(0, min(4, (os.cpu_count() or 1) - 1))
+
+
+def _default_parse_workers() -> int:
+    """
+    環境変数 PARSE_WORKERS（auto / 0 / ワーカー数）から決める
+
+    未設定なら 0。1URLずつ処理する CLI では、別プロセスに渡しても結果を待つだけで
+    HTML の受け渡しの分だけ遅くなる。同時に複数のジョブを処理するAPIサーバーは
+    set_parse_workers で設定する。
+    """
+    value = os.environ.get("PARSE_WORKERS", "0").strip().lower()
+    if value == "auto":
+        return auto_parse_workers()
+    return max(0, int(value))
+
+
+_parse_workers: Optional[int] = None
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def set_parse_workers(workers: int) -> None:
+    """解析用プロセスプールのワーカー数を設定（0 で呼び出し元のプロセスで解析）。プール作成前に呼ぶ"""
+    global _parse_workers
+    with _pool_lock:
+        if _pool is not None:
+            raise RuntimeError("parse pool is already running")
+        _parse_workers = max(0, workers)
+
+
+def get_parse_pool() -> Optional["ProcessPoolExecutor"]:
+    """解析用のプロセスプールを取得（ワーカー数が 0 なら None）"""
+    global _pool, _parse_workers
+    with _pool_lock:
+        if _parse_workers is None:
+            _parse_workers = _default_parse_workers()
+        if _parse_workers == 0:
+            return None
+        if _pool is None:
+            from concurrent.futures import ProcessPoolExecutor
+            _pool = ProcessPoolExecutor(max_workers=_parse_workers, initializer=configure_logging)
+            atexit.register(_pool.shutdown)
+        return _pool
+
+
+def run_parse_page(html: str, url: str, metrics: UrlMetrics, thread_url: Optional[str] = None) -> ParsedPage:
+    """
+    parse_page をプロセスプール（設定されていれば）で実行し、所要時間とパターンを metrics に反映する
+
+    プロファイル中（--profile）のURLは、計測できるように呼び出し元のプロセスで解析する。
+    """
+    pool = None if metrics.profiled else get_parse_pool()
+    if pool is None:
+        return parse_page(html, url, metrics, thread_url)
+
+    from concurrent.futures.process import BrokenProcessPool
+    try:
+        parsed = pool.submit(_parse_page_in_worker, html, url, thread_url).result()
+    except BrokenProcessPool:
+        # 子プロセスが落ちた場合（メモリ不足など）はプールを作り直し、このURLはここで解析する
+        logger.warning("Parse worker crashed; parsing %s in-process", url)
+        _discard_pool(pool)
+        return parse_page(html, url, metrics, thread_url)
+    for name, seconds in parsed.stage_seconds.items():
+        metrics.add_stage_seconds(name, seconds)
+    metrics.pattern = parsed.pattern
+    metrics.pattern_fallbacks += parsed.pattern_fallbacks
+    metrics.rss.sample("extract")
+    return parsed
+
+
+def _discard_pool(pool) -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False)
+
+
+def clean_text_from_images(elem: "Tag") -> str:
+    from bs4 import BeautifulSoup
+    elem_copy = BeautifulSoup(str(elem), "html.parser")
+    
+    # Remove ad/RSS sections
+    for ad_elem in elem_copy.find_all(class_=re.compile(r'(rss|ad|related|sidebar|widget)', re.I)):
+        ad_elem.decompose()
+    
+    # Remove specific ad text patterns
+    for div in elem_copy.find_all(['div', 'p', 'span']):
+        text = div.get_text()
+        if any(keyword in text for keyword in ['記事の途中ですが', 'RSS', '関連記事', 'スポンサー', '広告']):
+            div.decompose()
+    
+    for img in elem_copy.find_all("img"):
+        img.decompose()
+    
+    for a in elem_copy.find_all("a"):
+        href = a.get("href", "")
+        text = a.get_text()
+        if any(keyword in href.lower() for keyword in ["imgur.com", "i.imgur", ".jpg", ".jpeg", ".png", ".gif", ".webp"]):
+            a.decompose()
+        elif any(keyword in text.lower() for keyword in ["imgur.com", "i.imgur", ".jpg", ".jpeg", ".png", ".gif", ".webp"]):
+            a.decompose()
+    
+    text = elem_copy.get_text("\n", strip=True)
+    text = re.sub(r'https?://[^\s]*(?:imgur\.com|i\.imgur)[^\s]*', '', text)
+    text = re.sub(r'https?://[^\s]*\.(?:jpg|jpeg|png|gif|webp)[^\s]*', '', text, flags=re.IGNORECASE)
+    
+    return text.strip()
+
+
+def extract_id_from_text(text: str) -> Optional[str]:
+    match = re.search(r'ID:([A-Za-z0-9]+)', text)
+    if match:
+        return match.group(1)
+    return None
+
+
+def detect_thread_creator_ids(soup: "BeautifulSoup", first_post_id: Optional[str]) -> List[str]:
+    op_ids = set()
+    
+    if first_post_id:
+        op_ids.add(first_post_id)
+    
+    op_elements = soup.find_all(class_=re.compile(r'(op|thread-creator|author|postauthor)', re.I))
+    for elem in op_elements:
+        text = elem.get_text()
+        post_id = extract_id_from_text(text)
+        if post_id:
+            op_ids.add(post_id)
+    
+    return sorted(list(op_ids))
+
+
+def parse_response_header(header_text: str) -> Dict[str, str]:
+    result = {
+        "number": "",
+        "name": "",
+        "datetime": "",
+        "id": "",
+        "full": header_text.strip()
+    }
+    
+    num_match = re.match(r'^(\d+):', header_text)
+    if num_match:
+        result["number"] = num_match.group(1)
+    
+    # "1: 名無しさん 25/03/23(日) 08:24:57 ID:od5C" → 名前と日時
+    name_match = re.match(r'^\d+:\s*(.*?)\s*(\d{2,4}/\d{1,2}/\d{1,2}.*?)(?:\s*ID:|$)', header_text.strip())
+    if name_match:
+        result["name"] = name_match.group(1).rstrip(":：").strip()
+        result["datetime"] = name_match.group(2).strip()
+    
+    id_match = re.search(r'ID:([A-Za-z0-9]+)', header_text)
+    if id_match:
+        result["id"] = id_match.group(1)
+    
+    return result
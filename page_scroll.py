@@ -0,0 +1,158 @@
+# coding: utf-8
+"""
+Lazy Load 用のスクロール
+
+従来はすべてのページで最大20回のスクロールを行っていたが、多くのサイトでは
+画像のURLが最初のDOMの data-src などに入っており、スクロールは不要。
+スクロールの前にページ内で画像を調べ、必要な場合だけスクロールする。
+
+1. 本文領域（.t_b / dd / .entry-content など）の <img> を調べ、遅延読み込み属性
+   （data-src 等）があって src がまだ入っていないものは、スクリプトで src に移す
+2. それでも URL の分からない画像（src が空・data: URI のプレースホルダーで、遅延読み込み属性もない）
+   や未描画の Twitter/X 埋め込みがなければ、スクロールしない
+3. 残りが少なければ、その要素だけを順に画面内へスクロールする
+4. 本文領域が見つからない・残りが多い場合は従来どおりページ末尾までスクロールする
+
+SCROLL_MODE（CLIでは --scroll）で auto / full（常に従来どおり）/ never を選べる。
+"""
+import logging
+import os
+from typing import Dict, NamedTuple
+
+logger = logging.getLogger(__name__)
+
+SCROLL_MODES = ("auto", "full", "never")
+
+# extract_img_src と同じ順で見る遅延読み込み属性（src は除く）
+LAZY_ATTRIBUTES = ("data-src", "data-original", "data-lazy", "data-image")
+
+# 本文領域の候補（抽出パターンが投稿を探す要素）
+CONTENT_SELECTORS = ".t_h, .t_b, dl dd, .entry-content, .article-body, .article-body-inner, article, main"
+
+# この数までは要素ごとに画面内へスクロールする（多い場合はページ全体をスクロール）
+MAX_TARGETED_ELEMENTS = 30
+TARGETED_WAIT_MS = 300
+
+# URL の分からない要素に付ける印（要素ごとのスクロールで使う）
+PENDING_ATTRIBUTE = "data-scrape-pending"
+
+_PRECHECK_JS = """
+([lazyAttributes, contentSelectors, pendingAttribute]) => {
+    const roots = Array.from(document.querySelectorAll(contentSelectors));
+    const scopes = roots.length ? roots : [document.body];
+    const images = new Set();
+    scopes.forEach(scope => scope.querySelectorAll("img").forEach(img => images.add(img)));
+    const result = {content: roots.length > 0, images: images.size, resolved: 0, forced: 0, unresolved: 0};
+    images.forEach(img => {
+        const src = img.getAttribute("src") || "";
+        const placeholder = !src || src.startsWith("data:");
+        const lazy = lazyAttributes.map(name => img.getAttribute(name)).find(value => value);
+        if (lazy && lazy !== src && (placeholder || img.classList.contains("lazy") || img.classList.contains("lazyload"))) {
+            img.setAttribute("src", lazy);
+            result.forced += 1;
+        } else if (placeholder && !lazy) {
+            img.setAttribute(pendingAttribute, "1");
+            result.unresolved += 1;
+        } else {
+            result.resolved += 1;
+        }
+    });
+    document.querySelectorAll("blockquote.twitter-tweet").forEach(quote => {
+        quote.setAttribute(pendingAttribute, "1");
+        result.unresolved += 1;
+    });
+    return result;
+}
+"""
+
+_SCROLL_TO_PENDING_JS = """
+([pendingAttribute, index]) => {
+    const element = document.querySelectorAll("[" + pendingAttribute + "]")[index];
+    if (element) {
+        element.scrollIntoView({block: "center"});
+    }
+    return !!element;
+}
+"""
+
+
+class LazyImageCheck(NamedTuple):
+    """スクロール前の画像の状態"""
+    content: bool      # 本文領域が見つかったか（False ならページ全体を数えた）
+    images: int
+    resolved: int      # src に URL が入っている
+    forced: int        # 遅延読み込み属性を src に移した
+    unresolved: int    # URL が分からない画像と未描画の埋め込み
+
+
+def default_scroll_mode() -> str:
+    mode = os.environ.get("SCROLL_MODE", "auto").strip().lower()
+    return mode if mode in SCROLL_MODES else "auto"
+
+
+def check_lazy_images(page) -> LazyImageCheck:
+    """本文領域の画像を調べ、遅延読み込み属性をスクリプトで src に移す"""
+    result: Dict = page.evaluate(_PRECHECK_JS, [list(LAZY_ATTRIBUTES), CONTENT_SELECTORS, PENDING_ATTRIBUTE])
+    return LazyImageCheck(**{name: result[name] for name in LazyImageCheck._fields})
+
+
+def scroll_to_bottom(page) -> None:
+    """ページの高さが変わらなくなるまで末尾へスクロールする（最大20回）"""
+    page.wait_for_timeout(2000)
+
+    last_height = page.evaluate("document.body.scrollHeight")
+    scroll_attempts = 0
+
+    for _ in range(20):
+        page.evaluate("window.scrollTo(0, document.body.scrollHeight)")
+        page.wait_for_timeout(1500)
+
+        new_height = page.evaluate("document.body.scrollHeight")
+        if new_height == last_height:
+            scroll_attempts += 1
+            if scroll_attempts >= 3:
+                break
+        else:
+            scroll_attempts = 0
+        last_height = new_height
+
+    page.evaluate("window.scrollTo(0, 0)")
+    page.wait_for_timeout(1000)
+
+
+def scroll_to_pending(page, count: int) -> None:
+    """URL の分からない要素だけを順に画面内へスクロールする"""
+    for index in range(count):
+        if not page.evaluate(_SCROLL_TO_PENDING_JS, [PENDING_ATTRIBUTE, index]):
+            break
+        page.wait_for_timeout(TARGETED_WAIT_MS)
+    page.evaluate("window.scrollTo(0, 0)")
+
+
+def scroll_for_lazy_images(page, mode: str = "auto") -> str:
+    """
+    画像の遅延読み込みのためにスクロールし、行った処理を返す
+
+    Returns:
+        "skipped"（不要だった）/ "targeted"（要素ごと）/ "full"（ページ全体）/ "never"
+    """
+    page.wait_for_load_state("domcontentloaded")
+    if mode == "never":
+        return "never"
+    if mode == "full":
+        scroll_to_bottom(page)
+        return "full"
+
+    check = check_lazy_images(page)
+    logger.debug("Lazy image check: %s", check._asdict())
+    if not check.content or (check.images == 0 and check.unresolved == 0):
+        # 投稿の場所が分からない・画像が1枚もない（スクロールで読み込まれる可能性がある）
+        scroll_to_bottom(page)
+        return "full"
+    if check.unresolved == 0:
+        return "skipped"
+    if check.unresolved <= MAX_TARGETED_ELEMENTS:
+        scroll_to_pending(page, check.unresolved)
+        return "targeted"
+    scroll_to_bottom(page)
+    return "full"
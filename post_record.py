@@ -0,0 +1,89 @@
+# coding: utf-8
+"""
+投稿・画像のコンパクトな表現
+
+抽出器が返す投稿（辞書、画像は (type, url, Tag) のタプル）から、
+ダウンロード以降の処理に必要な属性だけをコピーした不変レコードを作る。
+Tag への参照を残さないため、抽出直後に BeautifulSoup の木を解放できる。
+レコードは pickle 可能で、プロセス間でも受け渡せる。
+"""
+from typing import Iterable, List, NamedTuple, Optional, Tuple
+
+
+class ImageRef(NamedTuple):
+    """投稿内の画像1件"""
+    type: str                    # "img", "link", "iframe"
+    url: str                     # 画像URL（相対URLの場合あり）
+    width: Optional[str] = None  # width 属性
+    height: Optional[str] = None  # height 属性
+    classes: Tuple[str, ...] = ()  # class 属性
+    element_id: str = ""         # id 属性
+    in_thread_body: bool = False  # 親または親の親が .t_b か（広告判定の緩和に使用）
+
+    @classmethod
+    def from_element(cls, img_type: str, url: str, element=None) -> "ImageRef":
+        """BeautifulSoup の要素から必要な属性だけをコピーして作成"""
+        if element is None or not hasattr(element, "get"):
+            return cls(img_type, url)
+        in_thread_body = False
+        parent = getattr(element, "parent", None)
+        if parent is not None:
+            if "t_b" in (parent.get("class") or []):
+                in_thread_body = True
+            elif parent.parent is not None and "t_b" in (parent.parent.get("class") or []):
+                in_thread_body = True
+        width = element.get("width")
+        height = element.get("height")
+        return cls(
+            type=img_type,
+            url=url,
+            width=str(width) if width else None,
+            height=str(height) if height else None,
+            classes=tuple(element.get("class") or ()),
+            element_id=str(element.get("id") or ""),
+            in_thread_body=in_thread_body,
+        )
+
+
+class Post(NamedTuple):
+    """投稿1件"""
+    header: str
+    body: str
+    images: Tuple[ImageRef, ...]
+    id: Optional[str]
+
+    @classmethod
+    def from_dict(cls, post: dict) -> "Post":
+        """抽出器が返す辞書形式の投稿から作成"""
+        images = []
+        for img_data in post.get("images") or []:
+            if isinstance(img_data, ImageRef):
+                images.append(img_data)
+            elif isinstance(img_data, tuple) and len(img_data) == 3:
+                img_type, src, img_element = img_data
+                if src:
+                    images.append(ImageRef.from_element(img_type, src, img_element))
+            elif hasattr(img_data, "get"):
+                # <img> タグがそのまま入っている場合（旧形式）
+                src = _extract_img_src(img_data)
+                if src:
+                    images.append(ImageRef.from_element("img", src, img_data))
+        return cls(
+            header=post.get("header", ""),
+            body=post.get("body", ""),
+            images=tuple(images),
+            id=post.get("id"),
+        )
+
+
+def compact_posts(posts: Iterable) -> List[Post]:
+    """辞書形式の投稿リストを Post のリストに変換（変換済みのものはそのまま）"""
+    return [post if isinstance(post, Post) else Post.from_dict(post) for post in posts]
+
+
+def _extract_img_src(img_tag) -> Optional[str]:
+    for attr in ["src", "data-src", "data-original", "data-lazy", "data-image"]:
+        val = img_tag.get(attr)
+        if val:
+            return val
+    return None
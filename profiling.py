@@ -0,0 +1,145 @@
+# coding: utf-8
+"""
+URLごとのプロファイリング
+
+scrape_single_url_js の呼び出しを cProfile と tracemalloc で包み、
+URLの出力フォルダに次のファイルを書き出す。
+
+- profile.prof      : cProfile の結果（snakeviz や pstats で閲覧）
+- profile_alloc.txt : 累積時間の上位関数と、メモリ確保量の上位行
+                      （RSSを記録する区切りのうち、確保量が最大だった時点のもの）
+
+cProfile と tracemalloc はプロセス全体で1つしか動かせないため、
+Webアプリ版で複数ジョブが同時にプロファイルを要求した場合は
+先着の1件だけを計測し、残りは通常どおり処理する。
+"""
+import cProfile
+import hashlib
+import io
+import logging
+import os
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+PROFILE_FILENAME = "profile.prof"
+ALLOC_FILENAME = "profile_alloc.txt"
+DEFAULT_TOP_N = 30
+# 確保元として記録するスタックの深さ（深くするほど計測が重くなる）
+TRACEMALLOC_FRAMES = 1
+
+_profile_lock = threading.Lock()
+
+
+@contextmanager
+def profile_url(enabled: bool, metrics, result_root: str, top_n: int = DEFAULT_TOP_N):
+    """
+    with profile_url(True, metrics, result_root): scrape_single_url_js(...)
+
+    Args:
+        enabled: False の場合は何もしない
+        metrics: 対象URLの UrlMetrics（metrics.folder を出力先に使う）
+        result_root: 出力フォルダが決まらなかった場合の出力先
+        top_n: サマリーに出す上位件数
+    """
+    if not enabled:
+        yield
+        return
+    if not _profile_lock.acquire(blocking=False):
+        logger.warning("Profiler is busy with another URL; %s is not profiled", metrics.url)
+        yield
+        return
+
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+    else:
+        tracemalloc.clear_traces()
+    tracemalloc.reset_peak()
+    # RSSの記録時（content, parse, extract ...）に確保量が最大ならスナップショットを取る
+    largest = {"size": -1, "label": None, "snapshot": None}
+    original_sample = metrics.rss.sample
+
+    def sample_with_snapshot(label: str):
+        current, _peak = tracemalloc.get_traced_memory()
+        if current > largest["size"]:
+            largest.update(size=current, label=label, snapshot=tracemalloc.take_snapshot())
+        return original_sample(label)
+
+    metrics.rss.sample = sample_with_snapshot
+    # 解析をプロセスプールに回さず、このプロセスで計測できるようにする
+    metrics.profiled = True
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            del metrics.rss.sample
+            metrics.profiled = False
+            if largest["snapshot"] is None:
+                largest.update(label="end", snapshot=tracemalloc.take_snapshot())
+            _current, peak = tracemalloc.get_traced_memory()
+            if started_tracing:
+                tracemalloc.stop()
+            _write_profile(profiler, largest["snapshot"], largest["label"], peak,
+                           metrics, result_root, top_n)
+    finally:
+        _profile_lock.release()
+
+
+def _output_paths(metrics, result_root: str):
+    """URLの出力フォルダ（未作成なら result_root にURLのハッシュ付きで出力）"""
+    if metrics.folder and os.path.isdir(metrics.folder):
+        return (os.path.join(metrics.folder, PROFILE_FILENAME),
+                os.path.join(metrics.folder, ALLOC_FILENAME))
+    prefix = "_" + hashlib.sha1(metrics.url.encode("utf-8")).hexdigest()[:8] + "_"
+    return (os.path.join(result_root, prefix + PROFILE_FILENAME),
+            os.path.join(result_root, prefix + ALLOC_FILENAME))
+
+
+def _write_profile(profiler: cProfile.Profile, snapshot, snapshot_label: str, peak: int,
+                   metrics, result_root: str, top_n: int) -> None:
+    prof_path, alloc_path = _output_paths(metrics, result_root)
+    try:
+        profiler.dump_stats(prof_path)
+        summary = format_summary(profiler, snapshot, snapshot_label, peak, metrics.url, top_n)
+        with open(alloc_path, "w", encoding="utf-8") as f:
+            f.write(summary)
+    except Exception as e:
+        # プロファイルの書き出し失敗で本来の処理結果を失わないようにする
+        logger.warning("Failed to write profile for %s: %s", metrics.url, e)
+        return
+    logger.info("Profile written: %s", prof_path)
+
+
+def format_summary(profiler: cProfile.Profile, snapshot, snapshot_label: str, peak: Optional[int],
+                   url: str, top_n: int = DEFAULT_TOP_N) -> str:
+    """CPU（累積時間）とメモリ確保量の上位 top_n 件をテキストにまとめる"""
+    lines = [f"URL: {url}"]
+    if peak is not None:
+        lines.append(f"Peak traced memory: {peak / 1048576:.1f}MB")
+    lines.append("")
+
+    lines.append(f"=== CPU: top {top_n} by cumulative time ===")
+    import pstats  # 計測しないときは読み込まない
+    stream = io.StringIO()
+    stats = pstats.Stats(profiler, stream=stream)
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(top_n)
+    lines.append(stream.getvalue().strip())
+    lines.append("")
+
+    lines.append(f"=== Memory: top {top_n} allocation sites (snapshot at {snapshot_label}) ===")
+    snapshot = snapshot.filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<unknown>"),
+    ))
+    for stat in snapshot.statistics("lineno")[:top_n]:
+        frame = stat.traceback[0]
+        lines.append(f"{stat.size / 1024:10.1f} KiB  {stat.count:8d} blocks  {frame.filename}:{frame.lineno}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,241 @@
+# coding: utf-8
+"""
+Prometheus 形式のメトリクス
+
+外部ライブラリを使わない最小限の Counter / Gauge / Histogram と、
+Webアプリ版（app.py）が公開するメトリクスの定義。
+
+値の更新はジョブ・URLの完了時に1回ずつ行い、画像ごとの処理ループでは
+何もしない（スクレイピング処理への影響を避けるため）。
+"""
+import os
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from memory_usage import current_rss_bytes
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, help_text: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """単調増加するカウンタ"""
+    type_name = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: Iterable[str] = ()):
+        super().__init__(name, help_text, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+                for key, value in items]
+
+
+class Gauge(_Metric):
+    """増減する値（set_function を指定すると出力時に値を計算する）"""
+    type_name = "gauge"
+
+    def __init__(self, name: str, help_text: str, labels: Iterable[str] = ()):
+        super().__init__(name, help_text, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._function: Optional[Callable[[], Optional[float]]] = None
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def set_function(self, function: Callable[[], Optional[float]]) -> None:
+        self._function = function
+
+    def _samples(self) -> List[str]:
+        if self._function is not None:
+            try:
+                value = self._function()
+            except Exception:
+                value = None
+            return [] if value is None else [f"{self.name} {_format_value(value)}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+                for key, value in items]
+
+
+class Histogram(_Metric):
+    """累積バケット付きのヒストグラム"""
+    type_name = "histogram"
+
+    def __init__(self, name: str, help_text: str, buckets: Iterable[float], labels: Iterable[str] = ()):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # ラベル値 → [バケットごとの件数..., 合計, 件数]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, list(state)) for key, state in self._values.items())
+        lines = []
+        for key, state in items:
+            for bound, count in zip(self.buckets, state):
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, le)} {_format_value(count)}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {_format_value(state[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {_format_value(state[-1])}")
+        return lines
+
+
+class Registry:
+    """メトリクスの登録と Prometheus テキスト形式での出力"""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def directory_size_bytes(paths: Iterable[str]) -> int:
+    """フォルダ配下のファイルサイズ合計（/metrics 取得時のみ計算）"""
+    total = 0
+    for path in paths:
+        for root, _dirs, files in os.walk(path):
+            for name in files:
+                try:
+                    total += os.path.getsize(os.path.join(root, name))
+                except OSError:
+                    continue
+    return total
+
+
+# ----------------------------------------
+# Webアプリ版のメトリクス定義
+# ----------------------------------------
+REGISTRY = Registry()
+
+JOBS_TOTAL = REGISTRY.register(Counter(
+    "scrape_jobs_total", "Completed /api/scrape jobs by result", ["status"]))
+JOBS_IN_PROGRESS = REGISTRY.register(Gauge(
+    "scrape_jobs_in_progress", "/api/scrape jobs currently running"))
+JOBS_IN_PROGRESS.set(0)
+JOB_DURATION = REGISTRY.register(Histogram(
+    "scrape_job_duration_seconds", "Wall time of /api/scrape jobs",
+    buckets=(1, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600)))
+QUEUE_DEPTH = REGISTRY.register(Gauge(
+    "scrape_queue_depth", "/api/scrape jobs waiting for a free slot"))
+QUEUE_WAIT_SECONDS = REGISTRY.register(Histogram(
+    "scrape_queue_wait_seconds", "Time /api/scrape jobs waited before starting by priority",
+    buckets=(0.1, 1, 5, 10, 30, 60, 120, 300, 600), labels=["priority"]))
+JOB_YIELDS = REGISTRY.register(Counter(
+    "scrape_job_yields_total", "Times a batch job gave up its slot to a higher-priority job"))
+ADMISSION_REJECTED = REGISTRY.register(Counter(
+    "scrape_admission_rejected_total", "/api/scrape requests answered with 429 by reason", ["reason"]))
+URLS_TOTAL = REGISTRY.register(Counter(
+    "scrape_urls_total", "Scraped URLs by result", ["status"]))
+URL_STAGE_SECONDS = REGISTRY.register(Histogram(
+    "scrape_url_stage_seconds", "Time spent per URL in each stage",
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300), labels=["stage"]))
+DOWNLOADED_BYTES = REGISTRY.register(Counter(
+    "scrape_downloaded_bytes_total", "Image bytes downloaded by host", ["host"]))
+IMAGES_TOTAL = REGISTRY.register(Counter(
+    "scrape_images_total", "Image download attempts by result", ["result"]))
+PATTERN_TOTAL = REGISTRY.register(Counter(
+    "scrape_extractor_pattern_total", "URLs handled by each extraction pattern", ["pattern"]))
+BROWSERS_ACTIVE = REGISTRY.register(Gauge(
+    "scrape_browsers_active", "Chromium instances currently launched by the server"))
+BROWSERS_ACTIVE.set(0)
+TEMP_DISK_BYTES = REGISTRY.register(Gauge(
+    "scrape_temp_disk_bytes", "Bytes held in temporary result directories"))
+RESULT_STORE_EVICTIONS = REGISTRY.register(Counter(
+    "scrape_result_store_evictions_total", "Result directories removed by the result store", ["reason"]))
+RESULT_STORE_EVICTED_BYTES = REGISTRY.register(Counter(
+    "scrape_result_store_evicted_bytes_total", "Bytes removed by the result store", ["reason"]))
+PROCESS_RSS_BYTES = REGISTRY.register(Gauge(
+    "process_resident_memory_bytes", "Resident memory size of the server process"))
+PROCESS_RSS_BYTES.set_function(current_rss_bytes)
+
+
+def record_url(metrics) -> None:
+    """URL1件の処理結果（scrape_metrics.UrlMetrics）を反映"""
+    URLS_TOTAL.inc(status=metrics.status or "unknown")
+    for stage, seconds in metrics.stage_seconds.items():
+        URL_STAGE_SECONDS.observe(seconds, stage=stage)
+    for host, nbytes in metrics.bytes_by_host.items():
+        DOWNLOADED_BYTES.inc(nbytes, host=host)
+    if metrics.images_downloaded:
+        IMAGES_TOTAL.inc(metrics.images_downloaded, result="downloaded")
+    if metrics.images_failed:
+        IMAGES_TOTAL.inc(metrics.images_failed, result="failed")
+    if metrics.pattern:
+        PATTERN_TOTAL.inc(pattern=metrics.pattern)
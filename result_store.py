@@ -0,0 +1,198 @@
+# coding: utf-8
+"""
+APIサーバーの結果の一時保管（ディスク上限・TTL）
+
+/api/scrape と /api/jobs/<batch>/download は、ジョブごとのフォルダに結果のZIPを作って返す。
+返し終わった結果はすぐには消さず（送信中・再送のため）、次のどれかで消す。
+
+- 保管中の合計が上限（RESULT_STORE_MAX_MB）を超えた: 処理が終わった時刻の古いものから、
+  超えた分のサイズだけ即座に消す（処理中のジョブのフォルダは消さない）
+- 保管期限（RESULT_TTL_SECONDS）が過ぎた: 次に期限が来る時刻まで待つスレッドが消す
+- 前回の起動で残ったフォルダ（作ったプロセスが終了している）: 起動時に消す
+
+送信中などで消せなかったファイル（Windows では開いているファイルを消せない）は、
+残った分のサイズで保管に戻し、次の期限に消し直す。
+
+保管先は RESULT_STORE_DIR（既定: 一時フォルダの scrape_results）。同じ保管先を
+複数のサーバープロセスで共有してもよい（動いている他のプロセスのフォルダは起動時に消さない）。
+"""
+import json
+import logging
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+
+from output_writer import LOCK_STALE_SECONDS, pid_alive
+from prometheus_metrics import directory_size_bytes
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_MB = 2048
+DEFAULT_TTL_SECONDS = 300
+
+# フォルダを作ったプロセスを記録するファイル（起動時の回収に使う）
+OWNER_FILE = ".owner"
+
+JOB_PREFIX = "job-"
+
+
+def default_store_dir() -> str:
+    return os.environ.get("RESULT_STORE_DIR") or os.path.join(tempfile.gettempdir(), "scrape_results")
+
+
+class ResultStore:
+    """
+    ジョブごとの結果フォルダの保管
+
+    create() で作ったフォルダは処理中として扱い、finish() で保管（上限・TTLの対象）に移す。
+    1つのインスタンスを複数スレッドから使ってよい。
+    """
+
+    def __init__(self, root: Optional[str] = None, max_bytes: Optional[int] = None,
+                 ttl_seconds: Optional[float] = None,
+                 on_evict: Optional[Callable[[str, int], None]] = None):
+        """
+        Args:
+            root: 保管先（省略時は default_store_dir()）
+            max_bytes: 保管する合計サイズの上限（省略時は環境変数 RESULT_STORE_MAX_MB）
+            ttl_seconds: 保管期限（省略時は環境変数 RESULT_TTL_SECONDS）
+            on_evict: 結果を消したときに (理由, バイト数) で呼ぶ（"quota" / "ttl" / "orphan"）
+        """
+        self.root = root or default_store_dir()
+        if max_bytes is None:
+            max_bytes = int(float(os.environ.get("RESULT_STORE_MAX_MB", DEFAULT_MAX_MB)) * 1024 * 1024)
+        if ttl_seconds is None:
+            ttl_seconds = float(os.environ.get("RESULT_TTL_SECONDS", DEFAULT_TTL_SECONDS))
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.on_evict = on_evict
+        self._active = set()
+        # 保管中の結果: パス -> (サイズ, 保管に移した時刻)。古い順
+        self._stored: "OrderedDict[str, tuple]" = OrderedDict()
+        self._stored_bytes = 0
+        self._cond = threading.Condition()
+        os.makedirs(self.root, exist_ok=True)
+        self.recover_orphans()
+        self._expiry_thread = threading.Thread(target=self._expire_loop, name="result-store-ttl", daemon=True)
+        self._expiry_thread.start()
+
+    def create(self) -> str:
+        """ジョブのフォルダを作る（finish() / discard() まで消さない）"""
+        path = os.path.join(self.root, JOB_PREFIX + uuid.uuid4().hex[:12])
+        os.makedirs(path)
+        with open(os.path.join(path, OWNER_FILE), "w", encoding="utf-8") as f:
+            json.dump({"pid": os.getpid(), "host": socket.gethostname(), "created_at": time.time()}, f)
+        with self._cond:
+            self._active.add(path)
+        return path
+
+    def finish(self, path: str) -> None:
+        """
+        処理が終わった結果を保管に移す
+
+        上限を超える場合は、ほかの結果を古い順に即座に消す（この結果は送信中なので残す）。
+        """
+        size = directory_size_bytes([path])
+        with self._cond:
+            self._active.discard(path)
+            self._stored[path] = (size, time.time())
+            self._stored_bytes += size
+            self._enforce_quota(keep=path)
+            self._cond.notify()
+
+    def discard(self, path: str) -> None:
+        """失敗したジョブのフォルダをすぐに消す"""
+        with self._cond:
+            self._active.discard(path)
+            entry = self._stored.pop(path, None)
+            if entry:
+                self._stored_bytes -= entry[0]
+        shutil.rmtree(path, ignore_errors=True)
+
+    def bytes_held(self) -> int:
+        """処理中・保管中のフォルダの合計サイズ（/metrics 取得時に計算）"""
+        with self._cond:
+            active = list(self._active)
+            stored = self._stored_bytes
+        return stored + directory_size_bytes(active)
+
+    def stats(self) -> Dict[str, int]:
+        with self._cond:
+            return {"active": len(self._active), "stored": len(self._stored), "stored_bytes": self._stored_bytes}
+
+    def _remove(self, path: str, reason: str) -> int:
+        """保管中の結果を消し、実際に消せたバイト数を返す"""
+        size, _stored_at = self._stored.pop(path)
+        shutil.rmtree(path, ignore_errors=True)
+        remaining = directory_size_bytes([path]) if os.path.exists(path) else 0
+        removed = max(0, size - remaining)
+        self._stored_bytes -= size
+        if remaining:
+            # 消せなかった分は保管に戻し、次の期限に消し直す
+            self._stored[path] = (remaining, time.time())
+            self._stored_bytes += remaining
+            logger.debug("Could not fully remove %s (%d bytes left)", path, remaining)
+        logger.debug("Evicted %s (%s, %d bytes)", path, reason, removed)
+        if self.on_evict and removed:
+            self.on_evict(reason, removed)
+        return removed
+
+    def _enforce_quota(self, keep: Optional[str] = None) -> None:
+        # 処理中のジョブの分も含めて上限に収める（処理中のフォルダ自体は消さない）
+        over = self._stored_bytes + directory_size_bytes(list(self._active)) - self.max_bytes
+        for path in list(self._stored):
+            if over <= 0:
+                break
+            if path == keep:
+                continue
+            over -= self._remove(path, "quota")
+
+    def _expire_loop(self) -> None:
+        """次に期限が来る結果の時刻まで待って消す（定期的なポーリングはしない）"""
+        with self._cond:
+            while True:
+                now = time.time()
+                for path, (_size, stored_at) in list(self._stored.items()):
+                    if stored_at + self.ttl_seconds > now:
+                        break
+                    self._remove(path, "ttl")
+                if self._stored:
+                    _size, stored_at = next(iter(self._stored.values()))
+                    self._cond.wait(timeout=max(0.0, stored_at + self.ttl_seconds - now))
+                else:
+                    self._cond.wait()
+
+    def recover_orphans(self) -> int:
+        """作ったプロセスが終了したフォルダ（前回の起動の残り）を消し、消した数を返す"""
+        removed = 0
+        host = socket.gethostname()
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if not name.startswith(JOB_PREFIX) or not os.path.isdir(path) or path in self._active:
+                continue
+            try:
+                with open(os.path.join(path, OWNER_FILE), "r", encoding="utf-8") as f:
+                    owner = json.load(f)
+            except (OSError, ValueError):
+                owner = {}
+            if owner.get("host") == host and owner.get("pid"):
+                # このホストのプロセスが作ったもの: プロセスが終了していれば残り
+                if owner["pid"] == os.getpid() or pid_alive(int(owner["pid"])):
+                    continue
+            elif time.time() - os.path.getmtime(path) < LOCK_STALE_SECONDS:
+                # 別のホスト（共有ディスク）・作成元が分からないもの: 十分に古い場合だけ
+                continue
+            size = directory_size_bytes([path])
+            shutil.rmtree(path, ignore_errors=True)
+            removed += 1
+            if self.on_evict:
+                self.on_evict("orphan", size)
+        if removed:
+            logger.info("Removed %d orphaned result folder(s) from %s", removed, self.root)
+        return removed
@@ -0,0 +1,113 @@
+# coding: utf-8
+"""
+ログ出力の設定
+
+スクレイパー本体・抽出器・Webアプリ版（app.py）は標準の logging を使い、
+出力先と書式はここで一括して設定する。
+
+- レベルは環境変数 LOG_LEVEL（既定: INFO）。DEBUG ログは無効時に整形もされない。
+- LOG_FORMAT=json で1行1レコードのJSON（url / stage / job フィールド付き）を出力する。
+- 処理中のURL・段階・ジョブIDは contextvars で保持し、各レコードに付与する。
+  スレッドごとに独立するため、Webアプリ版で複数ジョブが並行しても混ざらない。
+"""
+import contextvars
+import json
+import logging
+import os
+import sys
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Optional
+
+_current_url: contextvars.ContextVar = contextvars.ContextVar("log_url", default=None)
+_current_stage: contextvars.ContextVar = contextvars.ContextVar("log_stage", default=None)
+_current_job: contextvars.ContextVar = contextvars.ContextVar("log_job", default=None)
+
+TEXT_FORMAT = "%(asctime)s [%(levelname)s] %(message)s"
+TEXT_DATE_FORMAT = "%H:%M:%S"
+
+_configured = False
+
+
+class ContextFilter(logging.Filter):
+    """レコードに現在の url / stage / job を付与する"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.url = _current_url.get()
+        record.stage = _current_stage.get()
+        record.job = _current_job.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """1レコード1行のJSON"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "time": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key in ("job", "url", "stage"):
+            value = getattr(record, key, None)
+            if value is not None:
+                payload[key] = value
+        if record.exc_info:
+            payload["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False)
+
+
+def configure_logging(level: Optional[str] = None, fmt: Optional[str] = None, stream=None) -> None:
+    """
+    ルートロガーにハンドラを設定（複数回呼ばれても1回だけ）
+
+    Args:
+        level: ログレベル（未指定時は環境変数 LOG_LEVEL、既定 INFO）
+        fmt: "text" または "json"（未指定時は環境変数 LOG_FORMAT、既定 text）
+        stream: 出力先（既定: 標準エラー出力）
+    """
+    global _configured
+    if _configured:
+        return
+    level = (level or os.environ.get("LOG_LEVEL") or "INFO").upper()
+    fmt = (fmt or os.environ.get("LOG_FORMAT") or "text").lower()
+
+    handler = logging.StreamHandler(stream or sys.stderr)
+    handler.addFilter(ContextFilter())
+    if fmt == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter(TEXT_FORMAT, TEXT_DATE_FORMAT))
+
+    root = logging.getLogger()
+    root.addHandler(handler)
+    root.setLevel(getattr(logging, level, logging.INFO))
+    # 画像ダウンロードのたびに出る接続ログは抑制
+    logging.getLogger("urllib3").setLevel(logging.WARNING)
+    _configured = True
+
+
+@contextmanager
+def log_context(url: Optional[str] = None, job: Optional[str] = None):
+    """with log_context(url=url): ... の間のログに url / job を付与"""
+    tokens = []
+    if url is not None:
+        tokens.append((_current_url, _current_url.set(url)))
+    if job is not None:
+        tokens.append((_current_job, _current_job.set(job)))
+    try:
+        yield
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
+
+
+@contextmanager
+def log_stage(name: str):
+    """with log_stage("parse"): ... の間のログに stage を付与"""
+    token = _current_stage.set(name)
+    try:
+        yield
+    finally:
+        _current_stage.reset(token)
@@ -0,0 +1,181 @@
+# coding: utf-8
+"""
+URLごとの処理メトリクス
+
+各段階（ページ読み込み、スクロール、解析、ダウンロードなど）の所要時間、
+ダウンロードバイト数、画像数、選択されたパターンなどを1URL1レコードで記録し、
+バッチ全体のパーセンタイルと合わせてJSONログに書き出す。
+"""
+import json
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+from urllib.parse import urlparse
+
+from memory_usage import RssTracker
+from scrape_logging import log_stage
+
+# 記録する段階（出力順）
+STAGES = (
+    "goto",       # page.goto
+    "scroll",     # Lazy Load 用のスクロール
+    "twitter",    # Twitter/X 埋め込みのキャプチャ
+    "content",    # page.content()
+    "parse",      # BeautifulSoup による解析
+    "detect",     # パターン判定
+    "extract",    # 投稿抽出
+    "download",   # 画像のダウンロード（通信）
+    "write",      # 画像・posts.txt 等の書き込み
+)
+
+# バッチ集計で出力するパーセンタイル
+PERCENTILES = (50, 90, 99)
+
+
+class UrlMetrics:
+    """1URL分のメトリクス"""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.started_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.stage_seconds: Dict[str, float] = {}
+        self.status: Optional[str] = None     # "ok", "no_posts", "error"
+        self.error: Optional[str] = None
+        self.folder: Optional[str] = None
+        self.pattern: Optional[str] = None
+        self.scroll: Optional[str] = None     # page_scroll.scroll_for_lazy_images の結果
+        self.content_source: Optional[str] = None  # 解析したHTML（"page": ページ全体、"thread": ブラウザ内で切り出し）
+        self.html_bytes = 0                   # 解析したHTMLの文字数（複数ページのスレッドは合計）
+        self.pages = 1                        # 取得したページ数（複数ページに分かれたスレッド）
+        self.fetched_url: Optional[str] = None  # 軽い表示（スマホ版など）を取得した場合のURL
+        self.posts = 0
+        self.images_found = 0
+        self.images_downloaded = 0
+        self.images_failed = 0
+        self.bytes_downloaded = 0
+        self.bytes_by_host: Dict[str, int] = {}
+        self.download_retries = 0             # ローカル画像失敗後のimgurフォールバック回数
+        self.pattern_fallbacks = 0            # 抽出パターンのフォールバック回数
+        self.profiled = False                 # profiling.profile_url で計測中か
+        self.rss = RssTracker()
+
+    @contextmanager
+    def stage(self, name: str):
+        """with metrics.stage("parse"): ... で所要時間を加算（間のログには stage が付く）"""
+        start = time.perf_counter()
+        try:
+            with log_stage(name):
+                yield
+        finally:
+            self.add_stage_seconds(name, time.perf_counter() - start)
+
+    def add_stage_seconds(self, name: str, seconds: float) -> None:
+        """別の場所（子プロセスなど）で計測した所要時間を加算"""
+        self.stage_seconds[name] = self.stage_seconds.get(name, 0.0) + seconds
+
+    def add_download(self, nbytes: int, url: str = "") -> None:
+        self.images_downloaded += 1
+        self.bytes_downloaded += nbytes
+        host = (urlparse(url).hostname or "") if url else ""
+        self.bytes_by_host[host] = self.bytes_by_host.get(host, 0) + nbytes
+
+    def finish(self, status: str, error: Optional[str] = None) -> None:
+        self.status = status
+        self.error = error
+        self.finished_at = time.time()
+
+    @property
+    def total_seconds(self) -> float:
+        end = self.finished_at if self.finished_at is not None else time.time()
+        return end - self.started_at
+
+    def to_dict(self) -> Dict:
+        return {
+            "url": self.url,
+            "status": self.status,
+            "error": self.error,
+            "folder": self.folder,
+            "pattern": self.pattern,
+            "scroll": self.scroll,
+            "content_source": self.content_source,
+            "html_bytes": self.html_bytes,
+            "pages": self.pages,
+            "fetched_url": self.fetched_url,
+            "started_at": datetime.fromtimestamp(self.started_at).isoformat(timespec="seconds"),
+            "total_seconds": round(self.total_seconds, 3),
+            "stages": {name: round(self.stage_seconds[name], 3) for name in STAGES if name in self.stage_seconds},
+            "posts": self.posts,
+            "images_found": self.images_found,
+            "images_downloaded": self.images_downloaded,
+            "images_failed": self.images_failed,
+            "bytes_downloaded": self.bytes_downloaded,
+            "bytes_by_host": dict(self.bytes_by_host),
+            "download_retries": self.download_retries,
+            "pattern_fallbacks": self.pattern_fallbacks,
+            "peak_rss_bytes": self.rss.peak,
+            "rss_bytes": dict(self.rss.samples),
+        }
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    """線形補間によるパーセンタイル（values が空なら None）"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * p / 100
+    lower = int(k)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (k - lower)
+
+
+def _distribution(values: List[float]) -> Dict[str, Optional[float]]:
+    result = {f"p{p}": percentile(values, p) for p in PERCENTILES}
+    result["max"] = max(values) if values else None
+    return {key: round(value, 3) if value is not None else None for key, value in result.items()}
+
+
+def summarize_batch(records: Iterable[Dict]) -> Dict:
+    """UrlMetrics.to_dict() のリストからバッチ全体の集計を作成"""
+    records = list(records)
+    status_counts: Dict[str, int] = {}
+    pattern_counts: Dict[str, int] = {}
+    scroll_counts: Dict[str, int] = {}
+    for record in records:
+        status = record.get("status") or "unknown"
+        status_counts[status] = status_counts.get(status, 0) + 1
+        if record.get("pattern"):
+            pattern_counts[record["pattern"]] = pattern_counts.get(record["pattern"], 0) + 1
+        if record.get("scroll"):
+            scroll_counts[record["scroll"]] = scroll_counts.get(record["scroll"], 0) + 1
+
+    stages = {}
+    for name in STAGES:
+        values = [r["stages"][name] for r in records if name in r.get("stages", {})]
+        if values:
+            stages[name] = _distribution(values)
+
+    return {
+        "urls": len(records),
+        "status": status_counts,
+        "patterns": pattern_counts,
+        "scroll": scroll_counts,
+        "total_seconds": _distribution([r["total_seconds"] for r in records]),
+        "stages": stages,
+        "bytes_downloaded": sum(r.get("bytes_downloaded", 0) for r in records),
+        "images_downloaded": sum(r.get("images_downloaded", 0) for r in records),
+        "peak_rss_bytes": max((r["peak_rss_bytes"] for r in records if r.get("peak_rss_bytes")), default=None),
+    }
+
+
+def write_metrics_log(path: str, metrics_list: Iterable[UrlMetrics]) -> None:
+    """メトリクスをJSONログとして書き出す（URLごとのレコードとバッチ集計）"""
+    records = [m.to_dict() for m in metrics_list]
+    payload = {
+        "generated_at": datetime.now().isoformat(timespec="seconds"),
+        "summary": summarize_batch(records),
+        "urls": records,
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,150 @@
+# coding: utf-8
+"""admission.py の受け付け制御・スケジューリング"""
+import threading
+import time
+import unittest
+
+from admission import AdmissionController, AdmissionRejected
+
+
+def _controller(**kwargs) -> AdmissionController:
+    options = dict(max_concurrent=2, max_queue=10, max_client_urls=100, queue_timeout=5,
+                   small_job_urls=1, interactive_max_urls=20, interactive_slots=0, batch_quantum=0)
+    options.update(kwargs)
+    return AdmissionController(**options)
+
+
+def _wait_until(predicate, timeout: float = 5) -> None:
+    deadline = time.time() + timeout
+    while not predicate():
+        if time.time() > deadline:
+            raise AssertionError("timed out")
+        time.sleep(0.01)
+
+
+class ClientAccountingTest(unittest.TestCase):
+    def test_release_after_checkpoints_of_two_jobs_from_same_client(self):
+        admission = _controller(max_concurrent=4)
+        a = admission.acquire("c", 1)
+        b = admission.acquire("c", 1)
+        admission.checkpoint(a)
+        admission.checkpoint(b)
+        admission.release(b)
+        admission.release(a)
+        self.assertEqual(admission._client_urls, {})
+        self.assertEqual(admission._client_served, {})
+        self.assertEqual(admission.active_count(), 0)
+
+    def test_client_limit_counts_remaining_urls(self):
+        admission = _controller(max_concurrent=4, max_client_urls=5)
+        a = admission.acquire("c", 3)
+        with self.assertRaises(AdmissionRejected) as cm:
+            admission.acquire("c", 3)
+        self.assertEqual(cm.exception.reason, "client_limit")
+        admission.checkpoint(a)
+        b = admission.acquire("c", 3)
+        admission.release(a)
+        admission.release(b)
+        self.assertEqual(admission._client_urls, {})
+
+    def test_queue_full_is_rejected(self):
+        admission = _controller(max_concurrent=1, max_queue=0)
+        a = admission.acquire("a", 1)
+        with self.assertRaises(AdmissionRejected) as cm:
+            admission.acquire("b", 1)
+        self.assertEqual(cm.exception.reason, "queue_full")
+        self.assertGreaterEqual(cm.exception.retry_after, 1)
+        admission.release(a)
+
+    def test_queue_timeout_is_rejected(self):
+        admission = _controller(max_concurrent=1, queue_timeout=0.1)
+        a = admission.acquire("a", 1)
+        with self.assertRaises(AdmissionRejected) as cm:
+            admission.acquire("b", 1)
+        self.assertEqual(cm.exception.reason, "timeout")
+        self.assertEqual(admission.queue_depth(), 0)
+        admission.release(a)
+        self.assertEqual(admission._client_urls, {})
+
+
+class PriorityTest(unittest.TestCase):
+    def test_ui_priority_is_limited_to_one_job_per_client(self):
+        admission = _controller(max_concurrent=4)
+        first = admission.acquire("ui", 10, interactive=True)
+        second = admission.acquire("ui", 10, interactive=True)
+        other = admission.acquire("other", 10, interactive=True)
+        self.assertEqual((first.priority, second.priority, other.priority), ("interactive", "batch", "interactive"))
+        # 小さなジョブは数に関係なく interactive
+        self.assertEqual(admission.acquire("ui", 1).priority, "interactive")
+        admission.release(first)
+        self.assertEqual(admission.acquire("ui", 10, interactive=True).priority, "interactive")
+
+    def test_large_ui_job_is_batch(self):
+        admission = _controller(max_concurrent=4)
+        self.assertEqual(admission.acquire("ui", 21, interactive=True).priority, "batch")
+        self.assertEqual(admission.acquire("ui", 20, interactive=True).priority, "interactive")
+
+
+class YieldTest(unittest.TestCase):
+    def _start(self, admission, client, url_count, started, interactive=False):
+        def run():
+            ticket = admission.acquire(client, url_count, interactive=interactive)
+            started.append(client)
+            admission.release(ticket)
+        thread = threading.Thread(target=run)
+        thread.start()
+        return thread
+
+    def test_batch_yields_to_interactive_and_resumes(self):
+        admission = _controller(max_concurrent=1)
+        batch = admission.acquire("bulk", 5)
+        self.assertEqual(batch.priority, "batch")
+        started = []
+        thread = self._start(admission, "ui", 2, started, interactive=True)
+        _wait_until(lambda: admission.queue_depth() == 1)
+
+        self.assertTrue(admission.checkpoint(batch))
+        resumed = threading.Thread(target=admission.requeue, args=(batch,))
+        resumed.start()
+        thread.join(5)
+        resumed.join(5)
+        self.assertEqual(started, ["ui"])
+        self.assertEqual(batch.yields, 1)
+        self.assertIn(batch, admission._active)
+
+        # 残りのURLを処理して終える
+        for _ in range(4):
+            self.assertFalse(admission.checkpoint(batch))
+        admission.release(batch)
+        self.assertEqual(admission._client_urls, {})
+        self.assertEqual(admission.active_count(), 0)
+
+    def test_batch_does_not_yield_to_same_client_or_when_a_slot_is_free(self):
+        admission = _controller(max_concurrent=2)
+        batch = admission.acquire("bulk", 5)
+        started = []
+        thread = self._start(admission, "bulk", 5, started)
+        thread.join(5)
+        self.assertEqual(started, ["bulk"])
+        self.assertFalse(admission.checkpoint(batch))
+        admission.release(batch)
+
+    def test_batches_from_two_clients_take_turns(self):
+        admission = _controller(max_concurrent=1, batch_quantum=0)
+        first = admission.acquire("a", 5)
+        started = []
+        thread = self._start(admission, "b", 5, started)
+        _wait_until(lambda: admission.queue_depth() == 1)
+        # "a" は処理済みのURLが多いので "b" に譲る
+        self.assertTrue(admission.checkpoint(first))
+        resumed = threading.Thread(target=admission.requeue, args=(first,))
+        resumed.start()
+        thread.join(5)
+        resumed.join(5)
+        self.assertEqual(started, ["b"])
+        admission.release(first)
+        self.assertEqual(admission._client_urls, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,137 @@
+# coding: utf-8
+"""browser_contexts.HostContextPool のコンテキストの入れ替え"""
+import importlib
+import os
+import tempfile
+import unittest
+
+from browser_contexts import HostContextPool
+from scrape_metrics import UrlMetrics
+
+
+class _Page:
+    def __init__(self, context):
+        self.context = context
+        self.closed = False
+
+    def is_closed(self):
+        return self.closed or self.context.closed
+
+    def close(self):
+        self.closed = True
+
+    def goto(self, url, **kwargs):
+        raise TimeoutError("navigation timed out")
+
+
+class _Context:
+    def __init__(self):
+        self.closed = False
+
+    def new_page(self):
+        return _Page(self)
+
+    def close(self):
+        self.closed = True
+
+
+class _Browser:
+    def __init__(self):
+        self.contexts = []
+
+    def new_context(self):
+        context = _Context()
+        self.contexts.append(context)
+        return context
+
+    def close(self):
+        pass
+
+
+class _BrowserType:
+    def __init__(self):
+        self.browser = _Browser()
+
+    def launch(self, **kwargs):
+        return self.browser
+
+
+class _PersistentBrowserType(_BrowserType):
+    def __init__(self):
+        super().__init__()
+        self.persistent = []
+
+    def launch_persistent_context(self, user_data_dir, **kwargs):
+        os.makedirs(user_data_dir, exist_ok=True)
+        context = _Context()
+        self.persistent.append((user_data_dir, context))
+        return context
+
+
+class ProfileTest(unittest.TestCase):
+    def test_hosts_share_one_persistent_context(self):
+        browser_type = _PersistentBrowserType()
+        with tempfile.TemporaryDirectory() as profile_dir:
+            pool = HostContextPool(browser_type, profile_dir=profile_dir, max_pages=3)
+            pages = [pool.new_page(url) for url in ("https://a.example/1", "https://b.example/1",
+                                                    "https://www.c.example/1")]
+            self.assertEqual([path for path, _ in browser_type.persistent],
+                             [os.path.join(profile_dir, "shared")])
+            self.assertEqual(browser_type.browser.contexts, [])
+            # ページ数の上限で入れ替えても、起動し直すのは1つだけ
+            for page in pages:
+                page.close()
+            pool.new_page("https://d.example/1")
+            self.assertEqual(len(browser_type.persistent), 2)
+            self.assertTrue(browser_type.persistent[0][1].closed)
+            pool.close()
+            self.assertTrue(browser_type.persistent[1][1].closed)
+
+
+class RecycleTest(unittest.TestCase):
+    def test_recycling_keeps_pages_of_the_same_wave_open(self):
+        browser_type = _BrowserType()
+        pool = HostContextPool(browser_type, max_pages=2)
+        wave = [pool.new_page("https://ex.com/a?p=%d" % n) for n in range(2, 6)]
+        # 3ページ目で入れ替わっても、先に開いたページは閉じない
+        self.assertEqual(len(browser_type.browser.contexts), 2)
+        self.assertFalse(any(page.is_closed() for page in wave))
+
+        for page in wave:
+            page.close()
+        pool.new_page("https://ex.com/a?p=6")
+        first, second, third = browser_type.browser.contexts
+        self.assertTrue(first.closed)
+        self.assertFalse(third.closed)
+        pool.close()
+        self.assertTrue(all(context.closed for context in browser_type.browser.contexts))
+
+    def test_lru_eviction_waits_for_open_pages(self):
+        browser_type = _BrowserType()
+        pool = HostContextPool(browser_type, max_contexts=1)
+        page = pool.new_page("https://a.example/1")
+        pool.new_page("https://b.example/1")
+        self.assertFalse(page.is_closed())
+        page.close()
+        pool.new_page("https://b.example/2")
+        self.assertTrue(browser_type.browser.contexts[0].closed)
+        pool.close()
+
+
+class FetchThreadPagesTest(unittest.TestCase):
+    def test_pages_that_fail_to_load_are_closed(self):
+        scraper = importlib.import_module("画像一括取得")
+        browser_type = _BrowserType()
+        pool = HostContextPool(browser_type, max_pages=2)
+        url = "https://ex.com/a"
+        follow_ups = scraper.fetch_thread_pages(pool, url, [url + "?p=2", url + "?p=3"], UrlMetrics(url),
+                                                max_pages=10, scroll_mode="never", dom_extract=False)
+        self.assertEqual(follow_ups, [])
+        # 開いたままのページが残らないため、使い終わったコンテキストを閉じられる
+        pool.new_page(url + "?p=4")
+        self.assertTrue(browser_type.browser.contexts[0].closed)
+        pool.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+# coding: utf-8
+"""image_validation.py の形式判定と途中で切れたファイルの検出"""
+import io
+import struct
+import unittest
+import zlib
+
+from image_validation import InvalidImageError, is_truncated, pillow_available, validate_image
+
+
+def _png() -> bytes:
+    def chunk(kind: bytes, payload: bytes) -> bytes:
+        return struct.pack(">I", len(payload)) + kind + payload + struct.pack(">I", zlib.crc32(kind + payload))
+    header = struct.pack(">IIBBBBB", 1, 1, 8, 0, 0, 0, 0)
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(b"\x00\x00"))
+            + chunk(b"IEND", b""))
+
+
+def _gif() -> bytes:
+    # ヘッダー・画面記述子（グローバルカラーテーブル2色）・画像・トレーラー
+    return (b"GIF89a" + struct.pack("<HHBBB", 1, 1, 0x80, 0, 0) + b"\x00\x00\x00\xff\xff\xff"
+            + b"\x21\xf9\x04\x00\x00\x00\x00\x00"
+            + b"\x2c" + struct.pack("<HHHHB", 0, 0, 1, 1, 0) + b"\x02\x02\x4c\x01\x00" + b";")
+
+
+def _jpeg() -> bytes:
+    # EXIF（APP1）の中に EOI を含むサムネイル、圧縮データの中に 0xFF00 と RST を含む
+    thumbnail = b"\xff\xd8\xff\xd9"
+    app1 = b"Exif\x00\x00" + thumbnail
+    sos = b"\x01\x01\x00\x00\x3f\x00"
+    return (b"\xff\xd8" + b"\xff\xe1" + struct.pack(">H", len(app1) + 2) + app1
+            + b"\xff\xda" + struct.pack(">H", len(sos) + 2) + sos
+            + b"\x12\xff\x00\x34\xff\xd0\x56" + b"\xff\xd9")
+
+
+class ValidateImageTest(unittest.TestCase):
+    def test_valid_images(self):
+        self.assertEqual(validate_image(_jpeg()), ".jpg")
+        self.assertEqual(validate_image(_png()), ".png")
+        self.assertEqual(validate_image(_gif()), ".gif")
+
+    def test_truncated_images_are_rejected(self):
+        for data in (_jpeg()[:-2], _png()[:-12], _gif()[:-1]):
+            with self.assertRaises(InvalidImageError):
+                validate_image(data)
+        # サムネイルの EOI だけでは完全なファイルとみなさない
+        self.assertTrue(is_truncated(_jpeg()[:30], ".jpg"))
+
+    def test_trailing_data_is_allowed(self):
+        trailer = b"\x00" * 10 + b"trailer" * 300
+        self.assertEqual(validate_image(_jpeg() + trailer), ".jpg")
+        self.assertEqual(validate_image(_png() + trailer), ".png")
+        self.assertEqual(validate_image(_gif() + trailer), ".gif")
+
+    def test_html_is_rejected(self):
+        with self.assertRaises(InvalidImageError):
+            validate_image(b"<!DOCTYPE html><html><body>404</body></html>")
+        with self.assertRaises(InvalidImageError):
+            validate_image(b"")
+
+    def test_other_formats_are_kept(self):
+        avif = b"\x00\x00\x00\x1cftypavif" + b"\x00" * 20
+        self.assertEqual(validate_image(avif), ".avif")
+        self.assertEqual(validate_image(b"\x00\x00\x01\x00\x01\x00" + b"\x00" * 20), ".ico")
+        svg = b'<?xml version="1.0"?>\n<svg xmlns="http://www.w3.org/2000/svg"></svg>'
+        self.assertEqual(validate_image(svg), ".svg")
+        # 判定できない形式は検証せずに通し、拡張子はURLから決める
+        self.assertEqual(validate_image(b"\x00\x01unknown", "https://ex.com/a/photo.HEIC?x=1"), ".heic")
+        self.assertEqual(validate_image(b"\x00\x01unknown", "https://ex.com/image"), ".jpg")
+
+    @unittest.skipUnless(pillow_available(), "Pillow is not installed")
+    def test_images_saved_by_pillow(self):
+        from PIL import Image
+        for fmt, ext in (("JPEG", ".jpg"), ("PNG", ".png"), ("GIF", ".gif"), ("BMP", ".bmp"), ("WEBP", ".webp")):
+            buf = io.BytesIO()
+            Image.new("RGB", (64, 48), (200, 30, 30)).save(buf, fmt)
+            data = buf.getvalue()
+            self.assertEqual(validate_image(data), ext)
+            self.assertEqual(validate_image(data + b"\x00" * 2048), ext)
+            with self.assertRaises(InvalidImageError):
+                validate_image(data[:len(data) // 2])
+
+
+if __name__ == "__main__":
+    unittest.main()
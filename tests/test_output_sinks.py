@@ -0,0 +1,110 @@
+# coding: utf-8
+"""output_sinks.py の各出力先への書き込みと読み出し"""
+import os
+import sqlite3
+import tarfile
+import tempfile
+import unittest
+import zipfile
+
+from output_sinks import ZipBundleSink, create_sink
+
+KEY = "テスト_スレ_1a2b3c4d"
+IMAGE = b"\x89PNG\r\n\x1a\n" + bytes(range(256)) * 4
+LINES = [f"{i}: 名無しさん ID:abc{i}\n本文{i}\n\n" for i in range(1, 2001)]
+
+
+def _write_thread(output) -> None:
+    """画像と逐次書きのテキストを交互に書き込む（posts.txt・posts.jsonl を開いたまま画像を追加する）"""
+    text = output.open_text("posts.txt")
+    jsonl = output.open_text("posts.jsonl")
+    for i, line in enumerate(LINES):
+        text.write(line)
+        jsonl.write(f'{{"index": {i}}}\n')
+        jsonl.flush()
+        if i % 500 == 0:
+            output.write_bytes(f"images/画像{i // 500 + 1}.png", IMAGE)
+    text.close()
+    jsonl.close()
+    text.close()  # 2回閉じても書き込みは1回
+
+
+class SinkRoundTripTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.root = self.dir.name
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def _expected(self):
+        files = {f"images/画像{n}.png": IMAGE for n in range(1, 5)}
+        files["posts.txt"] = "".join(LINES).encode("utf-8")
+        files["posts.jsonl"] = "".join(f'{{"index": {i}}}\n' for i in range(len(LINES))).encode("utf-8")
+        return files
+
+    def _run(self, sink_type: str):
+        sink = create_sink(sink_type, self.root)
+        with sink.open_thread(KEY, "https://ex.com/1", "テスト スレ") as output:
+            _write_thread(output)
+        sink.close()
+
+    def test_dir(self):
+        self._run("dir")
+        folder = os.path.join(self.root, KEY)
+        for rel_path, data in self._expected().items():
+            with open(os.path.join(folder, *rel_path.split("/")), "rb") as f:
+                self.assertEqual(f.read(), data, rel_path)
+
+    def test_zip(self):
+        self._run("zip")
+        with zipfile.ZipFile(os.path.join(self.root, f"{KEY}.zip")) as zf:
+            self.assertIsNone(zf.testzip())
+            for rel_path, data in self._expected().items():
+                self.assertEqual(zf.read(f"{KEY}/{rel_path}"), data, rel_path)
+        self.assertFalse(os.path.exists(os.path.join(self.root, f"{KEY}.zip.part")))
+
+    def test_tar(self):
+        self._run("tar")
+        with tarfile.open(os.path.join(self.root, f"{KEY}.tar")) as tf:
+            for rel_path, data in self._expected().items():
+                self.assertEqual(tf.extractfile(f"{KEY}/{rel_path}").read(), data, rel_path)
+
+    def test_sqlite(self):
+        self._run("sqlite")
+        conn = sqlite3.connect(os.path.join(self.root, "results.sqlite3"))
+        try:
+            rows = conn.execute("SELECT f.path, f.size, f.data FROM files f JOIN threads t ON t.id = f.thread_id"
+                                " WHERE t.key = ? AND t.state = 'done'", (KEY,)).fetchall()
+        finally:
+            conn.close()
+        files = {path: bytes(data) for path, size, data in rows}
+        self.assertEqual(files, self._expected())
+        self.assertTrue(all(size == len(data) for _, size, data in rows))
+
+    def test_zip_bundle(self):
+        zip_path = os.path.join(self.root, "result.zip")
+        summary = os.path.join(self.root, "_result_summary.txt")
+        with open(summary, "w", encoding="utf-8") as f:
+            f.write("成功: 1件\n")
+        sink = ZipBundleSink(zip_path)
+        with sink.open_thread(KEY, "https://ex.com/1", "テスト スレ") as output:
+            _write_thread(output)
+        sink.add_file("_result_summary.txt", summary)
+        sink.close()
+        with zipfile.ZipFile(zip_path) as zf:
+            for rel_path, data in self._expected().items():
+                self.assertEqual(zf.read(f"{KEY}/{rel_path}"), data, rel_path)
+            self.assertEqual(zf.read("_result_summary.txt").decode("utf-8"), "成功: 1件\n")
+
+    def test_failed_archive_thread_leaves_nothing(self):
+        sink = create_sink("zip", self.root)
+        with self.assertRaises(RuntimeError):
+            with sink.open_thread(KEY, "https://ex.com/1", "テスト スレ") as output:
+                output.write_bytes("images/画像1.png", IMAGE)
+                raise RuntimeError("download failed")
+        self.assertEqual(os.listdir(self.root), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
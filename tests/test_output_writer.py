@@ -0,0 +1,70 @@
+# coding: utf-8
+"""output_writer.py の出力フォルダのロック"""
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import output_writer
+from output_writer import OutputFolderBusy, claim_lock, pid_alive
+
+
+def _dead_pid() -> int:
+    """終了済みのプロセスの PID"""
+    proc = subprocess.Popen([sys.executable, "-c", "pass"])
+    proc.wait()
+    return proc.pid
+
+
+class LockTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.lock_path = os.path.join(self.dir.name, ".lock")
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def _write_lock(self, pid: int, host: str = None):
+        with open(self.lock_path, "w", encoding="utf-8") as f:
+            json.dump({"pid": pid, "host": host or socket.gethostname(), "created_at": 0}, f)
+
+    def test_lock_of_exited_process_is_taken_over(self):
+        self._write_lock(_dead_pid())
+        with claim_lock(self.lock_path, self.dir.name):
+            with open(self.lock_path, "r", encoding="utf-8") as f:
+                self.assertEqual(json.load(f)["pid"], os.getpid())
+        self.assertFalse(os.path.exists(self.lock_path))
+
+    def test_lock_of_running_process_is_kept(self):
+        with subprocess.Popen([sys.executable, "-c", "import time; time.sleep(30)"]) as proc:
+            try:
+                self._write_lock(proc.pid)
+                with self.assertRaises(OutputFolderBusy):
+                    with claim_lock(self.lock_path, self.dir.name):
+                        pass
+                # 確認しただけでプロセスを終了させていない
+                self.assertIsNone(proc.poll())
+            finally:
+                proc.kill()
+
+    def test_lock_of_other_host_is_kept(self):
+        self._write_lock(_dead_pid(), host="another-host")
+        with self.assertRaises(OutputFolderBusy):
+            with claim_lock(self.lock_path, self.dir.name):
+                pass
+
+    def test_windows_does_not_use_os_kill(self):
+        with mock.patch.object(output_writer.sys, "platform", "win32"), \
+                mock.patch.object(output_writer, "_win32_pid_alive", return_value=True) as probe, \
+                mock.patch.object(output_writer.os, "kill") as kill:
+            self.assertTrue(pid_alive(1234))
+        probe.assert_called_once_with(1234)
+        kill.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+# coding: utf-8
+"""extractors/pagination.py のページ送りの判定"""
+import unittest
+
+from bs4 import BeautifulSoup
+
+from extractors.pagination import find_page_urls, page_number
+
+ARTICLE = "https://ex.com/archives/123.html"
+
+
+def _soup(body: str) -> BeautifulSoup:
+    return BeautifulSoup(f"<html><body>{body}</body></html>", "html.parser")
+
+
+class PageNumberTest(unittest.TestCase):
+    def test_query_and_path_pages_of_an_article(self):
+        self.assertEqual(page_number(ARTICLE + "?p=2", ARTICLE), 2)
+        self.assertEqual(page_number(ARTICLE + "/3/", ARTICLE), 3)
+        self.assertEqual(page_number(ARTICLE + "/page/4", ARTICLE), 4)
+        self.assertIsNone(page_number("https://ex.com/archives/124.html?p=2", ARTICLE))
+
+    def test_root_url_has_no_path_or_query_pages(self):
+        self.assertIsNone(page_number("https://ex.com/page/2", "https://ex.com/"))
+        self.assertIsNone(page_number("https://ex.com/2", "https://ex.com/"))
+        self.assertIsNone(page_number("https://ex.com/?p=5", "https://ex.com/"))
+
+    def test_wordpress_post_id_is_not_a_page_number(self):
+        base = "https://ex.com/?p=123"
+        self.assertIsNone(page_number("https://ex.com/?p=5", base))
+        self.assertIsNone(page_number("https://ex.com/?p=124", base))
+        self.assertEqual(page_number("https://ex.com/?p=123&page=2", base), 2)
+
+
+class FindPageUrlsTest(unittest.TestCase):
+    def test_links_to_other_wordpress_posts_are_ignored(self):
+        soup = _soup(
+            '<div class="related"><a href="/?p=5">a</a><a href="/?p=120">b</a><a href="/?p=124">c</a></div>'
+            '<div class="pagination"><a href="/?p=5">5</a><a href="/?p=123&amp;page=2">2</a></div>'
+        )
+        self.assertEqual(find_page_urls(soup, "https://ex.com/?p=123"), ["https://ex.com/?p=123&page=2"])
+
+    def test_root_url_finds_no_pages(self):
+        soup = _soup('<div class="pager"><a href="/2">2</a><a href="/page/3">3</a><a href="/?p=4">4</a></div>')
+        self.assertEqual(find_page_urls(soup, "https://ex.com/"), [])
+
+    def test_only_pager_and_rel_links_are_used(self):
+        soup = _soup(
+            '<div class="entry-content"><a href="/archives/123.html/5">本文中のリンク</a></div>'
+            '<nav class="wp-pagenavi"><span><a href="/archives/123.html/2">2</a></span></nav>'
+            '<a rel="next" href="/archives/123.html/3">次へ</a>'
+        )
+        self.assertEqual(find_page_urls(soup, ARTICLE), [ARTICLE + "/2", ARTICLE + "/3"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+# coding: utf-8
+"""result_store.py の上限・回収"""
+import json
+import os
+import socket
+import tempfile
+import unittest
+from unittest import mock
+
+import result_store
+from result_store import OWNER_FILE, ResultStore
+from tests.test_output_writer import _dead_pid
+
+
+def _fill(path: str, size: int) -> None:
+    with open(os.path.join(path, "result.zip"), "wb") as f:
+        f.write(b"\0" * size)
+
+
+class ResultStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.evicted = []
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def _store(self, max_bytes: int = 10_000) -> ResultStore:
+        return ResultStore(self.dir.name, max_bytes=max_bytes, ttl_seconds=3600,
+                           on_evict=lambda reason, size: self.evicted.append((reason, size)))
+
+    def _finished(self, store: ResultStore, size: int) -> str:
+        path = store.create()
+        _fill(path, size)
+        store.finish(path)
+        return path
+
+    def test_quota_removes_oldest_results(self):
+        store = self._store(max_bytes=2500)
+        first = self._finished(store, 1000)
+        second = self._finished(store, 1000)
+        third = self._finished(store, 1000)
+        self.assertFalse(os.path.exists(first))
+        self.assertTrue(os.path.exists(second))
+        self.assertTrue(os.path.exists(third))
+        self.assertEqual([reason for reason, _ in self.evicted], ["quota"])
+
+    def test_files_that_could_not_be_removed_stay_counted(self):
+        store = self._store(max_bytes=1500)
+        first = self._finished(store, 1000)
+        # 送信中で消せない（Windows で開いているファイル）
+        with mock.patch.object(result_store.shutil, "rmtree"):
+            self._finished(store, 1000)
+        self.assertTrue(os.path.exists(first))
+        self.assertEqual(self.evicted, [])
+        self.assertGreaterEqual(store.stats()["stored_bytes"], 2000)
+        self.assertEqual(store.stats()["stored"], 2)
+
+    def test_recover_orphans_keeps_folders_of_running_processes(self):
+        def folder(name: str, pid: int) -> str:
+            path = os.path.join(self.dir.name, result_store.JOB_PREFIX + name)
+            os.makedirs(path)
+            with open(os.path.join(path, OWNER_FILE), "w", encoding="utf-8") as f:
+                json.dump({"pid": pid, "host": socket.gethostname(), "created_at": 0}, f)
+            return path
+
+        dead = folder("dead", _dead_pid())
+        alive = folder("alive", os.getppid())
+        self._store()
+        self.assertFalse(os.path.exists(dead))
+        self.assertTrue(os.path.exists(alive))
+        self.assertEqual([reason for reason, _ in self.evicted], ["orphan"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+# coding: utf-8
+"""twitter_capture.py のキャッシュ"""
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+import twitter_capture
+from twitter_capture import capture_twitter_embeds, prune_cache
+
+SRC = "https://platform.twitter.com/embed/Tweet.html?id={}"
+
+
+class _Frame:
+    def __init__(self, loads: bool):
+        self.loads = loads
+
+    def wait_for_load_state(self, state, timeout):
+        if not self.loads:
+            raise TimeoutError("load timed out")
+
+
+class _Iframe:
+    def __init__(self, loads: bool):
+        self.frame = _Frame(loads)
+
+    def content_frame(self):
+        return self.frame
+
+
+class _Page:
+    """埋め込み iframe が並んだページ（loads[i] が False の iframe は load がタイムアウトする）"""
+
+    def __init__(self, tweet_ids, loads):
+        self.rects = [{"index": i, "src": SRC.format(tweet_id), "tweetId": "", "x": 0, "y": i * 100,
+                       "width": 100, "height": 100} for i, tweet_id in enumerate(tweet_ids)]
+        self.iframes = [_Iframe(ok) for ok in loads]
+
+    def evaluate(self, script, markers):
+        return self.rects
+
+    def query_selector_all(self, selector):
+        return self.iframes
+
+    def wait_for_timeout(self, ms):
+        pass
+
+    def screenshot(self, **kwargs):
+        return f"png@{kwargs['clip']['y']}".encode()
+
+
+class CaptureCacheTest(unittest.TestCase):
+    def test_only_loaded_frames_are_cached(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            captures = capture_twitter_embeds(_Page(["111", "222"], [True, False]), cache_dir)
+            self.assertEqual(len(captures), 2)
+            self.assertEqual(sorted(os.listdir(cache_dir)), ["111.png"])
+
+    def test_concurrent_stores_of_the_same_tweet(self):
+        payloads = [bytes([n]) * 200_000 for n in range(8)]
+        with tempfile.TemporaryDirectory() as cache_dir:
+            threads = [threading.Thread(target=twitter_capture.store_cached_capture, args=(cache_dir, "333", data))
+                       for data in payloads]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(os.listdir(cache_dir), ["333.png"])
+            self.assertIn(twitter_capture.load_cached_capture(cache_dir, "333"), payloads)
+
+
+class PruneCacheTest(unittest.TestCase):
+    def _write(self, cache_dir, name, size, age_days):
+        path = os.path.join(cache_dir, name)
+        with open(path, "wb") as f:
+            f.write(b"x" * size)
+        mtime = time.time() - age_days * 86400
+        os.utime(path, (mtime, mtime))
+
+    def test_removes_expired_then_oldest_over_quota(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            self._write(cache_dir, "1.png", 100, 40)
+            self._write(cache_dir, "2.png", 100, 3)
+            self._write(cache_dir, "3.png", 100, 2)
+            self._write(cache_dir, "4.png", 100, 1)
+            self.assertEqual(prune_cache(cache_dir, max_bytes=200, max_age_seconds=30 * 86400), 2)
+            self.assertEqual(sorted(os.listdir(cache_dir)), ["3.png", "4.png"])
+
+    def test_cache_hit_refreshes_last_use(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            self._write(cache_dir, "1.png", 100, 40)
+            self.assertIsNotNone(twitter_capture.load_cached_capture(cache_dir, "1"))
+            self.assertEqual(prune_cache(cache_dir, max_bytes=10 ** 6, max_age_seconds=30 * 86400), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
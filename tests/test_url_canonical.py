@@ -0,0 +1,50 @@
+# coding: utf-8
+"""url_canonical.py の重複の除去と軽い表示の確認"""
+import unittest
+from types import SimpleNamespace
+
+import url_canonical
+from url_canonical import (
+    group_unique_urls, light_variant_url, light_variant_verified, record_light_variant, unique_urls,
+)
+
+FC2 = "https://xx.blog.fc2.com/blog-entry-1.html"
+
+
+def _parsed(images_per_post):
+    return SimpleNamespace(posts=[SimpleNamespace(images=[object()] * n) for n in images_per_post])
+
+
+class GroupUniqueUrlsTest(unittest.TestCase):
+    def test_inputs_are_grouped_under_the_canonical_url(self):
+        inputs = ["http://Oryouri.2chblog.jp/archives/1.html?sp=1#c",
+                  "https://oryouri.2chblog.jp/archives/1.html",
+                  "https://ex.com/a#top"]
+        groups = group_unique_urls((url, url) for url in inputs)
+        self.assertEqual(list(groups), unique_urls(inputs))
+        self.assertEqual(groups["https://oryouri.2chblog.jp/archives/1.html"], inputs[:2])
+        self.assertEqual(groups["https://ex.com/a"], inputs[2:])
+
+
+class LightVariantCheckTest(unittest.TestCase):
+    def setUp(self):
+        url_canonical._light_checked.clear()
+
+    def tearDown(self):
+        url_canonical._light_checked.clear()
+
+    def test_matching_light_variant_is_trusted(self):
+        self.assertFalse(light_variant_verified(FC2))
+        self.assertTrue(record_light_variant(FC2, _parsed([1, 2]), _parsed([1, 2])))
+        self.assertTrue(light_variant_verified(FC2))
+        self.assertEqual(light_variant_url(FC2), FC2 + "?sp")
+
+    def test_light_variant_with_fewer_posts_or_images_is_disabled(self):
+        self.assertFalse(record_light_variant(FC2, _parsed([1, 1]), _parsed([1, 2])))
+        self.assertFalse(light_variant_verified(FC2))
+        self.assertIsNone(light_variant_url(FC2))
+        self.assertFalse(record_light_variant(FC2, _parsed([1]), _parsed([1, 0])))
+
+
+if __name__ == "__main__":
+    unittest.main()
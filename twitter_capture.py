@@ -0,0 +1,276 @@
+# coding: utf-8
+"""
+Twitter/X 埋め込みのスクリーンショット取得
+
+- 埋め込み iframe ごとの固定待機・スクロールをやめ、各 iframe 自身の load を待つ
+- フルページ座標でのクリップ撮影により scroll_into_view を不要にする
+- ツイートIDごとにキャプチャをキャッシュし、次回以降の実行で再利用する
+  （iframe の load を待てたものだけ。キャッシュは古いもの・上限を超えた分をプロセスごとに1回削除する）
+"""
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from typing import List, Optional, Set, Tuple
+from urllib.parse import urlparse, parse_qs
+
+logger = logging.getLogger(__name__)
+
+# 埋め込み iframe の判定に使う src の部分文字列（小文字）
+TWITTER_EMBED_MARKERS = (
+    "twitter.com/embed/tweet.html",
+    "x.com/embed/tweet.html",
+)
+
+# キャプチャのキャッシュ保存先（環境変数で変更可能）
+TWITTER_CACHE_DIR = os.environ.get(
+    "TWITTER_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "画像一括取得", "twitter")
+)
+
+# キャッシュ全体の上限（MB）と、最後に使われてから削除するまでの日数（環境変数で変更可能）
+DEFAULT_CACHE_MAX_MB = 200
+DEFAULT_CACHE_MAX_DAYS = 30
+
+# 全 iframe の読み込み待ちに使う合計時間（ミリ秒）
+LOAD_WAIT_BUDGET_MS = 8000
+
+# 埋め込み描画後の高さ調整を待つ時間（ミリ秒）
+SETTLE_WAIT_MS = 300
+
+# ページ内の全埋め込み iframe の位置をまとめて取得するスクリプト
+_COLLECT_RECTS_JS = """
+(markers) => {
+    const result = [];
+    document.querySelectorAll("iframe").forEach((el, index) => {
+        const src = (el.getAttribute("src") || "").toLowerCase();
+        if (!markers.some(m => src.includes(m))) {
+            return;
+        }
+        const rect = el.getBoundingClientRect();
+        result.push({
+            index: index,
+            src: el.getAttribute("src") || "",
+            tweetId: el.getAttribute("data-tweet-id") || "",
+            x: rect.left + window.scrollX,
+            y: rect.top + window.scrollY,
+            width: rect.width,
+            height: rect.height
+        });
+    });
+    return result;
+}
+"""
+
+
+def extract_tweet_id(src: str, data_tweet_id: str = "") -> Optional[str]:
+    """
+    埋め込み iframe からツイートIDを取得
+
+    Args:
+        src: iframe の src（例: https://platform.twitter.com/embed/Tweet.html?id=123...）
+        data_tweet_id: iframe の data-tweet-id 属性（widgets.js が付与）
+
+    Returns:
+        数字のみのツイートID、取得できない場合は None
+    """
+    if data_tweet_id and data_tweet_id.isdigit():
+        return data_tweet_id
+    try:
+        tweet_id = parse_qs(urlparse(src).query).get("id", [""])[0]
+    except ValueError:
+        return None
+    if re.fullmatch(r"\d{1,25}", tweet_id):
+        return tweet_id
+    return None
+
+
+def _cache_path(cache_dir: str, tweet_id: str) -> str:
+    return os.path.join(cache_dir, f"{tweet_id}.png")
+
+
+def load_cached_capture(cache_dir: Optional[str], tweet_id: Optional[str]) -> Optional[bytes]:
+    """キャッシュ済みのキャプチャを読み込む（なければ None）"""
+    if not cache_dir or not tweet_id:
+        return None
+    path = _cache_path(cache_dir, tweet_id)
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+        # 最後に使われた時刻を更新（prune_cache は古いものから削除する）
+        os.utime(path)
+        return data
+    except OSError:
+        return None
+
+
+_pruned_dirs = set()
+_prune_lock = threading.Lock()
+
+
+def prune_cache(cache_dir: str, max_bytes: int, max_age_seconds: float) -> int:
+    """
+    最後に使われてから max_age_seconds が経ったキャプチャを削除し、合計が max_bytes を
+    超えていれば古い順に削除する。削除したファイル数を返す。
+    """
+    entries = []
+    try:
+        names = os.listdir(cache_dir)
+    except OSError:
+        return 0
+    for name in names:
+        if not name.endswith(".png"):
+            continue
+        path = os.path.join(cache_dir, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+    entries.sort()
+
+    now = time.time()
+    total = sum(size for _, size, _ in entries)
+    removed = 0
+    for mtime, size, path in entries:
+        if now - mtime <= max_age_seconds and total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        removed += 1
+    if removed:
+        logger.info("Removed %d old Twitter capture(s) from %s", removed, cache_dir)
+    return removed
+
+
+def _prune_once(cache_dir: str) -> None:
+    with _prune_lock:
+        if cache_dir in _pruned_dirs:
+            return
+        _pruned_dirs.add(cache_dir)
+    max_mb = float(os.environ.get("TWITTER_CACHE_MAX_MB", DEFAULT_CACHE_MAX_MB))
+    max_days = float(os.environ.get("TWITTER_CACHE_MAX_DAYS", DEFAULT_CACHE_MAX_DAYS))
+    prune_cache(cache_dir, int(max_mb * 1024 * 1024), max_days * 86400)
+
+
+def store_cached_capture(cache_dir: Optional[str], tweet_id: Optional[str], data: bytes) -> None:
+    """キャプチャをキャッシュに保存（一時ファイル経由で置き換え、並行実行でも壊れない）"""
+    if not cache_dir or not tweet_id or not data:
+        return
+    tmp_path = None
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        _prune_once(cache_dir)
+        # 同じプロセスの別スレッドが同じツイートを保存しても衝突しない一時ファイル名にする
+        fd, tmp_path = tempfile.mkstemp(prefix=f"{tweet_id}.", suffix=".tmp", dir=cache_dir)
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, _cache_path(cache_dir, tweet_id))
+    except OSError:
+        if tmp_path:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+
+def _wait_for_frames(iframe_elements: List[Tuple[int, object]], budget_ms: int) -> Set[int]:
+    """
+    各 iframe 自身の load を待ち、読み込みが終わった iframe の番号を返す
+
+    読み込みはブラウザ側で並行に進むため、順番に待っても合計時間は
+    最も遅い iframe の読み込み時間程度になる。全体の上限は budget_ms。
+
+    Args:
+        iframe_elements: [(ページ内の iframe の番号, ElementHandle), ...]
+    """
+    loaded = set()
+    deadline = time.monotonic() + budget_ms / 1000
+    for index, iframe_elem in iframe_elements:
+        remaining_ms = int((deadline - time.monotonic()) * 1000)
+        if remaining_ms <= 0:
+            break
+        try:
+            frame = iframe_elem.content_frame()
+            if frame:
+                frame.wait_for_load_state("load", timeout=remaining_ms)
+                loaded.add(index)
+        except Exception:
+            continue
+    return loaded
+
+
+def capture_twitter_embeds(page, cache_dir: Optional[str] = TWITTER_CACHE_DIR) -> List[Tuple[str, bytes]]:
+    """
+    ページ内の Twitter/X 埋め込みをスクリーンショットとして取得
+
+    Args:
+        page: Playwright の Page
+        cache_dir: ツイートIDごとのキャッシュ保存先（None でキャッシュ無効）
+
+    Returns:
+        [("twitter_embed", png_bytes), ...] のリスト（ページ内の出現順）
+    """
+    rects = page.evaluate(_COLLECT_RECTS_JS, list(TWITTER_EMBED_MARKERS))
+    if not rects:
+        return []
+
+    # ツイートIDで重複を除き、キャッシュにないものだけ撮影対象にする
+    captures = {}
+    ordered_keys = []
+    seen_keys = set()
+    pending = []
+    for rect in rects:
+        tweet_id = extract_tweet_id(rect["src"], rect.get("tweetId", ""))
+        key = tweet_id or f"index:{rect['index']}"
+        if key in seen_keys:
+            continue
+        seen_keys.add(key)
+        ordered_keys.append(key)
+        cached = load_cached_capture(cache_dir, tweet_id)
+        if cached:
+            captures[key] = cached
+        else:
+            pending.append((key, tweet_id, rect["index"]))
+
+    if pending:
+        all_iframes = page.query_selector_all("iframe")
+        pending_elements = [(index, all_iframes[index]) for _, _, index in pending if index < len(all_iframes)]
+        loaded = _wait_for_frames(pending_elements, LOAD_WAIT_BUDGET_MS)
+        # 埋め込み側の高さ調整（postMessage によるリサイズ）を待つ
+        page.wait_for_timeout(SETTLE_WAIT_MS)
+
+        # 読み込み後に位置が変わるため、座標を取り直す
+        rects_by_index = {
+            rect["index"]: rect
+            for rect in page.evaluate(_COLLECT_RECTS_JS, list(TWITTER_EMBED_MARKERS))
+        }
+        for key, tweet_id, index in pending:
+            rect = rects_by_index.get(index)
+            if not rect or rect["width"] < 1 or rect["height"] < 1:
+                continue
+            try:
+                # フルページ座標でクリップ撮影（スクロール不要）
+                screenshot_bytes = page.screenshot(
+                    full_page=True,
+                    clip={
+                        "x": rect["x"],
+                        "y": rect["y"],
+                        "width": rect["width"],
+                        "height": rect["height"],
+                    },
+                    timeout=10000,
+                )
+            except Exception:
+                continue
+            captures[key] = screenshot_bytes
+            # 読み込みが終わらなかった（空白・描画途中の）キャプチャは今回だけ使い、キャッシュしない
+            if index in loaded:
+                store_cached_capture(cache_dir, tweet_id, screenshot_bytes)
+
+    return [("twitter_embed", captures[key]) for key in ordered_keys if key in captures]
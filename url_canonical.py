@@ -0,0 +1,222 @@
+# coding: utf-8
+"""
+URLの正規化と重複の除去
+
+同じスレッドが http/https、?sp=1 などの表示切り替え、#以降の違い、AMP・スマホ版のホストなど
+別の形で貼られると、それぞれを最初から取得していた。処理の前にURLを正規化し、
+同じURLは最初の1件だけを処理する。
+
+- すべてのサイト: スキーム・ホスト名を小文字に、#以降・既定のポート・計測用のクエリ
+  （utm_* / fbclid / gclid）を除く
+- SITE_RULES に登録したサイトのみ: https への統一、表示切り替えのクエリの除去、
+  スマホ版ホスト（m. / sp.）・AMP のパス（/amp/）を通常のURLに戻す
+
+スマホ版などの軽い表示で同じ抽出結果になるサイトは SiteRule.light_query に登録しておくと、
+--light-variant（または LIGHT_VARIANT=1）のときにそちらを取得する
+（投稿・画像が取れない場合は通常のURLで取り直す）。ホストごとに最初の1件は通常のURLも取得して
+投稿数・画像数を比べ、一致しなければそのホストでは（プロセスの終了まで）軽い表示を使わない。
+"""
+import logging
+import os
+import re
+import threading
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+if TYPE_CHECKING:
+    from page_parser import ParsedPage
+
+logger = logging.getLogger(__name__)
+
+# すべてのサイトで除く計測用のクエリ
+TRACKING_PARAMS = ("fbclid", "gclid", "yclid", "mc_cid", "mc_eid")
+TRACKING_PREFIXES = ("utm_",)
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+class SiteRule(NamedTuple):
+    """サイトごとの正規化ルール（登録したサイトにだけ適用する）"""
+    domains: Tuple[str, ...]                       # 対象ドメイン（サブドメインを含む）
+    https: bool = False                            # http:// を https:// にそろえる
+    strip_params: Tuple[str, ...] = ()             # 除くクエリ（表示切り替え用）
+    mobile_prefixes: Tuple[str, ...] = ()          # 除くとPC版になるホスト名の接頭辞
+    amp_path: bool = False                         # パス末尾の /amp/ を除く
+    light_query: Tuple[Tuple[str, str], ...] = ()  # 軽い表示を取得するときに付けるクエリ（値が空ならキーのみ）
+
+
+SITE_RULES: Tuple[SiteRule, ...] = (
+    # livedoor ブログ（独自ドメインの blog.jp・2chblog.jp などを含む）
+    SiteRule(
+        domains=("blog.livedoor.jp", "livedoor.biz", "livedoor.blog", "blog.jp", "2chblog.jp",
+                 "doorblog.jp", "ldblog.jp"),
+        https=True,
+        strip_params=("sp", "amp", "ref"),
+        mobile_prefixes=("sp.", "m."),
+    ),
+    # FC2ブログ（?sp でスマホ版のテンプレートになる）
+    SiteRule(
+        domains=("blog.fc2.com", "blog.fc2.net"),
+        strip_params=("sp", "pc", "m"),
+        light_query=(("sp", ""),),
+    ),
+    # WordPress のまとめサイト（AMPプラグインの /amp/・?amp=1）
+    SiteRule(
+        domains=("tabinolog.com",),
+        https=True,
+        strip_params=("amp",),
+        amp_path=True,
+    ),
+)
+
+_AMP_PATH = re.compile(r"/amp/?$")
+
+
+def site_rule(host: str) -> Optional[SiteRule]:
+    """ホスト名に当てはまるルール（なければ None）"""
+    for rule in SITE_RULES:
+        if any(host == domain or host.endswith("." + domain) for domain in rule.domains):
+            return rule
+    return None
+
+
+def _keep_param(key: str, rule: Optional[SiteRule]) -> bool:
+    if key in TRACKING_PARAMS or key.startswith(TRACKING_PREFIXES):
+        return False
+    return rule is None or key not in rule.strip_params
+
+
+def canonicalize_url(url: str) -> str:
+    """URLを正規化する（http(s) 以外・解釈できないURLはそのまま返す）"""
+    try:
+        parts = urlsplit(url.strip())
+        port = parts.port
+    except ValueError:
+        return url
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if scheme not in DEFAULT_PORTS or not host:
+        return url
+
+    rule = site_rule(host)
+    path = parts.path or "/"
+    if rule is not None:
+        if rule.https:
+            scheme = "https"
+        for prefix in rule.mobile_prefixes:
+            if host.startswith(prefix) and site_rule(host[len(prefix):]) is rule:
+                host = host[len(prefix):]
+                break
+        if rule.amp_path and _AMP_PATH.search(path):
+            path = _AMP_PATH.sub("/", path)
+
+    netloc = host
+    if port is not None and port != DEFAULT_PORTS[scheme]:
+        netloc = f"{host}:{port}"
+    params = parse_qsl(parts.query, keep_blank_values=True)
+    query = [(key, value) for key, value in params if _keep_param(key, rule)]
+    # 除くクエリがなければ元の表記のまま（エンコードの違いでURLを変えない）
+    query_string = parts.query if len(query) == len(params) else urlencode(query)
+    return urlunsplit((scheme, netloc, path, query_string, ""))
+
+
+def _dedupe_key(url: str) -> str:
+    # http と https は同じページとみなす
+    return re.sub(r"^https?://", "", url)
+
+
+def iter_unique_urls(urls: Iterable[str]) -> Iterator[str]:
+    """正規化したURLを、重複（最初に出たもの以外）を除いて順に返す"""
+    seen = set()
+    for url in urls:
+        canonical = canonicalize_url(url)
+        key = _dedupe_key(canonical)
+        if key in seen:
+            logger.info("Skipping duplicate URL: %s", url)
+            continue
+        seen.add(key)
+        if canonical != url:
+            logger.debug("Canonicalized %s -> %s", url, canonical)
+        yield canonical
+
+
+def unique_urls(urls: Iterable[str]) -> List[str]:
+    return list(iter_unique_urls(urls))
+
+
+def group_unique_urls(pairs: Iterable[Tuple[str, str]]) -> Dict[str, List[str]]:
+    """
+    (URL, 入力) の組を、正規化したURLごとにまとめる
+
+    Returns:
+        正規化したURL（iter_unique_urls と同じ順）→ そのURLにまとめた入力のリスト
+    """
+    groups: Dict[str, List[str]] = {}
+    canonical_by_key: Dict[str, str] = {}
+    for url, source in pairs:
+        canonical = canonicalize_url(url)
+        key = _dedupe_key(canonical)
+        if key not in canonical_by_key:
+            canonical_by_key[key] = canonical
+            groups[canonical] = []
+        groups[canonical_by_key[key]].append(source)
+    return groups
+
+
+def default_light_variant() -> bool:
+    return os.environ.get("LIGHT_VARIANT", "").strip().lower() in ("1", "true", "yes", "on")
+
+
+# 軽い表示の抽出結果を通常のURLと比べたホスト: ホスト名 → 一致したか
+_light_checked: Dict[str, bool] = {}
+_light_lock = threading.Lock()
+
+
+def _host(url: str) -> str:
+    return (urlsplit(url).hostname or "").lower()
+
+
+def light_variant_url(url: str) -> Optional[str]:
+    """軽い表示（スマホ版など）のURL（ルールに登録がない・通常のURLと結果が違ったホストは None）"""
+    parts = urlsplit(url)
+    rule = site_rule((parts.hostname or "").lower())
+    if rule is None or not rule.light_query:
+        return None
+    with _light_lock:
+        if _light_checked.get(_host(url)) is False:
+            return None
+    extra = "&".join(key if not value else urlencode([(key, value)]) for key, value in rule.light_query)
+    return urlunsplit(parts._replace(query=f"{parts.query}&{extra}" if parts.query else extra))
+
+
+def light_variant_usable(parsed: "ParsedPage") -> bool:
+    """軽い表示の抽出結果を使うか（投稿・画像がない、フォールバックが起きた場合は通常のURLで取り直す）"""
+    return (bool(parsed.posts)
+            and parsed.pattern_fallbacks == 0
+            and any(post.images for post in parsed.posts))
+
+
+def light_variant_verified(url: str) -> bool:
+    """url のホストで、軽い表示が通常のURLと同じ結果になることを確認済みか"""
+    with _light_lock:
+        return _light_checked.get(_host(url)) is True
+
+
+def record_light_variant(url: str, light: "ParsedPage", full: "ParsedPage") -> bool:
+    """
+    軽い表示と通常のURLの抽出結果（投稿数・画像数）を比べ、結果をホストごとに記録する
+
+    Returns:
+        一致したか（一致しなければ、このホストでは以降軽い表示を使わない）
+    """
+    light_counts = (len(light.posts), sum(len(post.images) for post in light.posts))
+    full_counts = (len(full.posts), sum(len(post.images) for post in full.posts))
+    matches = light_counts == full_counts
+    with _light_lock:
+        _light_checked[_host(url)] = matches
+    if matches:
+        logger.info("The light variant of %s matches the full page", _host(url))
+    else:
+        logger.warning("The light variant of %s extracted %d post(s) / %d image(s) but the full page has "
+                       "%d / %d; not using it for this host", _host(url), *light_counts, *full_counts)
+    return matches
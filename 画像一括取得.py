@@ -3,16 +3,45 @@
 画像一括取得システム
 バージョン: 2.0.0
 """
+import argparse
+import contextlib
+import json
+import logging
 import os
 import re
-import shutil
 import sys
-import requests
+import threading
+import time
 from urllib.parse import urljoin
-from typing import List, Dict, Tuple, Optional
+from typing import IO, TYPE_CHECKING, ContextManager, Iterable, Iterator, List, Dict, Tuple, Optional
 
-from bs4 import BeautifulSoup, Tag
-from playwright.sync_api import sync_playwright
+from browser_contexts import HostContextPool, default_profile_dir, open_page
+from dom_extract import default_dom_extract, extract_thread_html, matches_full_page
+from extractors.pagination import DEFAULT_MAX_PAGES, merge_pages, page_number
+from image_validation import ImagePostprocessor, InvalidImageError, validate_image
+from job_queue import (
+    DEFAULT_DB_PATH, DEFAULT_LEASE_SECONDS, DEFAULT_MAX_ATTEMPTS, Heartbeat, JobQueue, default_worker_id,
+)
+from output_sinks import SINK_TYPES, DirectorySink, OutputSink, ThreadOutput, create_sink, default_sink_type
+from output_writer import PostsWriter, url_hash
+from page_parser import parse_response_header, run_parse_page, set_parse_workers
+from page_scroll import SCROLL_MODES, default_scroll_mode, scroll_for_lazy_images
+from post_record import ImageRef, Post
+from profiling import DEFAULT_TOP_N, profile_url
+from scrape_logging import configure_logging, log_context
+from scrape_metrics import UrlMetrics, write_metrics_log
+from twitter_capture import capture_twitter_embeds
+from url_canonical import (
+    default_light_variant, iter_unique_urls, light_variant_url, light_variant_usable, light_variant_verified,
+    record_light_variant,
+)
+
+# Playwright・BeautifulSoup・requests は読み込みに時間がかかるため、
+# 実際に使う関数の中で読み込む（EXEや短命なワーカーの起動を速くする）
+if TYPE_CHECKING:
+    import requests
+    from bs4 import Tag
+    from page_parser import ParsedPage
 
 # バージョン情報
 try:
@@ -38,19 +67,41 @@ if getattr(sys, 'frozen', False):
     )
     os.environ["PLAYWRIGHT_BROWSERS_PATH"] = PLAYWRIGHT_BROWSERS_PATH
 
+logger = logging.getLogger("scraper")
+
 # ----------------------------------------
 # 画像ダウンロード用の HTTP セッション
 # ----------------------------------------
-session = requests.Session()
-session.headers.update({
-    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64)"
-                  " AppleWebKit/537.36 (KHTML, like Gecko)"
-                  " Chrome/120.0 Safari/537.36"
-})
+_session: Optional["requests.Session"] = None
+_session_lock = threading.Lock()
 TIMEOUT = 10
 
 
-def is_ad_image(img_url: str, img_tag: Tag, parent_elem: Optional[Tag] = None) -> bool:
+def get_session() -> "requests.Session":
+    """画像ダウンロード用の HTTP セッション（初回呼び出し時に作成）"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                import requests
+                session = requests.Session()
+                session.headers.update({
+                    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64)"
+                                  " AppleWebKit/537.36 (KHTML, like Gecko)"
+                                  " Chrome/120.0 Safari/537.36"
+                })
+                _session = session
+    return _session
+
+
+def __getattr__(name: str):
+    # 以前のモジュール変数 `session` を参照するコード向け
+    if name == "session":
+        return get_session()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def is_ad_image(img_url: str, img_tag: "Tag", parent_elem: Optional["Tag"] = None) -> bool:
     """
     広告画像かどうかを判定する
     
@@ -81,6 +132,32 @@ def is_ad_image(img_url: str, img_tag: Tag, parent_elem: Optional[Tag] = None) -
                 if "t_b" in parent_parent_classes:
                     is_in_thread_body = True
 
+    return _is_ad_by_attributes(
+        img_url,
+        img_tag.get("width"),
+        img_tag.get("height"),
+        img_tag.get("class", []),
+        img_tag.get("id") or "",
+        is_in_thread_body,
+    )
+
+
+def is_ad_image_ref(img_url: str, image: ImageRef) -> bool:
+    """
+    広告画像かどうかを判定する（ImageRef版）
+
+    抽出時にコピーした属性で is_ad_image() と同じ判定を行う。
+    BeautifulSoup の木を解放した後のダウンロード処理で使用する。
+    """
+    if not img_url:
+        return True
+    return _is_ad_by_attributes(
+        img_url, image.width, image.height, image.classes, image.element_id, image.in_thread_body
+    )
+
+
+def _is_ad_by_attributes(img_url: str, width, height, class_list, img_id: str,
+                         is_in_thread_body: bool) -> bool:
     lower = img_url.lower()
     bad_keywords = [
         "/ads/", "adservice", "doubleclick", "tracking",
@@ -92,8 +169,6 @@ def is_ad_image(img_url: str, img_tag: Tag, parent_elem: Optional[Tag] = None) -
         return True
 
     # スレッド本文内の画像はサイズ判定を緩和
-    width = img_tag.get("width")
-    height = img_tag.get("height")
     if width and height:
         try:
             w = int(str(width).replace("px", ""))
@@ -105,8 +180,8 @@ def is_ad_image(img_url: str, img_tag: Tag, parent_elem: Optional[Tag] = None) -
         except (ValueError, TypeError):
             pass
 
-    classes = " ".join(img_tag.get("class", [])).lower()
-    img_id = (img_tag.get("id") or "").lower()
+    classes = " ".join(class_list).lower()
+    img_id = img_id.lower()
     
     bad_class_keywords = ["ad", "banner", "sponsor", "promo", "advertisement"]
     if any(k in classes for k in bad_class_keywords):
@@ -118,7 +193,7 @@ def is_ad_image(img_url: str, img_tag: Tag, parent_elem: Optional[Tag] = None) -
     return False
 
 
-def extract_img_src(img_tag: Tag) -> Optional[str]:
+def extract_img_src(img_tag: "Tag") -> Optional[str]:
     for attr in ["src", "data-src", "data-original", "data-lazy", "data-image"]:
         val = img_tag.get(attr)
         if val:
@@ -126,7 +201,39 @@ def extract_img_src(img_tag: Tag) -> Optional[str]:
     return None
 
 
-def extract_images_from_element(elem: Tag) -> List[str]:
+def extract_image_id(url: str) -> str:
+    """Extract unique image ID from URL (e.g., nKqZYrk from any URL containing it)"""
+    # Try to extract imgur-style ID (alphanumeric, typically 7 chars)
+    # Also handle livedoor blog image formats like: 9df4f32a-s.jpg and 9df4f32a.jpg
+    # Also handle tabinolog formats like: /imgs/a314e997-s.jpg
+    # Pattern: /id-suffix.ext or /id.ext (match the last path segment before extension)
+    # Try multiple patterns
+    patterns = [
+        r'/([a-zA-Z0-9]{7,})(?:-[a-z0-9]+)?\.(?:jpg|jpeg|png|gif|webp)',  # Original pattern
+        r'/([a-zA-Z0-9]{7,})\.(?:jpg|jpeg|png|gif|webp)',  # Without suffix
+        r'([a-zA-Z0-9]{7,})(?:-[a-z0-9]+)?\.(?:jpg|jpeg|png|gif|webp)',  # Without leading slash
+    ]
+    for pattern in patterns:
+        match = re.search(pattern, url, re.IGNORECASE)
+        if match:
+            return match.group(1).lower()
+    # Fallback to full URL
+    return url.split('?')[0].lower()
+
+
+def get_image_id_from_url(url: str) -> str:
+    """Extract image ID from URL for duplicate checking"""
+    # Handle various image URL formats:
+    # - imgur: /nKqZYrk.jpg, /nKqZYrk-640x480.jpg, /nKqZYrk-scaled.jpg
+    # - livedoor: /9df4f32a.jpg, /9df4f32a-s.jpg (thumbnail)
+    # - tabinolog: /filename-640x480.jpg, /filename-scaled.jpg
+    match = re.search(r'/([a-zA-Z0-9]{7,})(?:-[a-z0-9]+)?\.(?:jpg|jpeg|png|gif|webp)', url, re.IGNORECASE)
+    if match:
+        return match.group(1).lower()
+    return url.split('?')[0].lower()
+
+
+def extract_images_from_element(elem: "Tag") -> List[str]:
     """
     Extract all image URLs from an element, including:
     - <img> tags
@@ -137,26 +244,8 @@ def extract_images_from_element(elem: Tag) -> List[str]:
     """
     image_urls = []
     seen_ids = set()  # 画像IDでの重複チェック用
-    
-    def extract_image_id(url: str) -> str:
-        """Extract unique image ID from URL (e.g., nKqZYrk from any URL containing it)"""
-        import re
-        # Try to extract imgur-style ID (alphanumeric, typically 7 chars)
-        # Also handle livedoor blog image formats like: 9df4f32a-s.jpg and 9df4f32a.jpg
-        # Also handle tabinolog formats like: /imgs/a314e997-s.jpg
-        # Pattern: /id-suffix.ext or /id.ext (match the last path segment before extension)
-        # Try multiple patterns
-        patterns = [
-            r'/([a-zA-Z0-9]{7,})(?:-[a-z0-9]+)?\.(?:jpg|jpeg|png|gif|webp)',  # Original pattern
-            r'/([a-zA-Z0-9]{7,})\.(?:jpg|jpeg|png|gif|webp)',  # Without suffix
-            r'([a-zA-Z0-9]{7,})(?:-[a-z0-9]+)?\.(?:jpg|jpeg|png|gif|webp)',  # Without leading slash
-        ]
-        for pattern in patterns:
-            match = re.search(pattern, url, re.IGNORECASE)
-            if match:
-                return match.group(1).lower()
-        # Fallback to full URL
-        return url.split('?')[0].lower()
+    # 画像ごとのループ内でレベル判定を繰り返さないよう、最初に1回だけ確認
+    debug = logger.isEnabledFor(logging.DEBUG)
     
     # Collect local image URLs (from <img> tags) and imgur URLs separately
     local_images = []  # (url, img_tag)
@@ -169,12 +258,12 @@ def extract_images_from_element(elem: Tag) -> List[str]:
             # Check if ad image (親要素を渡してスレッド本文内かどうかを判定)
             is_ad = is_ad_image(src, img, elem)
             # デバッグ: 最初の数件のみ
-            if len(local_images) + len(imgur_urls_in_post) < 3:
-                print(f"[DEBUG] extract_images_from_element STEP1: Found <img> with src={src}, is_ad={is_ad}")
+            if debug and len(local_images) + len(imgur_urls_in_post) < 3:
+                logger.debug("extract_images_from_element STEP1: Found <img> with src=%s, is_ad=%s", src, is_ad)
             
             if is_ad:
-                if len(local_images) + len(imgur_urls_in_post) < 3:
-                    print(f"[DEBUG] extract_images_from_element STEP1: Skipped ad image")
+                if debug and len(local_images) + len(imgur_urls_in_post) < 3:
+                    logger.debug("extract_images_from_element STEP1: Skipped ad image")
                 continue
             
             # Check if this <img> is wrapped by an <a> tag pointing to a full-size image
@@ -185,18 +274,18 @@ def extract_images_from_element(elem: Tag) -> List[str]:
                 if any(ext in href.lower() for ext in [".jpg", ".jpeg", ".png", ".gif", ".webp"]):
                     # Use the <a> href (full-size) instead of <img> src (thumbnail)
                     src = href
-                    if len(local_images) + len(imgur_urls_in_post) < 3:
-                        print(f"[DEBUG] extract_images_from_element STEP1: Using parent <a> href: {src}")
+                    if debug and len(local_images) + len(imgur_urls_in_post) < 3:
+                        logger.debug("extract_images_from_element STEP1: Using parent <a> href: %s", src)
             
             # Store for later prioritization
             if "imgur" in src.lower():
                 imgur_urls_in_post.append((src, img))
-                if len(imgur_urls_in_post) <= 3:
-                    print(f"[DEBUG] extract_images_from_element STEP1: Added to imgur_urls_in_post: {src}")
+                if debug and len(imgur_urls_in_post) <= 3:
+                    logger.debug("extract_images_from_element STEP1: Added to imgur_urls_in_post: %s", src)
             else:
                 local_images.append((src, img))
-                if len(local_images) <= 3:
-                    print(f"[DEBUG] extract_images_from_element STEP1: Added to local_images: {src}")
+                if debug and len(local_images) <= 3:
+                    logger.debug("extract_images_from_element STEP1: Added to local_images: %s", src)
     
     # STEP 2: Extract from <iframe> tags (imgur embeds)
     for iframe in elem.find_all("iframe"):
@@ -265,19 +354,20 @@ def extract_images_from_element(elem: Tag) -> List[str]:
     for local_url, local_elem in local_images:
         local_id = extract_image_id(local_url)
         # デバッグ: 最初の数件のみ
-        if len(image_urls) < 3:
-            print(f"[DEBUG] extract_images_from_element STEP4: Processing local image URL: {local_url}")
-            print(f"[DEBUG] extract_images_from_element STEP4: Extracted image ID: {local_id}")
-            print(f"[DEBUG] extract_images_from_element STEP4: Seen IDs: {list(seen_ids)}")
+        if debug and len(image_urls) < 3:
+            logger.debug("extract_images_from_element STEP4: Processing local image URL: %s", local_url)
+            logger.debug("extract_images_from_element STEP4: Extracted image ID: %s", local_id)
+            logger.debug("extract_images_from_element STEP4: Seen IDs: %s", list(seen_ids))
         
         if local_id not in seen_ids:
             seen_ids.add(local_id)
             image_urls.append(("img", local_url, local_elem))
-            if len(image_urls) <= 3:
-                print(f"[DEBUG] extract_images_from_element STEP4: Added to image_urls: {local_url}")
+            if debug and len(image_urls) <= 3:
+                logger.debug("extract_images_from_element STEP4: Added to image_urls: %s", local_url)
         # デバッグ: 最初の数件のみ
-        elif len(image_urls) < 3:
-            print(f"[DEBUG] extract_images_from_element STEP4: Skipped duplicate local image ID: {local_id} (URL: {local_url})")
+        elif debug and len(image_urls) < 3:
+            logger.debug("extract_images_from_element STEP4: Skipped duplicate local image ID: %s (URL: %s)",
+                         local_id, local_url)
     
     # Add imgur URLs (fallback source - only if NOT already added)
     for imgur_url, imgur_elem in imgur_urls_in_post:
@@ -287,54 +377,25 @@ def extract_images_from_element(elem: Tag) -> List[str]:
             elem_type = "iframe" if imgur_elem.name == "iframe" else "img"
             image_urls.append((elem_type, imgur_url, imgur_elem))
         # デバッグ: 最初の数件のみ
-        elif len(image_urls) < 3:
-            print(f"[DEBUG] extract_images_from_element: Skipped duplicate imgur image ID: {imgur_id} (URL: {imgur_url})")
+        elif debug and len(image_urls) < 3:
+            logger.debug("extract_images_from_element: Skipped duplicate imgur image ID: %s (URL: %s)",
+                         imgur_id, imgur_url)
     
     # デバッグ: 最終的な結果を確認
-    if len(local_images) > 0 or len(imgur_urls_in_post) > 0:
+    if debug and (len(local_images) > 0 or len(imgur_urls_in_post) > 0):
         if len(image_urls) == 0:
-            print(f"[DEBUG] extract_images_from_element: Found {len(local_images)} local images and {len(imgur_urls_in_post)} imgur images, but returned 0 images")
+            logger.debug("extract_images_from_element: Found %d local images and %d imgur images, but returned 0 images",
+                         len(local_images), len(imgur_urls_in_post))
             if len(local_images) > 0:
                 first_local_url = local_images[0][0]
                 first_local_id = extract_image_id(first_local_url)
-                print(f"[DEBUG]   First local image URL: {first_local_url}")
-                print(f"[DEBUG]   First local image ID: {first_local_id}")
-                print(f"[DEBUG]   Seen IDs: {list(seen_ids)[:5]}")
+                logger.debug("  First local image URL: %s", first_local_url)
+                logger.debug("  First local image ID: %s", first_local_id)
+                logger.debug("  Seen IDs: %s", list(seen_ids)[:5])
     
     return image_urls
 
 
-def clean_text_from_images(elem: Tag) -> str:
-    elem_copy = BeautifulSoup(str(elem), "html.parser")
-    
-    # Remove ad/RSS sections
-    for ad_elem in elem_copy.find_all(class_=re.compile(r'(rss|ad|related|sidebar|widget)', re.I)):
-        ad_elem.decompose()
-    
-    # Remove specific ad text patterns
-    for div in elem_copy.find_all(['div', 'p', 'span']):
-        text = div.get_text()
-        if any(keyword in text for keyword in ['記事の途中ですが', 'RSS', '関連記事', 'スポンサー', '広告']):
-            div.decompose()
-    
-    for img in elem_copy.find_all("img"):
-        img.decompose()
-    
-    for a in elem_copy.find_all("a"):
-        href = a.get("href", "")
-        text = a.get_text()
-        if any(keyword in href.lower() for keyword in ["imgur.com", "i.imgur", ".jpg", ".jpeg", ".png", ".gif", ".webp"]):
-            a.decompose()
-        elif any(keyword in text.lower() for keyword in ["imgur.com", "i.imgur", ".jpg", ".jpeg", ".png", ".gif", ".webp"]):
-            a.decompose()
-    
-    text = elem_copy.get_text("\n", strip=True)
-    text = re.sub(r'https?://[^\s]*(?:imgur\.com|i\.imgur)[^\s]*', '', text)
-    text = re.sub(r'https?://[^\s]*\.(?:jpg|jpeg|png|gif|webp)[^\s]*', '', text, flags=re.IGNORECASE)
-    
-    return text.strip()
-
-
 def normalize_title(raw: str) -> str:
     if not raw:
         return "post"
@@ -347,259 +408,291 @@ def normalize_title(raw: str) -> str:
     return title[:50]
 
 
-def extract_id_from_text(text: str) -> Optional[str]:
-    match = re.search(r'ID:([A-Za-z0-9]+)', text)
-    if match:
-        return match.group(1)
-    return None
+def download_image(full_url: str) -> Tuple[bytes, str]:
+    """
+    画像をダウンロードし、内容を検証して (バイト列, 拡張子) を返す
 
+    拡張子はURLではなくマジックバイトから決める（判定できない形式だけURLから決める）。
 
-def detect_thread_creator_ids(soup: BeautifulSoup, first_post_id: Optional[str]) -> List[str]:
-    op_ids = set()
-    
-    if first_post_id:
-        op_ids.add(first_post_id)
-    
-    op_elements = soup.find_all(class_=re.compile(r'(op|thread-creator|author|postauthor)', re.I))
-    for elem in op_elements:
-        text = elem.get_text()
-        post_id = extract_id_from_text(text)
-        if post_id:
-            op_ids.add(post_id)
-    
-    return sorted(list(op_ids))
+    Raises:
+        requests.exceptions.RequestException: 通信エラー・HTTPエラー
+        InvalidImageError: HTMLのエラーページや途中で切れたファイルの場合
+    """
+    resp = get_session().get(full_url, timeout=TIMEOUT)
+    resp.raise_for_status()
+    data = resp.content
+    ext = validate_image(data, full_url)
+    return data, ext
 
 
-def parse_response_header(header_text: str) -> Dict[str, str]:
-    result = {
-        "number": "",
-        "name": "",
-        "datetime": "",
-        "id": "",
-        "full": header_text.strip()
-    }
-    
-    num_match = re.match(r'^(\d+):', header_text)
-    if num_match:
-        result["number"] = num_match.group(1)
-    
-    id_match = re.search(r'ID:([A-Za-z0-9]+)', header_text)
-    if id_match:
-        result["id"] = id_match.group(1)
-    
-    return result
+def default_max_pages() -> int:
+    """環境変数 MAX_THREAD_PAGES（1スレッドとして取得する最大ページ数）"""
+    return max(1, int(os.environ.get("MAX_THREAD_PAGES", DEFAULT_MAX_PAGES)))
 
 
-def scrape_single_url_js(url: str, result_root: str, browser) -> Tuple[bool, str, int]:
-    try:
-        page = browser.new_page()
+def read_page(page, url: str, metrics: UrlMetrics, dom_extract: bool,
+              thread_url: Optional[str] = None) -> "ParsedPage":
+    """
+    表示中のページのHTMLを取得して解析・パターン判定・抽出を行う
+
+    プロセスプールで実行する場合は HTML だけを渡し、コンパクトな投稿レコードだけを受け取る。
+    dom_extract なら、対応パターンのページはスレッド部分だけをブラウザ内で切り出す。
+    """
+    thread = None
+    if dom_extract:
+        with metrics.stage("content"):
+            thread = extract_thread_html(page)
+    if thread is not None:
+        metrics.rss.sample("content")
+        parsed = run_parse_page(thread.html, url, metrics, thread_url)
+        if matches_full_page(parsed, thread):
+            metrics.html_bytes += len(thread.html)
+            metrics.content_source = metrics.content_source or "thread"
+            return parsed
+        logger.info("In-browser extraction (%s) cannot be used for this page, parsing the full page",
+                    thread.pattern)
+        metrics.pattern_fallbacks -= parsed.pattern_fallbacks
+
+    with metrics.stage("content"):
+        html = page.content()
+    metrics.rss.sample("content")
+    metrics.html_bytes += len(html)
+    metrics.content_source = metrics.content_source or "page"
+    return run_parse_page(html, url, metrics, thread_url)
+
+
+def fetch_thread_pages(browser, url: str, page_urls: Iterable[str], metrics: UrlMetrics, max_pages: int,
+                       scroll_mode: str, dom_extract: bool, capture_twitter: bool = True
+                       ) -> List[Tuple[str, "ParsedPage", List[Tuple[str, bytes]]]]:
+    """
+    複数ページに分かれたスレッドの2ページ目以降を読み込み、(URL, ParsedPage, Twitter/X 埋め込みのキャプチャ)
+    をページ順に返す
+
+    PAGE_CONCURRENCY ページずつ読み込みを同時に開始し（ブラウザ内で並行して通信する）、
+    読み込めたページから順に解析する。「次のページ」リンクしかないサイトでは、
+    読み込んだページで見つかったページを続けて取得する。1ページ目を含め max_pages ページまで。
+    開いたページは失敗した場合も必ず閉じる（HostContextPool が開いたままのページを待ち続けないように）。
+    """
+    pending = list(page_urls)
+    seen = {url, *pending}
+    results: Dict[str, Tuple["ParsedPage", List[Tuple[str, bytes]]]] = {}
+    while pending and len(results) < max_pages - 1:
+        wave = pending[:min(PAGE_CONCURRENCY, max_pages - 1 - len(results))]
+        pending = pending[len(wave):]
+
+        pages = []
         try:
-            page.goto(url, wait_until="domcontentloaded", timeout=60000)
-            page.wait_for_timeout(3000)
-        except Exception:
-            pass
-    except Exception as e:
-        return False, f"[ERROR] Page load failed: {url}\n{e}"
+            with metrics.stage("goto"):
+                for page_url in wave:
+                    page = None
+                    try:
+                        page = open_page(browser, page_url)
+                        # 応答ヘッダーを受け取った時点で戻り、残りの読み込みは並行して進める
+                        page.goto(page_url, wait_until="commit", timeout=60000)
+                        pages.append((page_url, page))
+                    except Exception as e:
+                        logger.warning("Failed to open page %s: %s", page_url, e)
+                        if page is not None:
+                            _close_quietly(page)
+                for page_url, page in pages:
+                    try:
+                        page.wait_for_load_state("domcontentloaded", timeout=60000)
+                    except Exception:
+                        pass
+                if pages:
+                    pages[0][1].wait_for_timeout(3000)
+
+            for page_url, page in pages:
+                try:
+                    with metrics.stage("scroll"):
+                        scroll_for_lazy_images(page, scroll_mode)
+                except Exception:
+                    pass
+                # 1ページ目と同じく、HTMLを取得する前に埋め込みを撮影する
+                twitter_screenshots = []
+                if capture_twitter:
+                    try:
+                        with metrics.stage("twitter"):
+                            twitter_screenshots = capture_twitter_embeds(page)
+                    except Exception:
+                        pass
+                try:
+                    parsed = read_page(page, page_url, metrics, dom_extract, thread_url=url)
+                except Exception as e:
+                    logger.warning("Failed to read page %s: %s", page_url, e)
+                    continue
+                finally:
+                    _close_quietly(page)
+                results[page_url] = (parsed, twitter_screenshots)
+                for next_url in parsed.page_urls:
+                    if next_url not in seen:
+                        seen.add(next_url)
+                        pending.append(next_url)
+        finally:
+            for _, page in pages:
+                _close_quietly(page)
 
+    metrics.pages = 1 + len(results)
+    return [(page_url, parsed, twitter_screenshots)
+            for page_url, (parsed, twitter_screenshots)
+            in sorted(results.items(), key=lambda item: page_number(item[0], url) or 0)]
+
+
+def _close_quietly(page) -> None:
+    """ページを閉じる（閉じ済み・ブラウザ終了後でも例外にしない）"""
     try:
-        page.wait_for_load_state("domcontentloaded")
-        page.wait_for_timeout(2000)
-        
-        last_height = page.evaluate("document.body.scrollHeight")
-        scroll_attempts = 0
-        
-        for _ in range(20):
-            page.evaluate("window.scrollTo(0, document.body.scrollHeight)")
-            page.wait_for_timeout(1500)
-            
-            new_height = page.evaluate("document.body.scrollHeight")
-            if new_height == last_height:
-                scroll_attempts += 1
-                if scroll_attempts >= 3:
-                    break
-            else:
-                scroll_attempts = 0
-            last_height = new_height
-        
-        page.evaluate("window.scrollTo(0, 0)")
-        page.wait_for_timeout(1000)
+        page.close()
     except Exception:
         pass
 
-    # Capture Twitter/X embeds as screenshots before getting HTML
-    twitter_screenshots = []
-    try:
-        # Wait a bit more for Twitter iframes to load
-        page.wait_for_timeout(2000)
-        
-        # Get all iframe elements
-        iframe_elements = page.query_selector_all("iframe")
-        
-        for i, iframe_elem in enumerate(iframe_elements):
+
+def scrape_single_url_js(url: str, result_root: str, browser, capture_twitter: bool = True,
+                         make_thumbnails: bool = False, convert_webp: bool = False,
+                         metrics: Optional[UrlMetrics] = None,
+                         scroll_mode: Optional[str] = None,
+                         dom_extract: Optional[bool] = None,
+                         max_pages: Optional[int] = None,
+                         light_variant: Optional[bool] = None,
+                         sink: Optional[OutputSink] = None) -> Tuple[bool, str, int]:
+    """
+    1つのURLから投稿と画像を取得して result_root 以下に保存
+
+    Args:
+        url: 対象URL
+        result_root: 出力先ルートフォルダ
+        browser: Playwright の Browser、またはホストごとにコンテキストを使い回す HostContextPool
+        capture_twitter: Twitter/X 埋め込みのスクリーンショットを取得するか
+        make_thumbnails: サムネイル（thumbs/）を生成するか（Pillowが必要）
+        convert_webp: WebP版（webp/）を生成するか（Pillowが必要）
+        metrics: 段階ごとの所要時間などを記録する UrlMetrics（省略時は内部で作成）
+        scroll_mode: Lazy Load 用のスクロール（auto / full / never。省略時は環境変数 SCROLL_MODE）
+        dom_extract: スレッド部分だけをブラウザ内で切り出して解析するか（省略時は環境変数 DOM_EXTRACT）
+        max_pages: 複数ページに分かれたスレッドで取得する最大ページ数（1 で1ページ目のみ。
+                   省略時は環境変数 MAX_THREAD_PAGES）
+        light_variant: 軽い表示（url_canonical.SITE_RULES の light_query）を先に試すか
+                       （省略時は環境変数 LIGHT_VARIANT）
+        sink: 出力先（output_sinks。省略時は result_root 以下のフォルダ）
+    """
+    if metrics is None:
+        metrics = UrlMetrics(url)
+    if dom_extract is None:
+        dom_extract = default_dom_extract()
+    if max_pages is None:
+        max_pages = default_max_pages()
+    if light_variant is None:
+        light_variant = default_light_variant()
+
+    # 軽い表示（スマホ版など）が登録されたサイトはそちらを先に試し、使えなければ通常のURLで取り直す。
+    # ホストごとに最初の1件は通常のURLも取得し、同じ結果になるか確かめる（url_canonical.record_light_variant）
+    light_url = light_variant_url(url) if light_variant else None
+    light_parsed = None
+    for fetch_url in filter(None, (light_url, url)):
+        try:
+            page = open_page(browser, fetch_url)
             try:
-                iframe_src = iframe_elem.get_attribute("src")
-                # Check if this is a Twitter/X embed (Tweet.html, not widgets)
-                if iframe_src:
-                    lower_src = iframe_src.lower()
-                    is_twitter_embed = "twitter.com/embed/tweet.html" in lower_src
-                    
-                    if is_twitter_embed:
-                        # Scroll element into view first
-                        try:
-                            iframe_elem.scroll_into_view_if_needed(timeout=5000)
-                            page.wait_for_timeout(1000)
-                        except Exception:
-                            pass
-                        
-                        # Take screenshot of this iframe
-                        screenshot_bytes = iframe_elem.screenshot(timeout=10000)
-                        twitter_screenshots.append(("twitter_embed", screenshot_bytes))
+                with metrics.stage("goto"):
+                    page.goto(fetch_url, wait_until="domcontentloaded", timeout=60000)
+                    page.wait_for_timeout(3000)
             except Exception:
+                pass
+        except Exception as e:
+            if fetch_url != url:
+                logger.info("Could not open the light variant %s: %s", fetch_url, e)
                 continue
-    except Exception:
-        pass
+            metrics.finish("error", str(e))
+            return False, f"[ERROR] Page load failed: {url}\n{e}"
 
-    try:
-        html = page.content()
-    finally:
-        page.close()
+        try:
+            with metrics.stage("scroll"):
+                # 画像のURLが最初のDOMにそろっていればスクロールしない
+                metrics.scroll = scroll_for_lazy_images(page, scroll_mode or default_scroll_mode())
+        except Exception:
+            pass
+
+        # Capture Twitter/X embeds as screenshots before getting HTML
+        # (iframe自身のloadを待ってクリップ撮影、ツイートIDごとにキャッシュ)
+        twitter_screenshots = []
+        if capture_twitter:
+            try:
+                with metrics.stage("twitter"):
+                    twitter_screenshots = capture_twitter_embeds(page)
+            except Exception:
+                pass
+
+        parsed = None
+        try:
+            parsed = read_page(page, fetch_url, metrics, dom_extract)
+        except Exception:
+            if fetch_url == url:
+                raise
+            logger.info("Could not parse the light variant %s", fetch_url, exc_info=True)
+        finally:
+            page.close()
+        if fetch_url == url:
+            break
+        if parsed is not None and light_variant_usable(parsed):
+            if light_variant_verified(url):
+                break
+            light_parsed = parsed
+            logger.info("Comparing the light variant %s with %s", fetch_url, url)
+        else:
+            logger.info("The light variant %s did not extract the thread, loading %s", fetch_url, url)
+        if parsed is not None:
+            metrics.pattern_fallbacks -= parsed.pattern_fallbacks
+        metrics.html_bytes = 0
+        metrics.content_source = None
+    if fetch_url != url:
+        metrics.fetched_url = fetch_url
+    elif light_parsed is not None:
+        record_light_variant(url, light_parsed, parsed)
 
-    soup = BeautifulSoup(html, "html.parser")
+    posts = list(parsed.posts)
+    op_ids = list(parsed.op_ids)
+    if posts and parsed.page_urls and max_pages > 1:
+        # 複数ページに分かれたスレッド: 2ページ目以降を同時に読み込んで結合する
+        follow_ups = fetch_thread_pages(browser, fetch_url, parsed.page_urls, metrics, max_pages,
+                                        scroll_mode or default_scroll_mode(), dom_extract, capture_twitter)
+        posts = merge_pages([(fetch_url, parsed.posts)]
+                            + [(page_url, follow.posts) for page_url, follow, _ in follow_ups])
+        for _, follow, follow_screenshots in follow_ups:
+            op_ids.extend(op_id for op_id in follow.op_ids if op_id not in op_ids)
+            twitter_screenshots.extend(follow_screenshots)
+        logger.info("Merged %d page(s) into %d post(s)", len(follow_ups) + 1, len(posts))
+    metrics.posts = len(posts)
+    metrics.images_found = sum(len(post.images) for post in posts)
+    metrics.rss.sample("release")
 
-    title_tag = soup.title.get_text(strip=True) if soup.title else "post"
-    folder_name = normalize_title(title_tag)
-    folder = os.path.join(result_root, folder_name)
+    title_tag = parsed.title
+    # 同じタイトルの別スレッドと衝突しないよう、URLのハッシュを付ける
+    key = f"{normalize_title(title_tag)}_{url_hash(url)}"
+    if sink is None:
+        sink = DirectorySink(result_root)
 
-    if os.path.exists(folder):
-        shutil.rmtree(folder)
-    os.makedirs(folder, exist_ok=True)
+    with sink.open_thread(key, url, title_tag) as output:
+        metrics.folder = output.location
+        return save_thread(url, output, title_tag, posts, op_ids, parsed.page_classes, twitter_screenshots,
+                           metrics, make_thumbnails, convert_webp)
 
-    img_folder = os.path.join(folder, "images")
-    os.makedirs(img_folder, exist_ok=True)
 
-    # パターン選択ロジックを使用して投稿を抽出
-    try:
-        from extractors.pattern_loader import extract_posts_from_page
-        posts = extract_posts_from_page(soup, session, url)
-    except ImportError as e:
-        print(f"[ERROR] Failed to import extractors.pattern_loader: {e}")
-        print("[ERROR] Please ensure extractors/ folder exists with all required modules.")
-        posts = []
-        article = soup.select_one("article, .article-body, .entry-content, #article-body")
-        
-        if article:
-            elements = article.find_all(['div', 'p', 'blockquote'], recursive=False)
-            
-            current_header = ""
-            current_body_parts = []
-            current_imgs = []
-            current_id = None
-            
-            for elem in elements:
-                elem_text = elem.get_text(strip=True)
-                
-                # Check if this is a response header (starts with number:)
-                if elem_text and re.match(r'^\d+:', elem_text):
-                    # Save previous post
-                    if current_header:
-                        posts.append({
-                            "header": current_header,
-                            "body": "\n".join([p for p in current_body_parts if p]),
-                            "images": list(current_imgs),
-                            "id": current_id
-                        })
-                    
-                    # New response header
-                    current_header = elem_text
-                    parsed = parse_response_header(elem_text)
-                    current_id = parsed["id"]
-                    current_body_parts = []
-                    current_imgs = []
-                    continue
-                
-                # If we have a current header, collect body and images
-                if current_header:
-                    # Collect images
-                    for img in elem.find_all("img"):
-                        current_imgs.append(img)
-                    
-                    # Collect text (excluding image URLs)
-                    body_text = clean_text_from_images(elem)
-                    if body_text and body_text != current_header:
-                        current_body_parts.append(body_text)
-            
-            # Save last post
-            if current_header:
-                posts.append({
-                    "header": current_header,
-                    "body": "\n".join([p for p in current_body_parts if p]),
-                    "images": list(current_imgs),
-                    "id": current_id
-                })
+def save_thread(url: str, output: ThreadOutput, title_tag: str, posts: List[Post], op_ids: List[str],
+                page_classes: Iterable[str], twitter_screenshots: List[Tuple[str, bytes]],
+                metrics: UrlMetrics, make_thumbnails: bool, convert_webp: bool) -> Tuple[bool, str, int]:
+    """確保した出力先に posts.txt・画像などを保存する"""
+    from requests.exceptions import HTTPError
 
-    # 旧コード（参考用）:
-    # Pattern 3: Old oryouri.2chblog.jp format (dl/dt/dd structure)
-    if False and not posts:
-        # Look for dl > dt (header) and dd (body) pattern
-        dl_elements = soup.find_all('dl')
-        
-        for dl in dl_elements:
-            dt_elements = dl.find_all('dt', recursive=False)
-            dd_elements = dl.find_all('dd', recursive=False)
-            
-            # Process dt/dd pairs
-            for dt in dt_elements:
-                header_text = dt.get_text(strip=True)
-                
-                # Check if this looks like a response header
-                if header_text and re.match(r'^\d+:', header_text):
-                    parsed = parse_response_header(header_text)
-                    
-                    # Find corresponding dd (next sibling)
-                    dd = dt.find_next_sibling('dd')
-                    
-                    body_parts = []
-                    imgs = []
-                    
-                    if dd:
-                        # Collect images
-                        for img in dd.find_all("img"):
-                            imgs.append(img)
-                        
-                        # Collect text
-                        body_text = clean_text_from_images(dd)
-                        if body_text:
-                            body_parts.append(body_text)
-                    
-                    posts.append({
-                        "header": header_text,
-                        "body": "\n".join(body_parts),
-                        "images": imgs,
-                        "id": parsed["id"]
-                    })
+    folder = output.location
 
     if not posts:
         # デバッグ情報をファイルに保存
-        debug_log_path = os.path.join(folder, "debug_log.txt")
-        with open(debug_log_path, "w", encoding="utf-8") as f:
-            f.write(f"URL: {url}\n")
-            f.write(f"Title: {title_tag}\n\n")
-            f.write("Available classes in page (first 50):\n")
-            all_classes = []
-            for elem in soup.find_all(class_=True):
-                for cls in elem.get('class', []):
-                    if cls not in all_classes:
-                        all_classes.append(cls)
-            f.write("\n".join(all_classes[:50]))
-        
-        post_path = os.path.join(folder, "posts.txt")
-        with open(post_path, "w", encoding="utf-8") as f:
-            f.write("Could not extract thread structure from this page.")
+        debug_log = (f"URL: {url}\n"
+                     f"Title: {title_tag}\n\n"
+                     "Available classes in page (first 50):\n"
+                     + "\n".join(page_classes))
+        output.write_bytes("debug_log.txt", debug_log.encode("utf-8"))
+        output.write_bytes("posts.txt", "Could not extract thread structure from this page.".encode("utf-8"))
+        metrics.finish("no_posts")
         return True, f"[WARN] No thread structure: {url} -> {folder} (see debug_log.txt for details)", 0
 
-    first_post_id = posts[0]["id"] if posts else None
-    op_ids = detect_thread_creator_ids(soup, first_post_id)
-
     image_counter = 1
     image_mapping = {}
     downloaded_image_ids = set()  # Track downloaded images by ID to avoid duplicates
@@ -608,218 +701,373 @@ def scrape_single_url_js(url: str, result_root: str, browser) -> Tuple[bool, str
     twitter_image_files = []
     for i, (embed_type, screenshot_bytes) in enumerate(twitter_screenshots, 1):
         filename = f"画像{image_counter}.png"
-        filepath = os.path.join(img_folder, filename)
         try:
-            with open(filepath, "wb") as f:
-                f.write(screenshot_bytes)
+            with metrics.stage("write"):
+                output.write_bytes(f"images/{filename}", screenshot_bytes)
             twitter_image_files.append(filename)
             image_counter += 1
         except Exception:
             pass
     
-    def get_image_id_from_url(url: str) -> str:
-        """Extract image ID from URL for duplicate checking"""
-        import re
-        # Handle various image URL formats:
-        # - imgur: /nKqZYrk.jpg, /nKqZYrk-640x480.jpg, /nKqZYrk-scaled.jpg
-        # - livedoor: /9df4f32a.jpg, /9df4f32a-s.jpg (thumbnail)
-        # - tabinolog: /filename-640x480.jpg, /filename-scaled.jpg
-        match = re.search(r'/([a-zA-Z0-9]{7,})(?:-[a-z0-9]+)?\.(?:jpg|jpeg|png|gif|webp)', url, re.IGNORECASE)
-        if match:
-            return match.group(1).lower()
-        return url.split('?')[0].lower()
-    
     # Download images with 404 fallback logic
     # Strategy: For each post, try local first, if 404 then try imgur
     image_mapping = {}
+    # サムネイル/WebP生成はプロセスプールで並行実行（ダウンロードは待たない）
+    postprocessor = ImagePostprocessor(output, make_thumbnails=make_thumbnails, convert_webp=convert_webp)
     
-    for post_idx, post in enumerate(posts):
-        # Separate local and imgur images for this post
-        local_imgs = []
-        imgur_imgs = []
+    # 投稿ごとに画像を取得し、確定した投稿から posts.txt / posts.jsonl に書き出す
+    writer = PostsWriter(output, url, title_tag, op_ids, twitter_image_files)
+    debug = logger.isEnabledFor(logging.DEBUG)
+    try:
+        for post_idx, post in enumerate(posts):
+            # Separate local and imgur images for this post
+            local_imgs = []
+            imgur_imgs = []
         
-        # デバッグ: 最初の数レスのみ
-        if post_idx < 3:
-            print(f"[DEBUG] Processing post {post_idx+1}: {len(post['images'])} images in post['images']")
+            # デバッグ: 最初の数レスのみ
+            if debug and post_idx < 3:
+                logger.debug("Processing post %d: %d images in post.images", post_idx + 1, len(post.images))
         
-        for img_data in post["images"]:
-            if isinstance(img_data, tuple) and len(img_data) == 3:
-                img_type, src, img_element = img_data
-                # URL解決のデバッグログ
-                if src:
-                    original_src = src
-                    full_url = urljoin(url, src)
-                    # デバッグ: URL解決の確認（最初の数件のみ）
-                    if post_idx < 3 and len(local_imgs) + len(imgur_imgs) < 3:
-                        print(f"[DEBUG] Image URL resolution: '{original_src}' -> '{full_url}'")
+            for image in post.images:
+                full_url = urljoin(url, image.url)
+                # デバッグ: URL解決の確認（最初の数件のみ）
+                if debug and post_idx < 3 and len(local_imgs) + len(imgur_imgs) < 3:
+                    logger.debug("Image URL resolution: '%s' -> '%s'", image.url, full_url)
+            
+                # Categorize by source
+                if "imgur" in full_url.lower():
+                    imgur_imgs.append((full_url, image))
                 else:
-                    full_url = None
-                
-                if full_url:
-                    # Categorize by source
-                    if "imgur" in full_url.lower():
-                        imgur_imgs.append((img_type, full_url, img_element))
-                    else:
-                        local_imgs.append((img_type, full_url, img_element))
+                    local_imgs.append((full_url, image))
         
-        # デバッグ: 最初の数レスのみ
-        if post_idx < 3:
-            print(f"[DEBUG] Post {post_idx+1}: {len(local_imgs)} local images, {len(imgur_imgs)} imgur images")
+            # デバッグ: 最初の数レスのみ
+            if debug and post_idx < 3:
+                logger.debug("Post %d: %d local images, %d imgur images", post_idx + 1, len(local_imgs), len(imgur_imgs))
         
-        # Process each local image with imgur fallback
-        max_imgs = max(len(local_imgs), len(imgur_imgs))
+            # Process each local image with imgur fallback
+            max_imgs = max(len(local_imgs), len(imgur_imgs))
         
-        for i in range(max_imgs):
-            local_img = local_imgs[i] if i < len(local_imgs) else None
-            imgur_img = imgur_imgs[i] if i < len(imgur_imgs) else None
+            for i in range(max_imgs):
+                local_img = local_imgs[i] if i < len(local_imgs) else None
+                imgur_img = imgur_imgs[i] if i < len(imgur_imgs) else None
             
-            downloaded = False
+                downloaded = False
+                attempted = False
             
-            # Try local first
-            if local_img:
-                img_type, full_url, img_element = local_img
-                img_id = get_image_id_from_url(full_url)
+                # Try local first
+                if local_img:
+                    full_url, image = local_img
+                    img_id = get_image_id_from_url(full_url)
                 
-                if img_id not in downloaded_image_ids:
-                    # Skip ads (親要素情報がないため、img_elementから親を取得)
-                    parent_for_ad_check = img_element.parent if hasattr(img_element, 'parent') else None
-                    if not (img_type == "img" and is_ad_image(full_url, img_element, parent_for_ad_check)):
-                        ext = os.path.splitext(full_url.split("?")[0])[1].lower()
-                        if ext not in [".jpg", ".jpeg", ".png", ".gif", ".webp"]:
-                            ext = ".jpg"
-                        
-                        filename = f"画像{image_counter}{ext}"
-                        filepath = os.path.join(img_folder, filename)
-                        
-                        try:
-                            resp = session.get(full_url, timeout=TIMEOUT)
-                            resp.raise_for_status()
-                            with open(filepath, "wb") as f:
-                                f.write(resp.content)
+                    if img_id not in downloaded_image_ids:
+                        # Skip ads (抽出時にコピーした属性で判定)
+                        if not (image.type == "img" and is_ad_image_ref(full_url, image)):
+                            attempted = True
+                            try:
+                                with metrics.stage("download"):
+                                    data, ext = download_image(full_url)
+                                filename = f"画像{image_counter}{ext}"
+                                with metrics.stage("write"):
+                                    output.write_bytes(f"images/{filename}", data)
+                                metrics.add_download(len(data), full_url)
+                                postprocessor.submit(filename, data)
                             
+                                image_mapping[full_url] = filename
+                                downloaded_image_ids.add(img_id)
+                                image_counter += 1
+                                downloaded = True
+                            except HTTPError as e:
+                                # 404エラーなどのHTTPエラーをログに記録（最初の数件のみ）
+                                if debug and image_counter <= 3:
+                                    logger.debug("Failed to download local image (HTTP %s): %s", e.response.status_code, full_url)
+                            except InvalidImageError as e:
+                                # HTMLのエラーページや途中で切れたファイル → imgurフォールバックへ
+                                if debug and image_counter <= 3:
+                                    logger.debug("Rejected local image (%s): %s", e, full_url)
+                            except Exception as e:
+                                # その他のエラーをログに記録（最初の数件のみ）
+                                if debug and image_counter <= 3:
+                                    logger.debug("Failed to download local image: %s - %s", full_url, type(e).__name__)
+                                pass  # Local failed, will try imgur fallback
+            
+                # If local failed or doesn't exist, try imgur
+                if not downloaded and imgur_img:
+                    full_url, image = imgur_img
+                    img_id = get_image_id_from_url(full_url)
+                
+                    if img_id not in downloaded_image_ids:
+                        if local_img:
+                            metrics.download_retries += 1
+                        attempted = True
+                        try:
+                            with metrics.stage("download"):
+                                data, ext = download_image(full_url)
+                            filename = f"画像{image_counter}{ext}"
+                            with metrics.stage("write"):
+                                output.write_bytes(f"images/{filename}", data)
+                            metrics.add_download(len(data), full_url)
+                            postprocessor.submit(filename, data)
+                        
                             image_mapping[full_url] = filename
                             downloaded_image_ids.add(img_id)
                             image_counter += 1
                             downloaded = True
-                        except requests.exceptions.HTTPError as e:
+                        except HTTPError as e:
                             # 404エラーなどのHTTPエラーをログに記録（最初の数件のみ）
-                            if image_counter <= 3:
-                                print(f"[DEBUG] Failed to download local image (HTTP {e.response.status_code}): {full_url}")
+                            if debug and image_counter <= 3:
+                                logger.debug("Failed to download imgur image (HTTP %s): %s", e.response.status_code, full_url)
+                        except InvalidImageError as e:
+                            if debug and image_counter <= 3:
+                                logger.debug("Rejected imgur image (%s): %s", e, full_url)
                         except Exception as e:
                             # その他のエラーをログに記録（最初の数件のみ）
-                            if image_counter <= 3:
-                                print(f"[DEBUG] Failed to download local image: {full_url} - {type(e).__name__}")
-                            pass  # Local failed, will try imgur fallback
-            
-            # If local failed or doesn't exist, try imgur
-            if not downloaded and imgur_img:
-                img_type, full_url, img_element = imgur_img
-                img_id = get_image_id_from_url(full_url)
-                
-                if img_id not in downloaded_image_ids:
-                    ext = os.path.splitext(full_url.split("?")[0])[1].lower()
-                    if ext not in [".jpg", ".jpeg", ".png", ".gif", ".webp"]:
-                        ext = ".jpg"
-                    
-                    filename = f"画像{image_counter}{ext}"
-                    filepath = os.path.join(img_folder, filename)
-                    
-                    try:
-                        resp = session.get(full_url, timeout=TIMEOUT)
-                        resp.raise_for_status()
-                        with open(filepath, "wb") as f:
-                            f.write(resp.content)
-                        
-                        image_mapping[full_url] = filename
-                        downloaded_image_ids.add(img_id)
-                        image_counter += 1
-                    except requests.exceptions.HTTPError as e:
-                        # 404エラーなどのHTTPエラーをログに記録（最初の数件のみ）
-                        if image_counter <= 3:
-                            print(f"[DEBUG] Failed to download imgur image (HTTP {e.response.status_code}): {full_url}")
-                    except Exception as e:
-                        # その他のエラーをログに記録（最初の数件のみ）
-                        if image_counter <= 3:
-                            print(f"[DEBUG] Failed to download imgur image: {full_url} - {type(e).__name__}")
-                        pass  # Both failed, skip this image
+                            if debug and image_counter <= 3:
+                                logger.debug("Failed to download imgur image: %s - %s", full_url, type(e).__name__)
+                            pass  # Both failed, skip this image
 
+                if attempted and not downloaded:
+                    metrics.images_failed += 1
 
+            # この投稿の画像ファイル名を確定して書き出す
+            post_images = []
+            for image in post.images:
+                full_url = urljoin(url, image.url)
+                if full_url in image_mapping:
+                    post_images.append({"file": image_mapping[full_url], "url": full_url})
 
-    lines = []
-    
-    lines.append(title_tag)
-    for op_id in op_ids:
-        lines.append(f"ID:{op_id}")
-    lines.append("")
-    
-    # Add Twitter/X embed screenshots at the beginning
-    if twitter_image_files:
-        lines.append("=== X（Twitter）投稿 ===")
-        for twitter_img in twitter_image_files:
-            lines.append(twitter_img)
-        lines.append("")
-    
-    for post in posts:
-        lines.append(post["header"])
-        
-        for img_data in post["images"]:
-            # img_data is tuple: (type, url, element)
-            if isinstance(img_data, tuple) and len(img_data) == 3:
-                img_type, src, img_element = img_data
-                full_url = urljoin(url, src) if src else None
-            else:
-                # Fallback
-                src = extract_img_src(img_data) if hasattr(img_data, 'get') else None
-                full_url = urljoin(url, src) if src else None
-            
-            if full_url and full_url in image_mapping:
-                lines.append(image_mapping[full_url])
-        
-        if post["body"]:
-            lines.append(post["body"])
-        
-        lines.append("")
+            with metrics.stage("write"):
+                writer.write_post(parse_response_header(post.header), post.header,
+                                  post.body, post_images, post.id)
+    finally:
+        writer.close()
 
-    post_path = os.path.join(folder, "posts.txt")
-    with open(post_path, "w", encoding="utf-8") as f:
-        f.write("\n".join(lines))
+    with metrics.stage("write"):
+        postprocessor.finish()
+    metrics.rss.sample("download")
+    logger.info("Memory for %s: %s", url, metrics.rss.summary())
 
     image_count = image_counter - 1
+    metrics.finish("ok")
     return True, f"[OK] {url} -> {folder} (Posts: {len(posts)}, Images: {image_count}, OP IDs: {len(op_ids)})", image_count
 
 
-def main():
+# main() の終了コード
+EXIT_OK = 0            # すべてのURLで画像を取得できた
+EXIT_URL_FAILED = 1    # 画像を取得できなかった（またはエラーになった）URLがある
+EXIT_NO_INPUT = 2      # URLリストがない、またはURLが1件もない
+EXIT_ERROR = 3         # 予期しないエラーで中断した
+
+# 複数ページのスレッドで同時に読み込むページ数
+PAGE_CONCURRENCY = 4
+
+# --worker で処理待ちのジョブがないときの待ち時間（秒）
+WORKER_POLL_SECONDS = 2
+
+# --worker でジョブを完了とする結果（投稿が見つからないページは取り直しても同じなので再試行しない）
+DONE_STATUSES = ("ok", "no_posts")
+
+# --jsonl の結果行に含める項目（UrlMetrics.to_dict() のキー）
+RESULT_LINE_FIELDS = (
+    "url", "status", "error", "folder", "pattern", "scroll", "posts", "images_found",
+    "images_downloaded", "images_failed", "bytes_downloaded", "total_seconds", "stages",
+)
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """コマンドライン引数（引数なしでの実行＝EXEのダブルクリックでも従来どおり動作）"""
+    parser = argparse.ArgumentParser(description="画像一括取得システム")
+    parser.add_argument("--input", metavar="FILE",
+                        help="URLリスト（- で標準入力）。1行ずつ読みながら処理する。省略時はカレントフォルダの urls.txt")
+    parser.add_argument("--output-dir", metavar="DIR",
+                        help="出力先フォルダ（既定: カレントフォルダの result_js）")
+    parser.add_argument("--sink", choices=SINK_TYPES, default=default_sink_type(),
+                        help="保存形式: dir（フォルダ）/ zip・tar（スレッドごとに1ファイル）/ sqlite（results.sqlite3）"
+                             "（既定: 環境変数 OUTPUT_SINK、未設定なら dir）")
+    parser.add_argument("--jsonl", action="store_true",
+                        help="URLの処理が終わるたびに結果を1行のJSONで標準出力に書き出す（案内表示は標準エラー出力へ）")
+    parser.add_argument("--no-pause", action="store_true",
+                        help="終了時に Enter の入力を待たない（--input / --jsonl 指定時や、標準入力が端末でない場合も待たない）")
+    queue = parser.add_argument_group("ジョブキュー（複数ワーカーでの分散処理）")
+    queue.add_argument("--queue", metavar="DB", default=None,
+                       help=f"ジョブキューのSQLiteファイル（既定: 環境変数 JOB_QUEUE_DB または {DEFAULT_DB_PATH}）")
+    mode = queue.add_mutually_exclusive_group()
+    mode.add_argument("--enqueue", action="store_true",
+                      help="URLリストをキューに登録し、batch ID を標準出力に書き出して終了")
+    mode.add_argument("--worker", action="store_true",
+                      help="キューからURLを取り出して処理するワーカーとして動作")
+    mode.add_argument("--collect", metavar="BATCH",
+                      help="batch の各URLの状態と結果を1行1レコードのJSONで標準出力に書き出す")
+    queue.add_argument("--wait", action="store_true",
+                       help="--collect で、batch のすべてのURLが完了または失敗するまで待つ")
+    queue.add_argument("--max-attempts", type=int, default=DEFAULT_MAX_ATTEMPTS,
+                       help=f"--enqueue で登録するジョブの最大試行回数（既定: {DEFAULT_MAX_ATTEMPTS}）")
+    queue.add_argument("--lease", type=float, default=DEFAULT_LEASE_SECONDS, metavar="SECONDS",
+                       help=f"--worker のリース期間（既定: {DEFAULT_LEASE_SECONDS}秒。処理中は自動で延長）")
+    queue.add_argument("--exit-when-idle", action="store_true",
+                       help="--worker で、処理待ちのジョブがなくなったら終了する")
+    parser.add_argument("--browser-profile-dir", metavar="DIR", default=default_profile_dir(),
+                        help="ブラウザプロファイル（ディスクキャッシュ・Cookie。全ホストで共有）を保存して次回も使う"
+                             "フォルダ（既定: 環境変数 BROWSER_PROFILE_DIR、未設定なら実行中のみメモリ上で共有）")
+    parser.add_argument("--scroll", choices=SCROLL_MODES, default=default_scroll_mode(),
+                        help="Lazy Load 用のスクロール。auto は画像のURLが最初のDOMにそろっていれば省略する"
+                             "（既定: 環境変数 SCROLL_MODE、未設定なら auto）")
+    parser.add_argument("--dom-extract", action="store_true", default=default_dom_extract(),
+                        help="対応パターンのページはスレッド部分だけをブラウザ内で切り出して解析する"
+                             "（既定: 環境変数 DOM_EXTRACT）")
+    parser.add_argument("--light-variant", action="store_true", default=default_light_variant(),
+                        help="軽い表示（スマホ版など）が登録されたサイトはそちらを先に取得する"
+                             "（既定: 環境変数 LIGHT_VARIANT）")
+    parser.add_argument("--max-pages", type=int, default=None, metavar="N",
+                        help="複数ページに分かれたスレッドで取得する最大ページ数（1 で1ページ目のみ。"
+                             f"既定: 環境変数 MAX_THREAD_PAGES、未設定なら {DEFAULT_MAX_PAGES}）")
+    parser.add_argument("--parse-workers", type=int, metavar="N",
+                        help="HTMLの解析・抽出を行うプロセス数（0 でこのプロセスで解析。既定: 環境変数 PARSE_WORKERS、"
+                             "未設定なら 0）")
+    parser.add_argument("--profile", action="store_true",
+                        help="URLごとに cProfile / tracemalloc で計測し、結果フォルダに profile.prof と profile_alloc.txt を出力")
+    parser.add_argument("--profile-top", type=int, default=DEFAULT_TOP_N, metavar="N",
+                        help=f"profile_alloc.txt に出す上位件数（既定: {DEFAULT_TOP_N}）")
+    return parser.parse_args(argv)
+
+
+def should_pause(args: argparse.Namespace) -> bool:
+    """終了時に Enter を待つか（ダブルクリックで起動したEXEのウィンドウがすぐ閉じないように）"""
+    if args.input or args.jsonl or args.no_pause or args.enqueue or args.worker or args.collect:
+        return False
+    return sys.stdin is not None and sys.stdin.isatty()
+
+
+def iter_urls(lines: Iterable[str]) -> Iterator[str]:
+    """URLリストを1行ずつ読み、空行とコメント行（#）を除いて正規化したURLを返す（重複は最初の1件のみ）"""
+    return iter_unique_urls(url for url in (line.strip() for line in lines)
+                            if url and not url.startswith("#"))
+
+
+def result_line(metrics: UrlMetrics) -> str:
+    """--jsonl で出力する1URL分の結果"""
+    record = metrics.to_dict()
+    return json.dumps({key: record[key] for key in RESULT_LINE_FIELDS}, ensure_ascii=False)
+
+
+def open_url_source(input_path: Optional[str], root_dir: str, out) -> Optional[ContextManager[IO[str]]]:
+    """--input（省略時は urls.txt）を開く。ファイルがなければメッセージを出して None"""
+    if input_path == "-":
+        return contextlib.nullcontext(sys.stdin)
+    urls_file = input_path or os.path.join(root_dir, "urls.txt")
+    if not os.path.exists(urls_file):
+        if input_path:
+            print(f"Input file not found: {urls_file}", file=out)
+        else:
+            print("urls.txt not found. Please place it in the same folder as this script.", file=out)
+        return None
+    return open(urls_file, "r", encoding="utf-8")
+
+
+def open_job_queue(path: Optional[str]) -> JobQueue:
+    return JobQueue(path or os.environ.get("JOB_QUEUE_DB", DEFAULT_DB_PATH))
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    configure_logging()
+    # --jsonl / --enqueue / --collect では標準出力を結果専用にする
+    out = sys.stderr if (args.jsonl or args.enqueue or args.collect) else sys.stdout
     # バージョン情報を表示
-    print(f"=== 画像一括取得システム v{get_version()} ===")
-    print()
+    print(f"=== 画像一括取得システム v{get_version()} ===", file=out)
+    print(file=out)
     
+    if args.parse_workers is not None:
+        set_parse_workers(args.parse_workers)
+
     root_dir = os.getcwd()
-    urls_file = os.path.join(root_dir, "urls.txt")
-    result_root = os.path.join(root_dir, "result_js")
+    result_root = os.path.abspath(args.output_dir) if args.output_dir else os.path.join(root_dir, "result_js")
+
+    if args.collect:
+        return collect_batch(open_job_queue(args.queue), args.collect, args.wait)
 
     if not os.path.exists(result_root):
         os.makedirs(result_root, exist_ok=True)
 
-    if not os.path.exists(urls_file):
-        print("urls.txt not found. Please place it in the same folder as this script.")
-        return
+    if args.worker:
+        return run_worker(open_job_queue(args.queue), result_root, args)
+
+    source = open_url_source(args.input, root_dir, out)
+    if source is None:
+        return EXIT_NO_INPUT
+
+    if args.enqueue:
+        with source as lines:
+            urls = list(iter_urls(lines))
+        if not urls:
+            print("No URLs to enqueue.", file=out)
+            return EXIT_NO_INPUT
+        batch = open_job_queue(args.queue).enqueue(urls, max_attempts=args.max_attempts)
+        print(f"Enqueued {len(urls)} URL(s) as batch {batch}", file=out)
+        print(batch)
+        return EXIT_OK
+
+    # URLリストは読みながら処理する（パイプで渡された場合も、全部届く前に処理を始める）
+    with source as lines:
+        url_metrics, failed_urls = run_batch(iter_urls(lines), result_root, args)
 
-    with open(urls_file, "r", encoding="utf-8") as f:
-        urls = [line.strip() for line in f.readlines() if line.strip() and not line.startswith("#")]
+    if not url_metrics:
+        source_name = "standard input" if args.input == "-" else (args.input or "urls.txt")
+        print(f"No URLs found in {source_name}.", file=out)
+        return EXIT_NO_INPUT
+
+    # 段階ごとの所要時間などをJSONで記録（バッチ全体のパーセンタイル付き）
+    write_metrics_log(os.path.join(result_root, "metrics_js.json"), url_metrics)
+
+    print("\n=== Scraping completed ===", file=out)
+    print(f"Check result_js folder: {result_root}", file=out)
+    
+    # 画像が取得できなかったURLの情報を表示
+    if failed_urls:
+        print(f"\n=== {len(failed_urls)} URL(s) failed to get images ===", file=out)
+        print("These URLs may require a new extraction pattern.", file=out)
+        print("Please check the logs and consider adding a new pattern to extractors/", file=out)
+        for url in failed_urls:
+            print(f"  - {url}", file=out)
+        return EXIT_URL_FAILED
+    return EXIT_OK
 
-    if not urls:
-        print("No URLs found in urls.txt.")
-        return
 
-    logs = []
+def run_batch(urls: Iterable[str], result_root: str,
+              args: argparse.Namespace) -> Tuple[List[UrlMetrics], List[str]]:
+    """
+    URLを1件ずつ処理し、(URLごとのメトリクス, 画像を取得できなかったURL) を返す
+
+    log_js.txt はURLごとに追記する（途中で止まっても処理済みの分は残る）。
+    """
+    from playwright.sync_api import sync_playwright
+
     failed_urls = []  # 画像が取得できなかったURLを記録
+    url_metrics = []  # URLごとの処理メトリクス
 
-    with sync_playwright() as p:
-        browser = p.chromium.launch(headless=True)
+    with contextlib.ExitStack() as stack:
+        p = None
+        browser = None
+        log_file = None
+        sink = None
         for url in urls:
+            if browser is None:
+                # 最初のURLが届いてからブラウザを起動する
+                p = stack.enter_context(sync_playwright())
+                browser = HostContextPool(p.chromium, profile_dir=args.browser_profile_dir)
+                stack.callback(browser.close)
+                log_file = stack.enter_context(
+                    open(os.path.join(result_root, "log_js.txt"), "w", encoding="utf-8"))
+                sink = create_sink(args.sink, result_root)
+                stack.callback(sink.close)
+            metrics = UrlMetrics(url)
+            url_metrics.append(metrics)
             try:
-                print(f"Processing -> {url}")
-                result = scrape_single_url_js(url, result_root, browser)
+                logger.info("Processing -> %s", url)
+                with log_context(url=url), profile_url(args.profile, metrics, result_root, args.profile_top):
+                    result = scrape_single_url_js(url, result_root, browser, metrics=metrics,
+                                                  scroll_mode=args.scroll, dom_extract=args.dom_extract,
+                                                  max_pages=args.max_pages, light_variant=args.light_variant,
+                                                  sink=sink)
                 
                 # 戻り値の形式を確認（後方互換性のため）
                 if isinstance(result, tuple) and len(result) == 3:
@@ -830,43 +1078,124 @@ def main():
                     image_match = re.search(r'Images: (\d+)', msg)
                     image_count = int(image_match.group(1)) if image_match else 0
                 
-                logs.append(msg)
-                print(msg)
+                logger.info("%s", msg)
                 
                 # 画像が0枚の場合、フォールバック対象として記録
                 if image_count == 0:
                     failed_urls.append(url)
-                    print(f"[WARN] No images found for {url}, will try fallback script")
+                    logger.warning("No images found for %s, will try fallback script", url)
             except Exception as e:
-                error_msg = f"[ERROR] Unexpected error: {url}\n{str(e)}"
-                logs.append(error_msg)
-                print(error_msg)
+                msg = f"[ERROR] Unexpected error: {url}\n{str(e)}"
+                metrics.finish("error", str(e))
+                logger.exception("Unexpected error: %s", url)
                 failed_urls.append(url)
-        browser.close()
 
-    log_path = os.path.join(result_root, "log_js.txt")
-    with open(log_path, "w", encoding="utf-8") as f:
-        f.write("\n".join(logs))
+            log_file.write(msg + "\n")
+            log_file.flush()
+            if args.jsonl:
+                print(result_line(metrics), flush=True)
 
-    print("\n=== Scraping completed ===")
-    print(f"Check result_js folder: {result_root}")
-    
-    # 画像が取得できなかったURLの情報を表示
-    if failed_urls:
-        print(f"\n=== {len(failed_urls)} URL(s) failed to get images ===")
-        print("These URLs may require a new extraction pattern.")
-        print("Please check the logs and consider adding a new pattern to extractors/")
-        for url in failed_urls:
-            print(f"  - {url}")
+    return url_metrics, failed_urls
+
+
+def run_worker(queue: JobQueue, result_root: str, args: argparse.Namespace) -> int:
+    """
+    キューからURLを1件ずつ取り出して処理する
+
+    処理中はハートビートでリースを延長する。エラーになったURLはキューに戻し
+    （最大試行回数まで）、Ctrl+C で止めた場合は処理中のURLを試行回数を数えずに戻す。
+    """
+    from playwright.sync_api import sync_playwright
+
+    worker_id = default_worker_id()
+    processed = 0
+    logger.info("Worker %s started (queue: %s)", worker_id, queue.path)
+    with contextlib.ExitStack() as stack:
+        browser = None
+        while True:
+            job = queue.claim(worker_id, args.lease)
+            if job is None:
+                if args.exit_when_idle:
+                    break
+                time.sleep(WORKER_POLL_SECONDS)
+                continue
+            if browser is None:
+                p = stack.enter_context(sync_playwright())
+                browser = HostContextPool(p.chromium, profile_dir=args.browser_profile_dir)
+                stack.callback(browser.close)
+                sink = create_sink(args.sink, result_root)
+                stack.callback(sink.close)
+
+            metrics = UrlMetrics(job.url)
+            logger.info("Processing job %d (attempt %d/%d) -> %s", job.id, job.attempts, job.max_attempts, job.url)
+            try:
+                with Heartbeat(queue, job, worker_id, args.lease), log_context(url=job.url, job=job.batch), \
+                        profile_url(args.profile, metrics, result_root, args.profile_top):
+                    scrape_single_url_js(
+                        job.url, result_root, browser,
+                        capture_twitter=bool(job.options.get("capture_twitter", True)),
+                        make_thumbnails=bool(job.options.get("thumbnails", False)),
+                        convert_webp=bool(job.options.get("webp", False)),
+                        metrics=metrics,
+                        scroll_mode=args.scroll,
+                        dom_extract=args.dom_extract,
+                        max_pages=args.max_pages,
+                        light_variant=args.light_variant,
+                        sink=sink,
+                    )
+            except KeyboardInterrupt:
+                queue.release(job.id, worker_id)
+                logger.info("Interrupted; job %d returned to the queue", job.id)
+                raise
+            except Exception as e:
+                metrics.finish("error", str(e))
+                logger.exception("Unexpected error: %s", job.url)
+
+            processed += 1
+            if metrics.status in DONE_STATUSES:
+                queue.complete(job.id, worker_id, metrics.to_dict())
+            else:
+                state = queue.fail(job.id, worker_id, metrics.error or "unknown error", metrics.to_dict())
+                logger.warning("Job %d failed (%s), now %s", job.id, metrics.error, state)
+            if args.jsonl:
+                print(result_line(metrics), flush=True)
+
+    logger.info("Worker %s finished after %d job(s)", worker_id, processed)
+    return EXIT_OK
+
+
+def collect_batch(queue: JobQueue, batch: str, wait: bool) -> int:
+    """batch の各URLの状態と結果を標準出力に書き出す（wait なら全件が終わるまで待つ）"""
+    while True:
+        counts = queue.counts(batch)
+        if not wait or (counts["queued"] == 0 and counts["running"] == 0):
+            break
+        time.sleep(WORKER_POLL_SECONDS)
+    jobs = queue.jobs(batch)
+    if not jobs:
+        print(f"Batch not found: {batch}", file=sys.stderr)
+        return EXIT_NO_INPUT
+    for job in jobs:
+        print(json.dumps(job.to_dict(), ensure_ascii=False))
+    print(f"Batch {batch}: {counts}", file=sys.stderr)
+    return EXIT_URL_FAILED if counts["failed"] else EXIT_OK
 
 
 if __name__ == "__main__":
+    # EXE（PyInstaller）で解析・後処理用の子プロセスを起動できるようにする
+    import multiprocessing
+    multiprocessing.freeze_support()
+
+    cli_args = parse_args()
+    exit_code = EXIT_ERROR
     try:
-        main()
+        exit_code = main()
     except Exception as e:
-        print(f"\n=== エラーが発生しました ===")
-        print(f"エラー内容: {e}")
+        print(f"\n=== エラーが発生しました ===", file=sys.stderr)
+        print(f"エラー内容: {e}", file=sys.stderr)
         import traceback
         traceback.print_exc()
     finally:
-        input("\nEnterキーを押して終了してください...")
+        if should_pause(cli_args):
+            input("\nEnterキーを押して終了してください...")
+    sys.exit(exit_code)